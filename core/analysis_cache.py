@@ -0,0 +1,66 @@
+# core/analysis_cache.py
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, List, Optional, Tuple
+
+from . import json_utils
+
+logger = logging.getLogger("analysis_cache")
+
+class AnalysisCache:
+    """
+    SQLite-backed key/value store for JSON-serializable analysis results, kept across batch runs
+    so an interrupted run only redoes the analyses it had not finished.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        # Document-level embeddings for near-duplicate detection, per embedding model
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_embeddings (doc_hash TEXT NOT NULL, model TEXT NOT NULL, embedding TEXT NOT NULL, "
+            "PRIMARY KEY (doc_hash, model))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        logger.info(f"Analysis cache opened at '{db_path}'.")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json_utils.loads(row[0])
+        except ValueError:
+            logger.warning(f"Ignoring unreadable analysis cache entry '{key}'.")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        payload = json_utils.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, value, created_at) VALUES (?, ?, ?)", (key, payload, time.time())
+            )
+            self._conn.commit() # Commit per entry so a crash keeps everything finished so far
+
+    def get_document_embeddings(self, model: str) -> List[Tuple[str, List[float]]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_hash, embedding FROM document_embeddings WHERE model = ?", (model,)).fetchall()
+        return [(doc_hash, json_utils.loads(embedding)) for doc_hash, embedding in rows]
+
+    def set_document_embedding(self, doc_hash: str, model: str, embedding: List[float]) -> None:
+        payload = json_utils.dumps(embedding)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO document_embeddings (doc_hash, model, embedding) VALUES (?, ?, ?)", (doc_hash, model, payload)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
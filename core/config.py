@@ -24,16 +24,42 @@ class Settings(BaseSettings):
 
     # --- Retrieval Settings ---
     TOP_K_LOCAL: int = 8 # Number of chunks from local COEQWAL DB
+    LOCAL_SEARCH_CACHE_SIZE: int = 1024 # Max cached (query, top_k) local search results; 0 disables
 
     # --- OpenAI Vector Store/File Settings ---
     POLLING_INTERVAL_SECONDS: int = 1
+    MAX_POLLING_INTERVAL_SECONDS: float = 8.0 # Backoff cap for async vector store polling
     PROCESSING_TIMEOUT_SECONDS: int = 360 # 6 minutes timeout
 
     # --- Generation Settings (for responses.create) ---
     TEMPERATURE: float = 0.0
     MAX_OUTPUT_TOKENS: int = 1500 # Max tokens for LLM response generation
+    MULTI_FOCUS_MAX_OUTPUT_TOKENS: int = 16000 # Cap for answer_multi_focus (MAX_OUTPUT_TOKENS per analysis otherwise)
     MAX_NUM_RESULTS: int = 10 # Max results for file_search tool
+    MAX_CONCURRENT_OPENAI_REQUESTS: int = 16 # Upper bound on simultaneous responses.create/stream calls
+    MAX_CONCURRENT_UPLOADS: int = 4 # API uploads ingested (read into memory, uploaded, indexed) at once; the rest wait as 'pending'
+    BATCH_CONCURRENCY: int = 4 # Documents uploaded and analyzed at the same time by generate_analysis.py
+    # Keep generate_analysis.py's vector stores (expiring after this many idle days) so reruns skip re-uploading; 0 deletes them.
+    # The uploaded files do not expire with their store; a rerun that finds the store expired deletes the old file
+    BATCH_VECTOR_STORE_KEEP_DAYS: int = 0
+    # Account limits for generation calls; also adapts to x-ratelimit-* / retry-after headers (0 disables a budget)
+    OPENAI_REQUESTS_PER_MINUTE: int = 500
+    OPENAI_TOKENS_PER_MINUTE: int = 200000
+    RATE_LIMIT_MAX_RETRIES: int = 3 # Retries of a generation call's 429 after waiting out the server's retry-after hint
+    OPENAI_MAX_RETRIES: int = 5 # Retries (backoff + jitter) of transient errors: by the SDK, or by acall_rate_limited for generation calls
+    OPENAI_HTTP2: bool = True # Multiplex the async client's concurrent calls over one connection (needs the h2 package)
     
+    # --- Answer Cache (identical query + focus + document + local context) ---
+    ANSWER_CACHE_SIZE: int = 2048 # 0 disables
+    ANSWER_CACHE_TTL_SECONDS: int = 1800
+    # --- Session Query Cache (repeat questions in a session skip retrieval + prompt build) ---
+    SESSION_QUERY_CACHE_SIZE: int = 500 # 0 disables
+    SESSION_QUERY_CACHE_TTL_SECONDS: int = 3600
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95 # Cosine similarity for reusing an answer to a rephrased question; 0 disables
+    # --- Session Expiry (abandoned sessions are ended as if /end-session had been called) ---
+    SESSION_IDLE_TIMEOUT_SECONDS: int = 6 * 60 * 60 # No query / status poll for this long ends the session; 0 disables
+    SESSION_SWEEP_INTERVAL_SECONDS: int = 300
+
     SIMULATE_ANALYSIS: bool = True
 
     # Class configuration for Pydantic Settings
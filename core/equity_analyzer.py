@@ -1,33 +1,38 @@
 # core/equity_analyzer.py
 
 import os
-import json
+import copy
 import logging
-import shutil
-import tempfile
 import textwrap
-import time
 import asyncio
 
 from typing import Dict, Any, List, Optional, Tuple
-from openai import OpenAI
 
 try:
     from PyPDF2 import PdfReader
 except ImportError:
     logging.warning("PyPDF2 is not installed. PDF title extraction might be limited.")
     PdfReader = None
+try:
+    import pypdfium2 as pdfium # C-backed; much faster than PyPDF2 for metadata-only reads
+except ImportError:
+    pdfium = None
 
 from .config import settings
+from . import json_utils
+from .rate_limit import estimate_tokens
+from .pdf_metadata import read_pdf_title
 from .openai_interaction import OpenAIInteraction
-from .rag_system import HybridRAGSystem
+from .rag_system import HybridRAGSystem, UserSession
 
 logger = logging.getLogger("equity_analyzer")
 
 # --- Constants and JSON Skeleton (remain unchanged) ---
-FOCUS_AREAS = ["general", "vulnerable_groups", "severity_of_impact", "mitigation_strategies"]
+FOCUS_AREAS: Tuple[str, ...] = ("general", "vulnerable_groups", "severity_of_impact", "mitigation_strategies")
+EQUITY_DIMENSIONS: Tuple[str, ...] = ("recognitional", "procedural", "distributional", "structural")
 ANALYSIS_QUERY_GENERIC = "Provide an equity analysis of this document, focusing on: {focus_description}"
-DELAY_BETWEEN_REQUESTS_SECONDS = 5
+# Related raw analyses (the standard focus areas; each perspective) asked in one multi-focus request; 1 disables
+MULTI_FOCUS_BATCH_SIZE = 5
 PERSPECTIVES = [
     {
         "group_name": "Policy Makers",
@@ -60,6 +65,68 @@ PERSPECTIVES = [
         }
     }
 ]
+
+# raw_analyses key prefix per perspective group, e.g. "Policy Makers" -> "policy_makers"
+PERSPECTIVE_GROUP_KEYS: Dict[str, str] = {p["group_name"]: p["group_name"].replace(" ", "_").lower() for p in PERSPECTIVES}
+# (group name, ((raw_analyses key, perspective entry section), ...)) for source injection
+PERSPECTIVE_SOURCE_KEYS: Tuple[Tuple[str, Tuple[Tuple[str, str], ...]], ...] = tuple(
+    (group_name, ((f"perspective_{group_key}_general", "general_equity_assessment"),)
+                 + tuple((f"perspective_{group_key}_{dim}", f"{dim}_equity") for dim in EQUITY_DIMENSIONS))
+    for group_name, group_key in PERSPECTIVE_GROUP_KEYS.items()
+)
+
+
+# Query detail for each standard focus area
+FOCUS_DESCRIPTIONS = {
+    "general": "the overall equity implications, considering all relevant dimensions of the COEQWAL framework.",
+    "vulnerable_groups": "how vulnerable groups are affected or mentioned.",
+    "severity_of_impact": "the severity of the document's impacts on equity.",
+    "mitigation_strategies": "strategies or solutions for equity concerns."
+}
+
+def _build_analysis_jobs() -> List[Tuple[str, str, str, str]]:
+    """
+    Every raw analysis generated per document, as (raw_analyses key, query, focus_area used
+    for retrieval, label for logs). The same for every document, so built once at import.
+    """
+    # --- Standard FOCUS_AREAS ---
+    jobs = [
+        (focus, ANALYSIS_QUERY_GENERIC.format(focus_description=FOCUS_DESCRIPTIONS.get(focus, "equity implications.")), focus, f"standard focus '{focus}'")
+        for focus in FOCUS_AREAS
+    ]
+    # --- Each PERSPECTIVE ---
+    for perspective_info in PERSPECTIVES:
+        perspective_group_key = PERSPECTIVE_GROUP_KEYS[perspective_info["group_name"]]
+        # General Equity Assessment for this perspective (general focus for retrieval)
+        jobs.append((
+            f"perspective_{perspective_group_key}_general",
+            ANALYSIS_QUERY_GENERIC.format(focus_description=perspective_info['description']),
+            "general", f"perspective '{perspective_info['group_name']}' general analysis"
+        ))
+        # Individual Equity Dimensions for this perspective
+        for dim in EQUITY_DIMENSIONS:
+            prompt_description = perspective_info["dimensions"].get(dim)
+            if prompt_description:
+                jobs.append((
+                    f"perspective_{perspective_group_key}_{dim}",
+                    ANALYSIS_QUERY_GENERIC.format(focus_description=prompt_description),
+                    "general", f"perspective '{perspective_info['group_name']}' {dim} analysis"
+                ))
+    return jobs
+
+ANALYSIS_JOBS = _build_analysis_jobs()
+
+def batch_analysis_jobs(jobs: List[Tuple[str, str, str, str]]) -> List[List[Tuple[str, str, str, str]]]:
+    """Groups jobs that share a topic (standard focus areas, or one perspective) into batches of at most MULTI_FOCUS_BATCH_SIZE."""
+    groups: Dict[str, List[Tuple[str, str, str, str]]] = {}
+    for job in jobs:
+        key = job[0]
+        group = key.rsplit("_", 1)[0] if key.startswith("perspective_") else "standard"
+        groups.setdefault(group, []).append(job)
+    return [group_jobs[i:i + MULTI_FOCUS_BATCH_SIZE] for group_jobs in groups.values() for i in range(0, len(group_jobs), MULTI_FOCUS_BATCH_SIZE)]
+
+ANALYSIS_JOB_BATCHES = batch_analysis_jobs(ANALYSIS_JOBS)
+
 JSON_SKELETON = """
 {
   "document": {
@@ -128,14 +195,63 @@ JSON_SKELETON = """
 }
 """
 
+# Parsed once; error paths deep-copy it instead of re-parsing JSON_SKELETON
+_SKELETON_DICT: Dict[str, Any] = json_utils.loads(JSON_SKELETON)
+
+# Static formatter instructions + skeleton, sent as the system message ahead of the per-document raw analyses
+FORMATTER_SYSTEM_PROMPT = textwrap.dedent("""
+    You are an expert data structurer and equity analyst. Your task is to populate the provided JSON structure.
+    All generated content in the JSON must be derived **ONLY** from the raw analysis texts provided below.
+    Crucially, all summary, narrative, and description fields must use an **indicative, tentative, or suggestive tone**.
+    Avoid definitive or authoritative statements. Employ phrases like "This may indicate...", "It suggests that...",
+    "A potential interpretation is...", "It appears to...", "Could be seen as...", "There is an indication that...",
+    "The document seems to...", "It might imply...", etc.
+
+    **Instructions:**
+    1.  Carefully read all provided raw text analyses.
+    2.  Fill in every "..." placeholder in the JSON skeleton with **detailed and comprehensive** information synthesized from these analysis texts. Do not over-summarize; preserve key details and nuanced interpretations.
+    3.  Ensure all content strictly adheres to the schema and the required indicative tone.
+    4.  **DO NOT ADD ANY SOURCE INFORMATION OR CITATIONS TO THE TEXT FIELDS OR THE 'sources' ARRAYS.** The 'sources' arrays in the JSON skeleton will be populated separately by Python.
+    5.  Specifically for the `general_equity_assessment` within `analysis_sections`, break down the 'general' raw analysis into the sub-fields for each of the four equity dimensions (Recognitional, Procedural, Distributional, Structural). For each dimension, aim to identify both "positive_findings" and "concerns" if discernible, and provide a "conclusion". If information is not provided for a sub-field, use "Not explicitly indicated by the document." or similar indicative phrasing.
+    6.  For the `equity_analysis_by_perspective` array, create an entry for each perspective mentioned in the raw analyses (e.g., Policy Makers, Residents, Farmers/Business Owners). For each perspective entry:
+        *   Populate the `group` name (e.g., "Policy Makers").
+        *   Fill the `general_equity_assessment` (title and narrative) using the corresponding raw analysis text (e.g., the content for key `perspective_policymakers_general`). The title should reflect the group's perspective.
+        *   Fill the individual equity dimension descriptions (recognitional_equity, procedural_equity, distributional_equity, structural_equity) using the specific raw analysis texts for that dimension and group (e.g., the content for key `perspective_policymakers_recognitional`).
+    7.  Ensure the output is a single, valid JSON object and nothing else.
+
+    **JSON SKELETON TO POPULATE (Text fields only):**
+""") + JSON_SKELETON
+# Per-document user message; only the raw analyses are substituted at call time
+FORMATTER_INPUT_TEMPLATE = "**RAW TEXT ANALYSES TO USE:**\n{raw_analyses}"
+
+def _raw_analysis_header(key: str) -> str:
+    return f"\n--- RAW ANALYSIS TEXT FOR: {key.replace('_', ' ').upper()} ---\n"
+
+# Section header per raw analysis key, built once instead of per formatter call
+RAW_ANALYSIS_HEADERS: Dict[str, str] = {key: _raw_analysis_header(key) for key, _, _, _ in ANALYSIS_JOBS}
+
 # --- Helper Functions (remain unchanged) ---
 def get_pdf_title(file_path: str, default_filename: str) -> str:
     """Extracts title from PDF metadata or returns default filename."""
+    # Trailer-only scan first; it reads a few KB instead of parsing the PDF
+    title = read_pdf_title(file_path)
+    if title:
+        return title
+    if pdfium is not None:
+        try:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                title = (pdf.get_metadata_dict().get("Title") or "").strip()
+            finally:
+                pdf.close()
+            return title or default_filename
+        except Exception as e:
+            logger.warning(f"pypdfium2 could not read metadata from PDF '{file_path}': {e}")
     if PdfReader is None:
         logger.warning(f"PyPDF2 not installed. Title extraction for '{default_filename}' skipped.")
         return f"Title not extracted (PyPDF2 missing) - {default_filename}"
     try:
-        reader = PdfReader(file_path)
+        reader = PdfReader(file_path, strict=False) # Only the trailer/metadata is read; pages stay unparsed
         title = reader.metadata.get('/Title', default_filename)
         if not isinstance(title, str):
             title = str(title) if title else default_filename
@@ -144,6 +260,15 @@ def get_pdf_title(file_path: str, default_filename: str) -> str:
         logger.error(f"Could not read metadata from PDF '{file_path}': {e}")
         return default_filename
 
+def _write_json_file(output_file_path: str, data: Dict[str, Any]) -> None:
+    """Writes an analysis JSON file (blocking; call via asyncio.to_thread from async code)."""
+    # Encoded in one go (orjson when installed) and swapped in atomically, so readers never see a partial file
+    try:
+        json_utils.write_file(output_file_path, data, indent=True)
+    except FileNotFoundError: # The app creates the folder at startup; only recreate it if it has since vanished
+        os.makedirs(os.path.dirname(output_file_path) or ".", exist_ok=True)
+        json_utils.write_file(output_file_path, data, indent=True)
+
 def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: Dict[str, Dict[str, Any]]):
     """
     Helper function to inject raw openai_sources into the structured_data JSON.
@@ -151,6 +276,12 @@ def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: D
     This is done purely by Python after the LLM has filled the text fields.
     """
     
+    if not raw_analyses:
+        # Nothing to inject (the document failed before any analysis succeeded)
+        if "overall_summary_and_recommendations" in structured_data:
+            structured_data["overall_summary_and_recommendations"]["sources"] = []
+        return
+
     # Mapping from raw_analyses keys to structured_data paths for sources
     source_mappings = {
         # Standard Focus Areas
@@ -161,19 +292,18 @@ def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: D
     }
 
     # Add Perspective-Based mappings
-    for perspective_info in PERSPECTIVES:
-        group_key = perspective_info["group_name"].replace(" ", "_").lower()
-        
+    # Index the perspective entries by group once instead of scanning the list per perspective
+    entries_by_group = {item.get("group"): item for item in structured_data["equity_analysis_by_perspective"]}
+    for group_name, section_keys in PERSPECTIVE_SOURCE_KEYS:
         # Find the correct perspective entry in structured_data
         # This assumes the LLM successfully created the perspective entries.
-        perspective_entry = next((item for item in structured_data["equity_analysis_by_perspective"] if item.get("group") == perspective_info["group_name"]), None)
+        perspective_entry = entries_by_group.get(group_name)
         
         if perspective_entry:
-            source_mappings[f"perspective_{group_key}_general"] = perspective_entry["general_equity_assessment"]
-            for dim in ["recognitional", "procedural", "distributional", "structural"]:
-                source_mappings[f"perspective_{group_key}_{dim}"] = perspective_entry[f"{dim}_equity"]
+            for key, section in section_keys:
+                source_mappings[key] = perspective_entry[section]
         else:
-            logger.warning(f"Could not find perspective entry for '{perspective_info['group_name']}' in structured_data. Sources for this perspective will not be added.")
+            logger.debug(f"Could not find perspective entry for '{group_name}' in structured_data. Sources for this perspective will not be added.")
 
     # Populate sources for each mapped section
     for key, target_section in source_mappings.items():
@@ -181,29 +311,23 @@ def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: D
             # ONLY include openai_sources as per requirement
             raw_openai_sources = raw_analyses[key].get("openai_sources", [])
             
-            # Create the list of source objects, only for OpenAI type
-            combined_sources = []
-            for openai_source_str in raw_openai_sources:
-                combined_sources.append({"type": "openai", "data": openai_source_str})
-            
-            # Assign to the target section's "sources" field
-            target_section["sources"] = combined_sources
+            # Create the list of source objects, only for OpenAI type, and assign to the target section's "sources" field
+            target_section["sources"] = [{"type": "openai", "data": openai_source_str} for openai_source_str in raw_openai_sources]
         else:
             logger.debug(f"Raw analysis key '{key}' not found, skipping source injection for corresponding section.")
 
     # Handle overall_summary_and_recommendations sources
     # For simplicity, copy sources from the main general_equity_assessment if it exists.
     if "overall_summary_and_recommendations" in structured_data and "general" in raw_analyses:
-        main_general_openai_sources = []
-        for openai_source_str in raw_analyses["general"].get("openai_sources", []):
-            main_general_openai_sources.append({"type": "openai", "data": openai_source_str})
-        structured_data["overall_summary_and_recommendations"]["sources"] = main_general_openai_sources
+        structured_data["overall_summary_and_recommendations"]["sources"] = [
+            {"type": "openai", "data": openai_source_str} for openai_source_str in raw_analyses["general"].get("openai_sources", [])
+        ]
     else:
         structured_data["overall_summary_and_recommendations"]["sources"] = [] # Ensure it's an empty list if no sources.
 
 
-def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename: str, title: str,
-                              file_size_kb: int, upload_date_utc: str, client: OpenAI) -> Optional[Dict[str, Any]]:
+async def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename: str, title: str,
+                                    file_size_kb: int, upload_date_utc: str, openai_interface: OpenAIInteraction) -> Optional[Dict[str, Any]]:
     """
     Synthesizes raw text analyses into the final structured JSON format.
     Sources are inserted *after* LLM generation, purely by Python.
@@ -213,7 +337,7 @@ def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename:
     # Check for any failures in raw analysis generation from the `raw_analyses` dict
     if any("ANALYSIS FAILED" in raw_analysis.get("text", "") for raw_analysis in raw_analyses.values()):
         logger.error("Skipping full JSON formatting due to failure in raw analysis generation for one or more sections.")
-        error_json = json.loads(JSON_SKELETON)
+        error_json = copy.deepcopy(_SKELETON_DICT)
         error_json["document"]["filename"] = filename
         error_json["document"]["title"] = title
         error_json["document"]["size_kb"] = file_size_kb
@@ -228,49 +352,33 @@ def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename:
 
 
     # Dynamically build the raw analyses string (text only) to include in the prompt for the formatter LLM
-    raw_analyses_text_str = ""
-    for k, v in raw_analyses.items():
-        raw_analyses_text_str += f"\n--- RAW ANALYSIS TEXT FOR: {k.replace('_', ' ').upper()} ---\n{v.get('text', 'Not provided.')}\n"
+    # Joined in one pass rather than grown with += (which recopies the accumulated text per section)
+    raw_analyses_text_str = "".join(
+        f"{RAW_ANALYSIS_HEADERS.get(k) or _raw_analysis_header(k)}{v.get('text', 'Not provided.')}\n" for k, v in raw_analyses.items()
+    )
 
-    formatter_prompt = textwrap.dedent(f"""
-    You are an expert data structurer and equity analyst. Your task is to populate the provided JSON structure.
-    All generated content in the JSON must be derived **ONLY** from the raw analysis texts provided below.
-    Crucially, all summary, narrative, and description fields must use an **indicative, tentative, or suggestive tone**.
-    Avoid definitive or authoritative statements. Employ phrases like "This may indicate...", "It suggests that...",
-    "A potential interpretation is...", "It appears to...", "Could be seen as...", "There is an indication that...",
-    "The document seems to...", "It might imply...", etc.
-
-    **Instructions:**
-    1.  Carefully read all provided raw text analyses.
-    2.  Fill in every "..." placeholder in the JSON skeleton with **detailed and comprehensive** information synthesized from these analysis texts. Do not over-summarize; preserve key details and nuanced interpretations.
-    3.  Ensure all content strictly adheres to the schema and the required indicative tone.
-    4.  **DO NOT ADD ANY SOURCE INFORMATION OR CITATIONS TO THE TEXT FIELDS OR THE 'sources' ARRAYS.** The 'sources' arrays in the JSON skeleton will be populated separately by Python.
-    5.  Specifically for the `general_equity_assessment` within `analysis_sections`, break down the 'general' raw analysis into the sub-fields for each of the four equity dimensions (Recognitional, Procedural, Distributional, Structural). For each dimension, aim to identify both "positive_findings" and "concerns" if discernible, and provide a "conclusion". If information is not provided for a sub-field, use "Not explicitly indicated by the document." or similar indicative phrasing.
-    6.  For the `equity_analysis_by_perspective` array, create an entry for each perspective mentioned in the raw analyses (e.g., Policy Makers, Residents, Farmers/Business Owners). For each perspective entry:
-        *   Populate the `group` name (e.g., "Policy Makers").
-        *   Fill the `general_equity_assessment` (title and narrative) using the corresponding raw analysis text (e.g., the content for key `perspective_policymakers_general`). The title should reflect the group's perspective.
-        *   Fill the individual equity dimension descriptions (recognitional_equity, procedural_equity, distributional_equity, structural_equity) using the specific raw analysis texts for that dimension and group (e.g., the content for key `perspective_policymakers_recognitional`).
-    7.  Ensure the output is a single, valid JSON object and nothing else.
-
-    **JSON SKELETON TO POPULATE (Text fields only):**
-    {JSON_SKELETON}
-
-    **RAW TEXT ANALYSES TO USE:**
-    {raw_analyses_text_str}
-    """)
+    # The instructions and skeleton lead the request unchanged for every document (FORMATTER_SYSTEM_PROMPT),
+    # so OpenAI's automatic prompt caching can reuse their prefill; only the raw analyses vary.
+    formatter_input = FORMATTER_INPUT_TEMPLATE.format(raw_analyses=raw_analyses_text_str)
 
+    json_output_str: Optional[str] = None
     try:
-        response = client.chat.completions.create(
+        # Async client under the shared token/request limiter, which paces on the x-ratelimit-* headers
+        response = await openai_interface.acall_rate_limited(
+            openai_interface.generation_client.chat.completions.with_raw_response.create,
+            estimate_tokens(FORMATTER_SYSTEM_PROMPT + formatter_input, 0, settings.OPENAI_CHAT_MODEL),
             model=settings.OPENAI_CHAT_MODEL,
             messages=[
-                {"role": "system", "content": "You are a helpful assistant that outputs JSON."},
-                {"role": "user", "content": formatter_prompt}
+                {"role": "system", "content": FORMATTER_SYSTEM_PROMPT},
+                {"role": "user", "content": formatter_input}
             ],
             response_format={"type": "json_object"}
             #temperature=0.2 # Keep temperature low for structured output - COMMENTED OUT
         )
         json_output_str = response.choices[0].message.content
-        structured_data = json.loads(json_output_str)
+        if json_output_str is None: # e.g. a refusal; stdlib json would raise TypeError rather than ValueError
+            raise ValueError("formatter response has no content")
+        structured_data = json_utils.loads(json_output_str)
 
         # Assign document metadata
         structured_data["document"]["filename"] = filename
@@ -283,10 +391,10 @@ def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename:
 
         logger.info("-> Successfully synthesized analyses into JSON structure and injected raw sources.")
         return structured_data
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON from OpenAI response during formatting: {e}. Response was: {json_output_str[:500]}...", exc_info=True)
+    except ValueError as e: # json / orjson decode errors both subclass ValueError
+        logger.error(f"Error decoding JSON from OpenAI response during formatting: {e}. Response was: {(json_output_str or '')[:500]}...", exc_info=True)
         # Attempt to return a partial JSON indicating formatting failure and populate sources
-        error_json = json.loads(JSON_SKELETON)
+        error_json = copy.deepcopy(_SKELETON_DICT)
         error_json["document"]["filename"] = filename
         error_json["document"]["title"] = title
         error_json["document"]["size_kb"] = file_size_kb
@@ -298,7 +406,7 @@ def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename:
         return error_json
     except Exception as e:
         logger.error(f"Failed to format analyses into JSON for unknown reason: {e}", exc_info=True)
-        error_json = json.loads(JSON_SKELETON)
+        error_json = copy.deepcopy(_SKELETON_DICT)
         error_json["document"]["filename"] = filename
         error_json["document"]["title"] = title
         error_json["document"]["size_kb"] = file_size_kb
@@ -318,27 +426,20 @@ async def perform_equity_analysis(
     upload_date_utc: str,
     rag_system_instance: HybridRAGSystem,
     openai_interface_instance: OpenAIInteraction,
-    user_sessions_dict: Dict[str, Dict[str, Any]], # Direct reference to the main app's user_sessions dict
+    session_info: UserSession, # The session this upload belongs to; only this object is updated
     analysis_output_dir: str # Directory to save the final JSON file
 ):
     """
     Performs the full equity analysis for a single document as a background task.
-    Updates session status and saves results to file and in-memory dict.
+    Updates the given session's status and saves results to file. Runs on the event loop, like every
+    other writer of session state, so the updates need no locking.
     """
     logger.info(f"Background task: Starting analysis for session: {session_id}, file: {original_filename}")
-    
-    session_info = user_sessions_dict.get(session_id)
-    if not session_info:
-        logger.error(f"Session {session_id} not found in user_sessions_dict during background analysis start.")
-        if os.path.exists(temp_file_path):
-            try: os.remove(temp_file_path); logger.info(f"[{session_id}] Deleted temp file due to missing session info.")
-            except OSError as e: logger.error(f"[{session_id}] Error deleting temp file (missing session info): {e}")
-        return
 
-    session_info['analysis_status'] = 'in_progress'
-    session_info['analysis_result_cached'] = None
-    session_info['analysis_result_path'] = None
-    session_info['analysis_error'] = None
+    session_info.analysis_status = 'in_progress'
+    session_info.analysis_result_path = None
+    session_info.analysis_error = None
+    session_info.notify_status_change()
 
     # --- MAIN TRY BLOCK FOR THE ENTIRE ANALYSIS PROCESS ---
     try:
@@ -422,15 +523,13 @@ async def perform_equity_analysis(
             }
             # Save to file
             output_file_path = os.path.join(analysis_output_dir, f"{session_id}.json")
-            os.makedirs(analysis_output_dir, exist_ok=True)
-            with open(output_file_path, 'w', encoding='utf-8') as f:
-                json.dump(dummy_json_result, f, indent=2, ensure_ascii=False)
+            await asyncio.to_thread(_write_json_file, output_file_path, dummy_json_result)
             logger.info(f"[{session_id}] Simulated analysis saved to file: {output_file_path}")
 
             # Update in-memory dict
-            session_info['analysis_status'] = 'completed'
-            session_info['analysis_result_path'] = output_file_path
-            session_info['analysis_result_cached'] = dummy_json_result
+            session_info.analysis_status = 'completed'
+            session_info.analysis_result_path = output_file_path
+            session_info.notify_status_change()
             logger.info(f"[{session_id}] Simulated analysis completed and session info updated.")
 
         else: # --- REAL ANALYSIS LOGIC ---
@@ -441,86 +540,76 @@ async def perform_equity_analysis(
             # This entire real analysis process runs within the main try block
             # No inner try/except needed here.
 
-            # --- Generate analyses for standard FOCUS_AREAS ---
-            focus_description_map = {
-                "general": "the overall equity implications, considering all relevant dimensions of the COEQWAL framework.",
-                "vulnerable_groups": "how vulnerable groups are affected or mentioned.",
-                "severity_of_impact": "the severity of the document's impacts on equity.",
-                "mitigation_strategies": "strategies or solutions for equity concerns."
-            }
-            for focus in FOCUS_AREAS:
-                logger.info(f"[{session_id}] -> Generating raw analysis for focus: '{focus}'...")
-                query_for_rag_system = ANALYSIS_QUERY_GENERIC.format(focus_description=focus_description_map.get(focus, "equity implications."))
-                
-                answer, _, openai_srcs = rag_system_instance.answer_question(session_id=session_id, query=query_for_rag_system, focus_area=focus)
-                
+            async def run_job(key: str, query: str, focus: str, label: str) -> None:
+                answer, _, openai_srcs = await rag_system_instance.answer_question(session_id=session_id, query=query, focus_area=focus)
                 if "Error:" in answer:
-                    logger.error(f"[{session_id}] Received an error for standard focus '{focus}': {answer}. Marking as failed.")
-                    raw_analyses[focus] = {"text": f"ANALYSIS FAILED: {answer}", "openai_sources": openai_srcs}
+                    logger.error(f"[{session_id}] Received an error for {label}: {answer}. Marking as failed.")
+                    raw_analyses[key] = {"text": f"ANALYSIS FAILED: {answer}", "openai_sources": openai_srcs}
                 else:
-                    raw_analyses[focus] = {"text": answer, "openai_sources": openai_srcs}
-                logger.info(f"[{session_id}] Generated raw analysis for '{focus}'. Waiting for {DELAY_BETWEEN_REQUESTS_SECONDS}s...")
-                time.sleep(DELAY_BETWEEN_REQUESTS_SECONDS)
-
-            # --- Generate analyses for each PERSPECTIVE ---
-            for perspective_info in PERSPECTIVES:
-                perspective_group_key = perspective_info["group_name"].replace(" ", "_").lower()
-                logger.info(f"[{session_id}] -> Generating analysis for perspective: '{perspective_info['group_name']}'...")
-
-                # General Equity Assessment for this perspective
-                query_general_perspective = ANALYSIS_QUERY_GENERIC.format(focus_description=perspective_info['description'])
-                answer_general, _, openai_srcs = rag_system_instance.answer_question(session_id=session_id, query=query_general_perspective, focus_area="general")
-                if "Error:" in answer_general:
-                    logger.error(f"[{session_id}] Error for perspective '{perspective_info['group_name']}' general analysis: {answer_general}. Marking as failed.")
-                    raw_analyses[f"perspective_{perspective_group_key}_general"] = {"text": f"ANALYSIS FAILED: {answer_general}", "openai_sources": openai_srcs}
-                else:
-                    raw_analyses[f"perspective_{perspective_group_key}_general"] = {"text": answer_general, "openai_sources": openai_srcs}
-                logger.info(f"[{session_id}] Generated general analysis for '{perspective_info['group_name']}'. Waiting for {DELAY_BETWEEN_REQUESTS_SECONDS}s...")
-                time.sleep(DELAY_BETWEEN_REQUESTS_SECONDS)
-
-                # Individual Equity Dimensions for this perspective
-                for dim in ["recognitional", "procedural", "distributional", "structural"]:
-                    prompt_description = perspective_info["dimensions"].get(dim)
-                    if prompt_description:
-                        query_dim_perspective = ANALYSIS_QUERY_GENERIC.format(focus_description=prompt_description)
-                        answer_dim, _, openai_srcs = rag_system_instance.answer_question(session_id=session_id, query=query_dim_perspective, focus_area="general")
-                        if "Error:" in answer_dim:
-                            logger.error(f"[{session_id}] Error for perspective '{perspective_info['group_name']}' {dim} analysis: {answer_dim}. Marking as failed.")
-                            raw_analyses[f"perspective_{perspective_group_key}_{dim}"] = {"text": f"ANALYSIS FAILED: {answer_dim}", "openai_sources": openai_srcs}
-                        else:
-                            raw_analyses[f"perspective_{perspective_group_key}_{dim}"] = {"text": answer_dim, "openai_sources": openai_srcs}
-                        logger.info(f"[{session_id}] Generated '{dim}' analysis for '{perspective_info['group_name']}'. Waiting for {DELAY_BETWEEN_REQUESTS_SECONDS}s...")
-                        time.sleep(DELAY_BETWEEN_REQUESTS_SECONDS)
+                    raw_analyses[key] = {"text": answer, "openai_sources": openai_srcs}
+                logger.info(f"[{session_id}] Generated raw analysis for {label}.")
+
+            async def run_batch(batch: List[Tuple[str, str, str, str]]) -> None:
+                # One request answers the whole batch; anything it leaves out is asked on its own
+                answers, _, openai_srcs = await rag_system_instance.answer_multi_focus(
+                    session_id, [(key, query, focus) for key, query, focus, _ in batch]
+                )
+                fallback_jobs = []
+                for job in batch:
+                    if job[0] in answers:
+                        # Deliberately batch-level attribution: file_search ran once for the whole request, so each
+                        # section lists everything retrieved for its batch (see README, "Analysis Sources")
+                        raw_analyses[job[0]] = {"text": answers[job[0]], "openai_sources": list(openai_srcs)}
+                    else:
+                        fallback_jobs.append(job)
+                if fallback_jobs:
+                    logger.warning(f"[{session_id}] Multi-focus request missed {len(fallback_jobs)} analyses; asking them individually.")
+                    async with asyncio.TaskGroup() as tg:
+                        for job in fallback_jobs: tg.create_task(run_job(*job))
+
+            # The focus areas and perspective dimensions are independent questions against the same session,
+            # so they are issued together; HybridRAGSystem's request semaphore and token/request budget
+            # throttle them instead of a fixed delay between calls.
+            if MULTI_FOCUS_BATCH_SIZE > 1:
+                logger.info(f"[{session_id}] -> Generating {len(ANALYSIS_JOBS)} raw analyses in {len(ANALYSIS_JOB_BATCHES)} multi-focus requests...")
+                async with asyncio.TaskGroup() as tg:
+                    for batch in ANALYSIS_JOB_BATCHES: tg.create_task(run_batch(batch))
+            else:
+                logger.info(f"[{session_id}] -> Generating {len(ANALYSIS_JOBS)} raw analyses concurrently...")
+                async with asyncio.TaskGroup() as tg:
+                    for job in ANALYSIS_JOBS: tg.create_task(run_job(*job))
 
             # --- Synthesize all raw analyses text into final JSON structure (Python injects sources after) ---
-            final_json_result = format_analyses_into_json(raw_analyses, original_filename, title, file_size_kb, upload_date_utc, openai_interface_instance.client)
+            final_json_result = await format_analyses_into_json(
+                raw_analyses, original_filename, title, file_size_kb, upload_date_utc, openai_interface_instance
+            )
             if not final_json_result:
                 raise Exception("Failed to synthesize the final JSON structure from raw analyses.")
 
             # --- Save result to file and update in-memory dict ---
             output_file_path = os.path.join(analysis_output_dir, f"{session_id}.json")
-            os.makedirs(analysis_output_dir, exist_ok=True)
-            with open(output_file_path, 'w', encoding='utf-8') as f:
-                json.dump(final_json_result, f, indent=2, ensure_ascii=False)
+            await asyncio.to_thread(_write_json_file, output_file_path, final_json_result)
             logger.info(f"[{session_id}] Analysis saved to file: {output_file_path}")
 
             # Update in-memory dict
-            session_info['analysis_status'] = 'completed'
-            session_info['analysis_result_path'] = output_file_path
-            session_info['analysis_result_cached'] = final_json_result
+            session_info.analysis_status = 'completed'
+            session_info.analysis_result_path = output_file_path
+            session_info.notify_status_change()
             logger.info(f"[{session_id}] Analysis completed and session info updated.")
 
     except Exception as e: # This is the specific catch for REAL analysis errors.
         logger.error(f"[{session_id}] Critical error during background REAL analysis: {e}", exc_info=True)
-        session_info['analysis_status'] = 'failed'
-        session_info['analysis_error'] = str(e)
+        session_info.analysis_status = 'failed'
+        session_info.analysis_error = str(e)
+        session_info.notify_status_change()
     # --- END REAL ANALYSIS LOGIC ---
 
     finally: # This finally block encapsulates the entire function's execution.
         # Ensure the temporary file is deleted after processing (or failure)
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"[{session_id}] Deleted temporary file: {temp_file_path}")
-            except OSError as e:
-                logger.error(f"[{session_id}] Error deleting temporary file {temp_file_path}: {e}")
\ No newline at end of file
+        try:
+            await asyncio.to_thread(os.remove, temp_file_path)
+            logger.info(f"[{session_id}] Deleted temporary file: {temp_file_path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"[{session_id}] Error deleting temporary file {temp_file_path}: {e}")
\ No newline at end of file
@@ -0,0 +1,63 @@
+# core/json_utils.py
+import json
+import logging
+import mmap
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    logging.warning("orjson is not installed. Falling back to the standard json module.")
+    orjson = None
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serializes obj to a JSON string, using orjson when available. Non-JSON types fall back to str()."""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=str, option=option).decode("utf-8")
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=str)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+    """Like dumps, but returns UTF-8 bytes (orjson's native output) for writing straight to a binary file."""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=str, option=option)
+    return dumps(obj, indent=indent).encode("utf-8")
+
+def write_file(path: str, obj: Any, indent: bool = False) -> None:
+    """
+    Writes obj as JSON to path atomically (blocking): the encoded bytes go to a sibling temp file that
+    os.replace then swaps in, so readers and interrupted runs never see a half-written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(dumps_bytes(obj, indent=indent))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+MMAP_MIN_BYTES = 64 * 1024 # Smaller files are cheaper to read() than to map
+
+def read_file(path: str) -> Any:
+    """
+    Parses a JSON file (blocking). Large files are memory-mapped and parsed in place by orjson, so the
+    bytes are served from the OS page cache without a private copy in the process.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if orjson is None or size < MMAP_MIN_BYTES:
+            return loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+def loads(data: Any) -> Any:
+    """Parses JSON from str or bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -4,7 +4,9 @@ import json
 import logging
 import numpy as np
 import time
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 
 try:
     from sentence_transformers import SentenceTransformer
@@ -15,6 +17,7 @@ except ImportError:
     st_imported = False
 
 from .config import settings # Import from config.py
+from . import json_utils
 
 logger = logging.getLogger("local_db")
 
@@ -26,6 +29,12 @@ if SentenceTransformer:
             self.documents: List[Dict[str, Any]] = []
             self.embedding_model_name = embedding_model_name
             self.model = None
+            # LRU of search results keyed on (normalized query, top_k); cleared whenever documents change
+            self._search_cache: "OrderedDict[Tuple[str, int], List[Dict[str, Any]]]" = OrderedDict()
+            self._search_cache_size = getattr(settings, "LOCAL_SEARCH_CACHE_SIZE", 1024) if settings else 1024
+            self._search_cache_lock = threading.Lock()
+            # Query embeddings by exact query text, shared by search and the semantic answer cache
+            self._embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
             if embedding_model_name and st_imported:
                 try:
                     # Explicitly specify cache folder if needed, otherwise uses default
@@ -55,11 +64,72 @@ if SentenceTransformer:
                     doc = { "id": chunk.get("id", -1), "text": chunk.get("text", ""), "embedding": embeddings[i].tolist(),
                             "metadata": { "headings": meta.get("headings", []), "position_index": meta.get("position_index", -1), "position_total": meta.get("position_total", -1) } }
                     self.documents.append(doc)
+                self.clear_search_cache()
                 logger.info(f"Added {len(chunks)} chunks to local Vector DB.")
             except Exception as e: logger.error(f"Error during local embedding or adding documents: {e}", exc_info=True)
 
 
+        def warm_up(self) -> bool:
+            """Runs one throwaway encode so first-query costs (lazy kernel/weight init) are paid up front."""
+            if not self.model:
+                return False
+            try:
+                start_time = time.time()
+                self.model.encode("warm-up query", show_progress_bar=False)
+                logger.info(f"Local embedding model warmed up in {time.time() - start_time:.2f} seconds.")
+                return True
+            except Exception as e:
+                logger.error(f"Local embedding model warm-up failed: {e}", exc_info=True)
+                return False
+
+        def embed_query(self, query: str) -> Optional[np.ndarray]:
+            """Encodes a query with the local model, reusing the embedding when the same text was seen recently."""
+            if not self.model or not query:
+                return None
+            key = query.strip()
+            with self._search_cache_lock:
+                cached = self._embedding_cache.get(key)
+                if cached is not None:
+                    self._embedding_cache.move_to_end(key)
+                    return cached
+            query_emb = np.array(self.model.encode(key))
+            query_emb.setflags(write=False) # Shared between callers
+            if self._search_cache_size > 0:
+                with self._search_cache_lock:
+                    self._embedding_cache[key] = query_emb
+                    while len(self._embedding_cache) > self._search_cache_size:
+                        self._embedding_cache.popitem(last=False)
+            return query_emb
+
+        def clear_search_cache(self) -> None:
+            """Drops all cached search results (call after the document set changes)."""
+            with self._search_cache_lock:
+                self._search_cache.clear()
+
         def search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+            """Cosine similarity search, served from the LRU cache when the same query repeats."""
+            if not query or top_k <= 0 or self._search_cache_size <= 0:
+                return self._search_uncached(query, top_k)
+
+            key = (query.strip().lower(), top_k)
+            with self._search_cache_lock:
+                cached = self._search_cache.get(key)
+                if cached is not None:
+                    self._search_cache.move_to_end(key)
+            if cached is not None:
+                logger.debug(f"Local DB search cache hit for top_k={top_k}.")
+                return [doc.copy() for doc in cached]
+
+            results = self._search_uncached(query, top_k)
+            if results: # Don't cache empty results; they usually mean the model/DB wasn't ready
+                with self._search_cache_lock:
+                    self._search_cache[key] = results
+                    self._search_cache.move_to_end(key)
+                    while len(self._search_cache) > self._search_cache_size:
+                        self._search_cache.popitem(last=False)
+            return [doc.copy() for doc in results]
+
+        def _search_uncached(self, query: str, top_k: int) -> List[Dict[str, Any]]:
             """Performs cosine similarity search on locally stored embeddings."""
             # (Code largely the same as the notebook)
             if not self.documents or top_k <= 0:
@@ -74,7 +144,9 @@ if SentenceTransformer:
 
             try:
                 start_time = time.time()
-                query_emb = np.array(self.model.encode(query))
+                query_emb = self.embed_query(query)
+                if query_emb is None:
+                    return []
 
                 valid_docs_info = []
                 for i, d in enumerate(self.documents):
@@ -144,8 +216,9 @@ if SentenceTransformer:
                 raise FileNotFoundError(f"Local Vector DB file not found: {file_path}")
 
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    loaded_data = json.load(f)
+                # orjson when installed (far faster than json.load on the float-heavy embedding lists),
+                # parsed straight from a memory map of the file
+                loaded_data = json_utils.read_file(file_path)
                 if not isinstance(loaded_data, list):
                     raise ValueError("Invalid JSON format for DB: expected a list.")
                 if loaded_data and not isinstance(loaded_data[0], dict):
@@ -160,6 +233,7 @@ if SentenceTransformer:
                     valid_docs.append(doc)
 
                 db.documents = valid_docs
+                db.clear_search_cache()
                 logger.info(f"Loaded {len(db.documents)} documents into local Vector DB.")
 
             except FileNotFoundError: raise
@@ -1,14 +1,25 @@
 # core/openai_interaction.py
 import os
 import time
+import random
+import asyncio
 import logging
-from typing import Optional, List
-from openai import OpenAI, APIError, APIStatusError, RateLimitError, NotFoundError
+from typing import Optional, List, Any, Awaitable, Callable
+from openai import (OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, APIError, APIStatusError, APIConnectionError,
+                    InternalServerError, RateLimitError, NotFoundError)
+
+try:
+    import h2 # noqa: F401 -- httpx's HTTP/2 support
+except ImportError:
+    h2 = None
 
 from .config import settings # Import settings
+from .rate_limit import OpenAIRateLimiter
 
 logger = logging.getLogger("openai_interaction")
 
+TRANSIENT_RETRY_MAX_DELAY = 60 # Seconds; cap of acall_rate_limited's jittered backoff for connection errors / 5xx
+
 class OpenAIInteraction:
     """Handles interactions with OpenAI API: File Upload, Vector Stores, Status Checks."""
     def __init__(self, api_key: Optional[str] = None):
@@ -17,7 +28,21 @@ class OpenAIInteraction:
             raise ValueError("OpenAI API key is required but not found or is a placeholder.")
 
         try:
-            self.client = OpenAI(api_key=resolved_key)
+            # The SDK retries connection errors, timeouts, 429s and 5xx itself, with jittered exponential
+            # backoff that honours retry-after; OPENAI_MAX_RETRIES raises its default of 2
+            self.client = OpenAI(api_key=resolved_key, max_retries=settings.OPENAI_MAX_RETRIES)
+            # Async client for the request hot path (responses.create from async handlers)
+            # With h2 installed, its concurrent calls (queries, uploads, polling, cleanup deletes) share one connection
+            use_http2 = h2 is not None and getattr(settings, "OPENAI_HTTP2", True)
+            self.aclient = AsyncOpenAI(api_key=resolved_key, max_retries=settings.OPENAI_MAX_RETRIES,
+                                       http_client=DefaultAsyncHttpxClient(http2=True) if use_http2 else None)
+            # Shared pacing for generation calls (answers + batch formatting), tuned by response headers
+            self.rate_limiter = OpenAIRateLimiter(settings.OPENAI_REQUESTS_PER_MINUTE, settings.OPENAI_TOKENS_PER_MINUTE)
+            self._rate_limit_max_retries = settings.RATE_LIMIT_MAX_RETRIES
+            self._transient_max_retries = settings.OPENAI_MAX_RETRIES
+            # Generation calls go through acall_rate_limited, which is their only retry layer: SDK retries on top
+            # would multiply the attempts and hide 429s from the limiter
+            self.generation_client = self.aclient.with_options(max_retries=0)
             # Test connection by listing models (optional, remove if causes issues)
             # REMOVED: self.client.models.list(limit=1) # <--- This line caused the TypeError
             # If the client initializes without error, we assume basic connectivity.
@@ -29,6 +54,38 @@ class OpenAIInteraction:
             # Changed the exception type to ValueError for consistency, but ConnectionError is also reasonable
             raise ValueError("Could not initialize OpenAI client.") from e
 
+    async def acall_rate_limited(self, raw_create: Callable[..., Awaitable[Any]], estimated_tokens: int = 0, **kwargs) -> Any:
+        """
+        Awaits a `with_raw_response` create method of generation_client (e.g.
+        generation_client.responses.with_raw_response.create) under the shared rate limiter and returns
+        the parsed result. The response headers feed the limiter; a 429 pauses all callers for the
+        server's retry-after hint and is retried up to RATE_LIMIT_MAX_RETRIES times, and connection
+        errors / 5xx are retried with jittered exponential backoff up to OPENAI_MAX_RETRIES times.
+        """
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                raw_response = await raw_create(**kwargs)
+            except RateLimitError as e:
+                response = getattr(e, "response", None)
+                delay = self.rate_limiter.record_rate_limited(response.headers if response is not None else None)
+                if attempt >= self._rate_limit_max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"OpenAI rate limit hit; retrying in {delay:.1f}s (attempt {attempt}/{self._rate_limit_max_retries}).")
+                continue
+            except (APIConnectionError, InternalServerError) as e: # APITimeoutError is an APIConnectionError
+                if attempt >= self._transient_max_retries:
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(TRANSIENT_RETRY_MAX_DELAY, 2 ** attempt))
+                logger.warning(f"Transient OpenAI error ({e.__class__.__name__}); retrying in {delay:.1f}s (attempt {attempt}/{self._transient_max_retries}).")
+                await asyncio.sleep(delay)
+                continue
+            self.rate_limiter.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
     def upload_file(self, file_path: str, purpose: str = "assistants") -> Optional[str]:
         """Uploads a file to OpenAI."""
         if not os.path.exists(file_path):
@@ -126,6 +183,124 @@ class OpenAIInteraction:
         logger.error(f"Timeout ({timeout}s) waiting for file {file_id} processing in VS {vector_store_id}. Last status: {last_status}")
         return False
 
+    async def aupload_file(self, file_path: str, purpose: str = "assistants") -> Optional[str]:
+        """Async variant of upload_file. The file is read in a worker thread so the event loop stays free."""
+        def _read() -> bytes:
+            with open(file_path, "rb") as f:
+                return f.read()
+        try:
+            content = await asyncio.to_thread(_read) # A missing file surfaces here, without a separate stat on the loop
+        except FileNotFoundError:
+            logger.error(f"File not found for upload: {file_path}")
+            return None
+        except OSError as e:
+            logger.error(f"Could not read file {file_path} for upload: {e}")
+            return None
+
+        logger.info(f"Uploading file: {file_path} with purpose: {purpose}")
+        try:
+            response = await self.aclient.files.create(file=(os.path.basename(file_path), content), purpose=purpose)
+            logger.info(f"File '{os.path.basename(file_path)}' uploaded. File ID: {response.id}")
+            return response.id
+        except (APIError, APIStatusError) as e:
+            logger.error(f"OpenAI API error uploading file {file_path}: Status={getattr(e, 'status_code', 'N/A')} Message={getattr(e, 'message', str(e))}")
+        except RateLimitError:
+             logger.error(f"OpenAI Rate Limit Error during file upload for {file_path}.")
+        except Exception as e:
+            logger.error(f"Unexpected error uploading file {file_path}: {e}", exc_info=True)
+        return None
+
+    async def acreate_vector_store_with_files(self, name: str, file_ids: List[str], expires_after_days: int = 0) -> Optional[str]:
+        """Async variant of create_vector_store_with_files. expires_after_days > 0 lets OpenAI delete the store once idle that long."""
+        if not file_ids:
+            logger.error("Cannot create vector store: No file IDs provided.")
+            return None
+
+        logger.info(f"Creating OpenAI Vector Store '{name}' with files: {file_ids}")
+        kwargs = {}
+        if expires_after_days > 0:
+            kwargs["expires_after"] = {"anchor": "last_active_at", "days": expires_after_days}
+        try:
+            vector_store = await self.aclient.vector_stores.create(name=name, file_ids=file_ids, **kwargs)
+            logger.info(f"Created OpenAI Vector Store '{name}'. ID: {vector_store.id}, Status: {vector_store.status}")
+            return vector_store.id
+        except (APIError, APIStatusError) as e:
+            logger.error(f"API error creating vector store '{name}': Status={getattr(e, 'status_code', 'N/A')} Message={getattr(e, 'message', str(e))}")
+        except RateLimitError:
+             logger.error(f"OpenAI Rate Limit Error during vector store creation for '{name}'.")
+        except Exception as e:
+            logger.error(f"Unexpected error creating vector store '{name}': {e}", exc_info=True)
+        return None
+
+    async def aget_vector_store_status(self, vector_store_id: str) -> Optional[str]:
+        """Status of an existing vector store ('completed', 'in_progress', 'expired'), or None if it is gone or unreadable."""
+        try:
+            vector_store = await self.aclient.vector_stores.retrieve(vector_store_id=vector_store_id)
+            return vector_store.status
+        except NotFoundError:
+            logger.info(f"Vector Store {vector_store_id} no longer exists.")
+        except (APIError, APIStatusError) as e:
+            logger.warning(f"API error retrieving Vector Store {vector_store_id}: Status={getattr(e, 'status_code', 'N/A')} Message={getattr(e, 'message', str(e))}")
+        except Exception as e:
+            logger.warning(f"Unexpected error retrieving Vector Store {vector_store_id}: {e}")
+        return None
+
+    async def await_vector_store_file_processing(self, vector_store_id: str, file_id: str,
+                                                 timeout: int = settings.PROCESSING_TIMEOUT_SECONDS,
+                                                 poll_interval: float = settings.POLLING_INTERVAL_SECONDS,
+                                                 max_poll_interval: float = settings.MAX_POLLING_INTERVAL_SECONDS) -> bool:
+        """
+        Async variant of wait_for_vector_store_file_processing.
+        Polls with exponential backoff (x1.5 per poll, capped at max_poll_interval) using asyncio.sleep.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = poll_interval
+        logger.info(f"Waiting up to {timeout}s for File ID {file_id} processing within VS {vector_store_id}...")
+        last_status = None
+        while loop.time() < deadline:
+            try:
+                vs_file = await self.aclient.vector_stores.files.retrieve(
+                    vector_store_id=vector_store_id,
+                    file_id=file_id
+                )
+                status = vs_file.status
+                if status != last_status:
+                    logger.info(f"File {file_id} in VS {vector_store_id} status: {status}")
+                    last_status = status
+
+                if status == 'completed':
+                    logger.info(f"File {file_id} processing completed successfully in VS {vector_store_id}.")
+                    return True
+                elif status == 'failed':
+                    error_message = vs_file.last_error.message if vs_file.last_error else "Unknown error"
+                    logger.error(f"File {file_id} processing failed in VS {vector_store_id}. Error: {error_message}")
+                    return False
+                elif status in ['cancelled', 'cancelling']:
+                    logger.warning(f"File {file_id} processing cancelled in VS {vector_store_id}.")
+                    return False
+                elif status != 'in_progress':
+                    logger.warning(f"Unexpected VS File status '{status}' for file {file_id}. Continuing poll.")
+
+            except NotFoundError:
+                 # File may not be linked to the VS yet; keep polling.
+                 logger.warning(f"VS File {file_id} in VS {vector_store_id} not found (404). May not be linked yet or IDs incorrect. Retrying...")
+            except RateLimitError:
+                 logger.warning(f"Rate limit hit while checking VS file status for {file_id}. Backing off...")
+                 delay = max_poll_interval
+            except APIStatusError as e:
+                 logger.error(f"API error checking VS file status (File ID {file_id}, VS {vector_store_id}): {e}")
+                 return False
+            except Exception as e:
+                logger.error(f"Unexpected error checking VS file status (File ID {file_id}, VS {vector_store_id}): {e}", exc_info=True)
+                return False
+
+            await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+            delay = min(delay * 1.5, max_poll_interval)
+
+        logger.error(f"Timeout ({timeout}s) waiting for file {file_id} processing in VS {vector_store_id}. Last status: {last_status}")
+        return False
+
     def delete_vector_store(self, vector_store_id: str) -> bool:
         """Deletes an OpenAI Vector Store."""
         logger.info(f"Attempting to delete OpenAI Vector Store: {vector_store_id}")
@@ -174,4 +349,53 @@ class OpenAIInteraction:
              return False
         except Exception as e:
             logger.error(f"Unexpected error deleting File {file_id}: {e}", exc_info=True)
-            return False
\ No newline at end of file
+            return False
+
+    async def adelete_vector_store(self, vector_store_id: str) -> bool:
+        """Async variant of delete_vector_store."""
+        logger.info(f"Attempting to delete OpenAI Vector Store: {vector_store_id}")
+        try:
+            response = await self.aclient.vector_stores.delete(vector_store_id=vector_store_id)
+            if response.deleted:
+                logger.info(f"Vector Store {vector_store_id} deleted successfully.")
+            else:
+                 logger.warning(f"Vector Store {vector_store_id} deletion response indicates not deleted: {response}")
+            return response.deleted
+        except NotFoundError:
+             logger.warning(f"Vector Store {vector_store_id} not found (already deleted?).")
+             return True # Treat as success if already gone
+        except (APIError, APIStatusError) as e:
+             logger.error(f"API error deleting Vector Store {vector_store_id}: Status={getattr(e, 'status_code', 'N/A')} Message={getattr(e, 'message', str(e))}")
+             return False
+        except RateLimitError:
+             logger.error(f"Rate limit error deleting Vector Store {vector_store_id}.")
+             return False
+        except Exception as e:
+            logger.error(f"Unexpected error deleting Vector Store {vector_store_id}: {e}", exc_info=True)
+            return False
+
+    async def adelete_file(self, file_id: str) -> bool:
+        """Async variant of delete_file."""
+        logger.info(f"Attempting to delete OpenAI File: {file_id}")
+        try:
+            response = await self.aclient.files.delete(file_id=file_id)
+            if response.deleted:
+                 logger.info(f"File {file_id} deleted successfully.")
+            else:
+                 logger.warning(f"File {file_id} deletion response indicates not deleted: {response}")
+            return response.deleted
+        except NotFoundError:
+             logger.warning(f"File {file_id} not found (already deleted?).")
+             return True # Treat as success
+        except (APIError, APIStatusError) as e:
+            if getattr(e, 'status_code', None) == 409:
+                 logger.warning(f"Cannot delete File {file_id} (Conflict/409). It might still be attached to a Vector Store.")
+            else:
+                 logger.error(f"API error deleting File {file_id}: Status={getattr(e, 'status_code', 'N/A')} Message={getattr(e, 'message', str(e))}")
+            return False
+        except RateLimitError:
+             logger.error(f"Rate limit error deleting File {file_id}.")
+             return False
+        except Exception as e:
+            logger.error(f"Unexpected error deleting File {file_id}: {e}", exc_info=True)
+            return False
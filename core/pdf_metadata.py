@@ -0,0 +1,67 @@
+# core/pdf_metadata.py
+import mmap
+import re
+import logging
+from typing import Optional
+
+logger = logging.getLogger("pdf_metadata")
+
+PDF_TAIL_BYTES = 4096 # The trailer (or xref stream dictionary) sits within the last few KB
+_INFO_REF_RE = re.compile(rb"/Info\s+(\d+)\s+(\d+)\s+R")
+_TITLE_RE = re.compile(rb"/Title\s*(\((?:[^()\\]|\\.|\((?:[^()\\]|\\.)*\))*\)|<[0-9A-Fa-f\s]*>)", re.DOTALL)
+_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f", b"(": b"(", b")": b")", b"\\": b"\\"}
+_ESCAPE_RE = re.compile(rb"\\([0-7]{1,3}|\r\n|[\r\n]|.)", re.DOTALL)
+
+def _unescape_literal(raw: bytes) -> bytes:
+    def replace(match: re.Match) -> bytes:
+        token = match.group(1)
+        if token[:1].isdigit():
+            return bytes([int(token, 8) & 0xFF])
+        if token in (b"\r\n", b"\r", b"\n"): # Line continuation
+            return b""
+        return _ESCAPES.get(token, token)
+    return _ESCAPE_RE.sub(replace, raw)
+
+def _decode_pdf_string(token: bytes) -> str:
+    if token.startswith(b"<"):
+        hex_digits = re.sub(rb"\s", b"", token[1:-1])
+        if len(hex_digits) % 2: hex_digits += b"0"
+        data = bytes.fromhex(hex_digits.decode("ascii"))
+    else:
+        data = _unescape_literal(token[1:-1])
+    if data.startswith(b"\xfe\xff"):
+        return data[2:].decode("utf-16-be", errors="replace")
+    if data.startswith(b"\xef\xbb\xbf"):
+        return data[3:].decode("utf-8", errors="replace")
+    return data.decode("latin-1") # Close enough to PDFDocEncoding for titles
+
+def read_pdf_title(file_path: str) -> Optional[str]:
+    """
+    Reads the document-info /Title of a PDF without parsing it (blocking): finds the /Info reference in the
+    trailer at the end of the file, then the last definition of that object. Returns None when that shortcut
+    does not apply (encrypted file, info dictionary inside a compressed object stream, no title), so callers
+    fall back to a full PDF reader.
+    """
+    try:
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            tail = data[max(0, len(data) - PDF_TAIL_BYTES):]
+            if b"/Encrypt" in tail:
+                return None
+            info_refs = _INFO_REF_RE.findall(tail)
+            if not info_refs:
+                return None
+            obj_num, gen_num = info_refs[-1] # Incremental updates append newer trailers
+            # The last definition wins, as later revisions are appended to the file
+            start = data.rfind(b"%s %s obj" % (obj_num, gen_num))
+            if start < 0 or (start > 0 and data[start - 1:start].isdigit()):
+                return None
+            end = data.find(b"endobj", start)
+            if end < 0:
+                return None
+            match = _TITLE_RE.search(data[start:end])
+            if not match:
+                return None
+            return _decode_pdf_string(match.group(1)).strip() or None
+    except (OSError, ValueError) as e:
+        logger.debug(f"Trailer title scan failed for '{file_path}': {e}")
+        return None
@@ -1,66 +1,347 @@
 # core/rag_system.py
 import os
+import string
 import textwrap
 import logging
 import time
-import json
-from typing import Optional, List, Dict, Any, Tuple
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator, Awaitable
 from openai import APIError, APIStatusError, RateLimitError
 
 from .config import settings
+from . import json_utils
+from .cache import TTLCache
+from .rate_limit import AsyncRateLimiter, estimate_tokens
+from .semantic_cache import SemanticCache
 from .local_db import VectorDatabase, get_local_db
 from .openai_interaction import OpenAIInteraction
 
 logger = logging.getLogger("rag_system")
 
+NO_CONTEXT_ANSWER = "I don't have any COEQWAL context or a user document loaded for this session. Please upload a document or ask a general question."
+_NO_LOCAL_CONTEXT_MSG = "No definitions or context from the COEQWAL document were retrieved from the COEQWAL Framework document."
+
+# Shared framework preamble. Prompts put all static text first and the per-query details
+# (_REQUEST_DETAILS_TEMPLATE) last, so the prefix is byte-identical across calls for a focus
+# area and OpenAI's automatic prompt caching can reuse it.
+_BASE_INTRO_TEMPLATE = textwrap.dedent("""
+    **Framework Definitions (from COEQWAL Context - Four Equity Dimensions):**
+    - **Recognitional Equity:** Concerns the fair and inclusive recognition of diverse groups, their unique identities, histories, and cultural values in policies, processes, and outcomes. It asks if all voices are seen and valued.
+    - **Procedural Equity:** Focuses on fair and inclusive processes for decision-making. It examines whether all affected parties have meaningful opportunities to participate, influence, and access information.
+    - **Distributional Equity:** Addresses the fair and just distribution of benefits and burdens. It questions whether resources, services, and environmental risks are equitably shared among all groups, avoiding disproportionate impacts on any particular community.
+    - **Structural Equity:** Seeks to identify and address the underlying systemic barriers, institutional practices, and power imbalances that perpetuate inequities. It aims to transform these structures to create a more just society.
+
+    **IMPORTANT - Output Style & Tone:** Please write your analysis in clear, accessible language. Avoid overly academic or technical jargon.
+    Crucially, your analysis should be presented in a **tentative, suggestive, or indicative tone**. Avoid definitive or authoritative statements. You might use phrases such as: "This could suggest...", "It may indicate...", "A possible interpretation is...", "It appears to...", "Could be seen as...", "There seems to be an indication that...", "The document seems to imply...", "It might be perceived as...", "It might suggest the presence of...". If information is not explicitly available in the document, you may state that it is not directly mentioned or that the document does not appear to provide sufficient detail.
+    **Provide a comprehensive response, aiming for detailed analysis and multiple paragraphs where appropriate for each section/point.** Elaborate thoroughly on each finding. Conclude your response with a bulleted summary of the key findings.
+""").strip()
+
+# Focus-area instructions, dedented once at import. These hold no per-query values.
+_PROMPT_TEMPLATES: Dict[str, str] = {
+    "custom": textwrap.dedent("""
+        **Your Task:** You are an equity analyst. Your goal is to analyze the uploaded 'User Document' based on a specific set of custom instructions provided by the user. You should strive to follow these instructions while using the COEQWAL Equity Framework as a guiding lens.
+
+        {base_intro}
+
+        **Your Analysis Steps:**
+        1.  Thoroughly consider the User's Custom Focus Instructions (given with the request details below).
+        2.  You may identify and extract all parts from the User Document that appear relevant to these instructions and the user's query.
+        3.  Where applicable, you might consider how the COEQWAL dimensions (Recognition, Procedure, Distribution, Structure) could help illuminate the analysis as per the user's instructions.
+        4.  Strive to provide a balanced view, discussing both potential strengths and possible weaknesses that you might identify.
+        5.  Where possible, you may refer to instances or examples from the User Document that could support your observations.
+        6.  If the document seems to lack the necessary information to follow the instructions, it may be appropriate to state this limitation.
+
+        **Final Output:** Provide a detailed analysis that directly addresses the User's Custom Focus Instructions. Start with a clear overview, then offer the detailed analysis, and conclude with a bulleted summary of your key findings. Ensure comprehensive coverage.
+    """).strip(),
+    "vulnerable_groups": textwrap.dedent("""
+        **Your Task:** You are an equity analyst. Your primary goal is to analyze how the uploaded 'User Document' discusses or potentially impacts **vulnerable groups**. You should use the user's query and the COEQWAL Equity Framework to guide your analysis.
+
+        {base_intro}
+
+        **Instructions for Vulnerable Group Analysis:**
+        1.  **Identify Vulnerable Groups:** You might look for any groups in the User Document that could be negatively affected or appear to have special needs (e.g., based on income, race, location, disability, language, etc.). Elaborate on any groups identified.
+        2.  **Recognition (Recognitional Equity):** Consider if the document seems to acknowledge these groups and their unique situations, or if they might be overlooked. Provide comprehensive detail.
+        3.  **Fair Process (Procedural Equity):** Does the document appear to describe a fair process for these groups to participate in decisions or potentially receive help? Detail the mechanisms or lack thereof.
+        4.  **Fair Outcomes (Distributional Equity):** Could the document suggest whether these groups might receive a fair share of benefits and appear protected from harm? Provide a thorough assessment.
+        5.  **Addressing Root Causes (Structural Equity):** Does the document seem to address any long-standing barriers or systems that might disadvantage these groups? Elaborate on the structural aspects.
+        6.  **Suggest Evidence:** Where possible, you may refer to specific examples or quotes from the *User Document* that could support your observations.
+        7.  **Present a Balanced View:** Discuss both the potential strengths (positive considerations) and possible weaknesses (potential concerns) that you might discern in the User Document comprehensively.
+        8.  **Handle Missing Information:** If the User Document appears to lack detail on this topic, it may be appropriate to state this clearly.
+
+        **Final Output:** Provide a **thorough and comprehensive** analysis focused on vulnerable groups, supported by specific examples from the document. Start with a clear overview and ensure each point is well-developed.
+    """).strip(),
+    "severity_of_impact": textwrap.dedent("""
+        **Your Task:** You are an equity analyst. Your primary goal is to assess the **potential severity of impacts**—both positive and negative—that might be described or implied in the uploaded 'User Document'. You should use the user's query and the COEQWAL Equity Framework to guide your analysis of how these potential impacts are handled.
+
+        {base_intro}
+
+        **Instructions for Severity of Impact Analysis:**
+        1.  **Identify Key Impacts:** You might try to identify the main potential consequences or outcomes (both positive and negative) that could be suggested by the actions or policies described in the User Document. Elaborate on these impacts.
+        2.  **Assess Severity:** For each identified impact, consider how serious it might be. This could involve evaluating the potential number of people affected, the possible duration of the impact, and its apparent reversibility. Provide detailed insights.
+        3.  **Distribution of Severe Impacts (Distributional Equity):** Does the document seem to indicate if the most severe potential negative impacts might be unfairly concentrated on certain groups? Detail any disproportionate effects.
+        4.  **Acknowledgement of Severity (Recognitional Equity):** Could the document suggest whether it acknowledges that some groups might be potentially impacted more severely than others? Provide comprehensive detail on this recognition.
+        5.  **Process for Addressing Severe Impacts (Procedural Equity):** Does the document appear to describe a fair process for evaluating and possibly dealing with severe impacts? Elaborate on these processes.
+        6.  **Structural Link to Severity (Structural Equity):** Do the severe potential impacts seem to stem from deeper, systemic issues? Discuss any apparent structural connections.
+        7.  **Suggest Evidence:** Where possible, you may refer to specific examples or data from the *User Document* that could support your observations.
+        8.  **Present a Balanced View:** Discuss both significant potential positive outcomes and possible severe negative impacts comprehensively.
+        9.  **Handle Missing Information:** If the User Document appears to lack detail on the severity of impacts, it may be appropriate to state this clearly.
+
+        **Final Output:** Provide a **thorough and comprehensive** analysis focused on the potential severity of impact, supported by specific examples from the document. Start with a clear overview and ensure each point is well-developed.
+    """).strip(),
+    "mitigation_strategies": textwrap.dedent("""
+        **Your Task:** You are an equity analyst. Your primary goal is to evaluate the **mitigation strategies** (plans to reduce harm) that might be discussed or implied in the uploaded 'User Document'. You should use the user's query and the COEQWAL Equity Framework to assess how fair and potentially effective these strategies appear to be.
+
+        {base_intro}
+
+        **Instructions for Mitigation Strategy Analysis:**
+        1.  **Identify Mitigation Strategies:** You might look for any specific plans or actions in the User Document that appear to be designed to prevent, reduce, or address potential negative impacts. Provide a detailed list and description.
+        2.  **Evaluate Strategy Fairness and Effectiveness:**
+            *   **Recognition:** Do the strategies seem to consider the unique needs of the people who might be most affected? Elaborate on this consideration.
+            *   **Fair Process:** Was the process for considering or creating these strategies seemingly fair and inclusive? Detail the procedural aspects.
+            *   **Fair Outcomes:** Could the strategies actually help those who might need it most, or do they appear to introduce new potential challenges? Provide a thorough assessment of outcomes.
+            *   **Addressing Root Causes:** Do the strategies seem to address the underlying problem, or could they be perceived as more of a temporary measure? Elaborate on their systemic impact.
+        3.  **Consider Unintended Consequences:** Does the User Document hint at potential new problems that the strategies themselves might inadvertently create? Discuss these potential issues.
+        4.  **Assess Sufficiency:** Do the strategies appear to be sufficiently robust to address the problem they are meant to target? Provide a comprehensive assessment.
+        5.  **Suggest Evidence:** Where possible, you may refer to specific details from the *User Document* that could support your evaluation.
+        6.  **Present a Balanced View:** Discuss both the potential strengths and possible weaknesses of the suggested mitigation strategies comprehensively.
+        7.  **Handle Missing Information:** If the User Document appears to lack detail on mitigation strategies, it may be appropriate to state this clearly.
+
+        **Final Output:** Provide a **thorough and comprehensive** analysis focused on mitigation strategies, supported by specific examples from the document. Start with a clear overview and ensure each point is well-developed.
+    """).strip(),
+    "general": textwrap.dedent("""
+        **Your Task:** You are an equity analyst. Your goal is to provide a balanced analysis of the uploaded 'User Document' based on the user's query, using the COEQWAL Equity Framework (Recognition, Procedure, Distribution, and Structure) as your guide. You might identify both potential strengths and possible areas of concern.
+
+        {base_intro}
+
+        **Instructions for General Analysis:**
+        1.  **Search the User Document:** You may identify sections of the document that appear relevant to the user's query.
+        2.  **Apply COEQWAL Framework:** For each relevant part, it might be useful to evaluate it using the four dimensions: Recognition, Procedure, Distribution, and Structure. Provide comprehensive details for each.
+        3.  **Identify Strengths and Potential Concerns:** Consider whether certain points could be interpreted as positive alignments with equity or as potential areas of concern. Elaborate thoroughly on these findings.
+        4.  **Suggest Evidence:** Where possible, you may refer to instances or examples from the *User Document* that could support your observations.
+        5.  **Address Information Gaps:** If the User Document appears to lack detail on a specific aspect, it may be appropriate to note this limitation.
+
+        **Final Output:** Provide a balanced analysis of the User Document. Start with a clear overview, then offer the detailed analysis, and conclude with a bulleted summary of your key potential strengths and concerns. Ensure comprehensive coverage for all aspects.
+    """).strip(),
+}
+_PROMPT_TEMPLATES = {k: v.replace("{base_intro}", _BASE_INTRO_TEMPLATE) for k, v in _PROMPT_TEMPLATES.items()}
+
+# Per-query details appended after the static instructions; filled by _get_system_prompt.
+_REQUEST_DETAILS_TEMPLATE = textwrap.dedent("""
+    --- START CONTEXT FROM COEQWAL DOCUMENT ---
+    {local_context_str}
+    --- END CONTEXT FROM COEQWAL DOCUMENT ---
+
+    **User Document Name:** {original_filename}
+    **User Query:** {query}
+""").strip()
+_CUSTOM_REQUEST_DETAILS_TEMPLATE = _REQUEST_DETAILS_TEMPLATE + "\n\n" + textwrap.dedent("""
+    **User's Custom Focus Instructions:**
+    --- START OF USER INSTRUCTIONS ---
+    {custom_instructions}
+    --- END OF USER INSTRUCTIONS ---
+""").strip()
+
+def _compile_prompt_template(template: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Splits a format template once into (literal_text, field_name) segments for _render_prompt."""
+    return tuple((literal, field_name) for literal, field_name, _, _ in string.Formatter().parse(template))
+
+def _render_prompt(segments: Tuple[Tuple[str, Optional[str]], ...], values: Dict[str, str]) -> str:
+    """Fills compiled template segments with a single join (no per-call template parsing)."""
+    parts: List[str] = []
+    append = parts.append
+    for literal, field_name in segments:
+        append(literal)
+        if field_name is not None:
+            append(values[field_name])
+    return "".join(parts)
+
+# Static prefix text followed by the compiled per-query details, per focus area
+_COMPILED_PROMPTS: Dict[str, Tuple[Tuple[str, Optional[str]], ...]] = {
+    k: ((v + "\n\n", None),) + _compile_prompt_template(
+        _CUSTOM_REQUEST_DETAILS_TEMPLATE if k == "custom" else _REQUEST_DETAILS_TEMPLATE
+    )
+    for k, v in _PROMPT_TEMPLATES.items()
+}
+
+# --- Multi-focus requests (several analyses of one document in a single JSON-mode call) ---
+# Instruction block of each focus-area prompt, i.e. everything after the shared framework preamble
+_FOCUS_INSTRUCTIONS: Dict[str, str] = {
+    k: v.partition(_BASE_INTRO_TEMPLATE)[2].strip() for k, v in _PROMPT_TEMPLATES.items() if k != "custom"
+}
+_MULTI_FOCUS_INTRO = textwrap.dedent("""
+    **Your Task:** You are an equity analyst. Answer several analysis requests about the uploaded 'User Document' in a single response, using the COEQWAL Equity Framework (Recognition, Procedure, Distribution, and Structure) as your guide. Each request names the focus area whose instructions below apply to it.
+""").strip()
+_MULTI_FOCUS_OUTPUT_FORMAT = textwrap.dedent("""
+    **Output Format:** Respond with a single JSON object and nothing else. It must contain exactly one key per request ID listed under "Analysis Requests". Each value is that request's complete analysis: a string (Markdown is allowed inside it) or, when the request gives a JSON shape, an object of exactly that shape with every "..." placeholder replaced by detailed analysis text (use "Not explicitly indicated by the document." where nothing applies). Do not put source citations in the values. Give every request the full depth its focus-area instructions ask for.
+""").strip()
+_MULTI_FOCUS_DETAILS_TEMPLATE = textwrap.dedent("""
+    --- START CONTEXT FROM COEQWAL DOCUMENT ---
+    {local_context_str}
+    --- END CONTEXT FROM COEQWAL DOCUMENT ---
+
+    **User Document Name:** {original_filename}
+    **Analysis Requests:**
+    {requests}
+""").strip()
+
+_LOCAL_CONTEXT_CACHE_SIZE = 256 # Formatted local-context blocks kept by _format_local_context_for_prompt
+_SYSTEM_PROMPT_CACHE_SIZE = 256 # Rendered prompts kept by _get_system_prompt
+
+# Local source blocks for the prompt, keyed on (has score, has position) so each block is one format call
+_LOCAL_SOURCE_TEMPLATES = {
+    (True, True): "-- Local Source {i}/{n} | Score: {score:.4f} | Section: {section} | Position: {pos}/{total} --\n{text}",
+    (True, False): "-- Local Source {i}/{n} | Score: {score:.4f} | Section: {section} --\n{text}",
+    (False, True): "-- Local Source {i}/{n} | Section: {section} | Position: {pos}/{total} --\n{text}",
+    (False, False): "-- Local Source {i}/{n} | Section: {section} --\n{text}",
+}
+
+_HEX_WHITESPACE_TABLE = str.maketrans("", "", " \t\n\r\f\v")
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+def decode_hex_utf16le(hex_string: str) -> str:
+    """
+    Try to decode hex-encoded UTF-16LE text snippets to readable string.
+    Returns original string on failure.
+    """
+    # Strip whitespace/newlines in one C-level pass (skipped when there is none), then reject
+    # non-hex input before allocating bytes
+    hex_str_clean = hex_string if hex_string.isalnum() else hex_string.translate(_HEX_WHITESPACE_TABLE)
+    if not hex_str_clean or len(hex_str_clean) % 4 or not _HEX_DIGITS.issuperset(hex_str_clean):
+        return hex_string
+    try:
+        return bytes.fromhex(hex_str_clean).decode('utf-16le')
+    except ValueError:
+        return hex_string
+
+@dataclass(slots=True)
+class UserSession:
+    """Document and analysis state for one chat session (values of HybridRAGSystem.user_sessions)."""
+    original_filename: str
+    file_id: Optional[str] = None
+    vector_store_id: Optional[str] = None
+    status: str = "initial_upload_pending" # Upload / vector store phase
+    analysis_status: str = "pending" # pending, in_progress, completed, failed
+    analysis_result_path: Optional[str] = None
+    analysis_error: Optional[str] = None
+    temp_file_path: Optional[str] = None # Tracked so the analyzer / end-session can clean it up
+    file_search_tool: Optional[Dict[str, Any]] = None # Built once when the vector store is ready
+    content_hash: Optional[str] = None # BLAKE2b of the uploaded bytes; idempotency key for re-uploads
+    created_at: float = field(default_factory=time.monotonic)
+    last_active: float = field(default_factory=time.monotonic) # Refreshed by queries and status polls; drives idle expiry
+    status_changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False) # Replaced on every notify
+
+    def notify_status_change(self) -> None:
+        """Wakes everyone waiting on the current status_changed event; later waiters get a fresh one."""
+        changed, self.status_changed = self.status_changed, asyncio.Event()
+        changed.set()
+
 class HybridRAGSystem:
     def __init__(self, openai_interaction: OpenAIInteraction):
         self.config = settings
         self.openai_interaction = openai_interaction
+        # Settings read on every query, resolved once here
+        self._top_k_local = self.config.TOP_K_LOCAL
+        self._responses_model = self.config.RESPONSES_MODEL
+        self._max_output_tokens = self.config.MAX_OUTPUT_TOKENS
+        self._max_num_results = getattr(self.config, "MAX_NUM_RESULTS", 5)
         self.local_db = get_local_db()
         if self.local_db is None: logger.warning("HybridRAGSystem initialized WITHOUT a functional local database.")
         else: logger.info("HybridRAGSystem initialized WITH local database.")
-        self.user_sessions: Dict[str, Dict[str, Any]] = {}
-
-    def add_user_document_for_session(self, session_id: str, file_path: str, original_filename: str) -> Tuple[bool, str]:
+        # Warm the local embedding model in the background so the first query doesn't pay for it
+        self._local_db_ready = threading.Event()
+        if self.local_db is not None and self.local_db.model is not None:
+            threading.Thread(target=self._warm_up_local_db, name="local-db-warmup", daemon=True).start()
+        else:
+            self._local_db_ready.set() # Nothing to warm up
+        # Only ever read and mutated on the event loop (worker threads just run local searches), so no lock is needed
+        self.user_sessions: Dict[str, UserSession] = {}
+        # Formatted local context keyed on the (chunk id, rounded score) sequence of the search results
+        self._local_context_cache: "OrderedDict[Tuple[Tuple[Any, float], ...], str]" = OrderedDict()
+        # Rendered system prompts; batch analysis re-renders the same document/context across focus areas
+        self._system_prompt_cache = TTLCache(_SYSTEM_PROMPT_CACHE_SIZE)
+        # Full (answer, local_chunks, openai_sources) results for repeated questions against the same document
+        self._answer_cache = TTLCache(self.config.ANSWER_CACHE_SIZE, self.config.ANSWER_CACHE_TTL_SECONDS)
+        # Same results keyed on the raw session question, checked before local retrieval and prompt assembly
+        self._session_query_cache = TTLCache(self.config.SESSION_QUERY_CACHE_SIZE, self.config.SESSION_QUERY_CACHE_TTL_SECONDS)
+        # Near-duplicate (rephrased) session questions, matched on local query embeddings
+        self._semantic_cache = SemanticCache(self.config.SEMANTIC_CACHE_THRESHOLD)
+        # Bounds outstanding Responses API calls; identical in-flight questions share one call
+        self._openai_semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENT_OPENAI_REQUESTS)
+        self._inflight_answers: Dict[str, asyncio.Task] = {}
+        # Background OpenAI resource deletions (remove_user_session_resources with wait=False)
+        self._cleanup_tasks: set = set()
+
+    def _warm_up_local_db(self) -> None:
+        try:
+            self.local_db.warm_up()
+        finally:
+            self._local_db_ready.set()
+
+    def is_ready(self) -> bool:
+        """True once the local embedding model warm-up has finished (or there was nothing to warm up)."""
+        return self._local_db_ready.is_set()
+
+    def touch_session(self, session_id: str) -> Optional[UserSession]:
+        """Returns the tracked session (or None) and marks it as active now."""
+        session = self.user_sessions.get(session_id)
+        if session is not None: session.last_active = time.monotonic()
+        return session
+
+    def idle_session_ids(self, max_idle_seconds: float) -> List[str]:
+        """Sessions untouched for max_idle_seconds whose document is not still being ingested or analyzed."""
+        cutoff = time.monotonic() - max_idle_seconds
+        return [session_id for session_id, session in self.user_sessions.items()
+                if session.last_active < cutoff and session.analysis_status not in ("pending", "in_progress")]
+
+    async def add_user_document_for_session(self, session_id: str, file_path: str, original_filename: str,
+                                            vector_store_expires_after_days: int = 0) -> Tuple[bool, str]:
         logger.info(f"Processing user document for session '{session_id}': '{original_filename}' from path '{file_path}'")
 
         # --- ASSUME session_id is ALREADY initialized in self.user_sessions by main.py ---
         # If it's not, that's an error in the calling code (main.py's upload_document)
-        if session_id not in self.user_sessions:
+        session = self.user_sessions.get(session_id)
+        if session is None:
             logger.error(f"Session {session_id} not pre-initialized in user_sessions for add_user_document_for_session.")
             return False, "Internal error: Session not tracked correctly."
         
         # Update the status to reflect the current phase
-        self.user_sessions[session_id]["status"] = "uploading_file"
+        session.status = "uploading_file"
 
-        file_id = self.openai_interaction.upload_file(file_path, purpose="assistants")
+        file_id = await self.openai_interaction.aupload_file(file_path, purpose="assistants")
         if not file_id:
             msg = f"Failed to upload file {original_filename} for session {session_id}."
             logger.error(msg)
-            self.user_sessions[session_id]["status"] = "failed_upload"
+            session.status = "failed_upload"
             return False, msg
         
-        self.user_sessions[session_id]["file_id"] = file_id 
-        self.user_sessions[session_id]["status"] = "creating_vs"
+        session.file_id = file_id 
+        session.status = "creating_vs"
 
         vs_name = f"vs_{session_id}_{original_filename}".replace(" ", "_")[:100]
-        vector_store_id = self.openai_interaction.create_vector_store_with_files(name=vs_name, file_ids=[file_id])
+        vector_store_id = await self.openai_interaction.acreate_vector_store_with_files(
+            name=vs_name, file_ids=[file_id], expires_after_days=vector_store_expires_after_days
+        )
         if not vector_store_id:
             msg = f"Failed to create Vector Store for file ID {file_id} (session {session_id}). Cleaning up."
             logger.error(msg)
             # Only delete the file if VS creation failed, but keep it tracked in user_sessions for overall session cleanup
-            self.openai_interaction.delete_file(file_id) 
-            self.user_sessions[session_id]["status"] = "failed_vs_creation"
+            await self.openai_interaction.adelete_file(file_id)
+            session.status = "failed_vs_creation"
             return False, msg
         
-        self.user_sessions[session_id]["vector_store_id"] = vector_store_id 
-        self.user_sessions[session_id]["status"] = "vs_processing"
+        session.vector_store_id = vector_store_id 
+        session.status = "vs_processing"
 
-        processing_success = self.openai_interaction.wait_for_vector_store_file_processing(vector_store_id=vector_store_id, file_id=file_id)
+        processing_success = await self.openai_interaction.await_vector_store_file_processing(vector_store_id=vector_store_id, file_id=file_id)
         
         # Final status update for the upload/VS processing part
-        self.user_sessions[session_id]["status"] = "completed" if processing_success else "failed_vs_processing"
+        session.status = "completed" if processing_success else "failed_vs_processing"
+        if processing_success:
+            session.file_search_tool = self._file_search_tool(vector_store_id)
 
         if not processing_success:
             msg = f"File '{original_filename}' (ID: {file_id}) failed processing in VS {vector_store_id} for session {session_id}. File search may fail."
@@ -71,145 +352,252 @@ class HybridRAGSystem:
             logger.info(msg)
             return True, msg
 
+    def _file_search_tool(self, vector_store_id: str) -> Dict[str, Any]:
+        return {
+            "type": "file_search",
+            "vector_store_ids": [vector_store_id],
+            "max_num_results": self._max_num_results,
+        }
+
+    async def attach_existing_vector_store(self, session_id: str, vector_store_id: str, file_id: Optional[str]) -> bool:
+        """
+        Points a pre-initialized session at a vector store kept from an earlier upload of the same document,
+        skipping upload and indexing. Returns False (session untouched) if the store is gone, expired or not ready.
+        """
+        session = self.user_sessions.get(session_id)
+        if session is None:
+            logger.error(f"Session {session_id} not pre-initialized in user_sessions for attach_existing_vector_store.")
+            return False
+        if await self.openai_interaction.aget_vector_store_status(vector_store_id) != "completed":
+            return False
+        session.file_id = file_id
+        session.vector_store_id = vector_store_id
+        session.file_search_tool = self._file_search_tool(vector_store_id)
+        session.status = "completed"
+        logger.info(f"Session {session_id}: Reusing existing Vector Store {vector_store_id}.")
+        return True
+
+    async def add_user_documents_batch(
+        self,
+        items: List[Tuple[str, str, str]],
+        max_concurrency: int = 8,
+        requests_per_minute: float = 100
+    ) -> List[Tuple[bool, str]]:
+        """
+        Ingests many (session_id, file_path, original_filename) documents concurrently.
+        At most max_concurrency ingestions run at once and new ones start at no more than
+        requests_per_minute. Sessions not yet tracked are registered here.
+        Returns (success, message) per item, in input order.
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        limiter = AsyncRateLimiter(requests_per_minute)
+
+        async def ingest_one(session_id: str, file_path: str, original_filename: str) -> Tuple[bool, str]:
+            async with semaphore:
+                await limiter.acquire()
+                session = self.user_sessions.setdefault(
+                    session_id, UserSession(original_filename=original_filename, temp_file_path=file_path)
+                )
+                try:
+                    return await self.add_user_document_for_session(session_id, file_path, original_filename)
+                except Exception as e:
+                    logger.error(f"Batch ingestion failed for session '{session_id}' ('{original_filename}'): {e}", exc_info=True)
+                    session.status = "failed"
+                    return False, f"Unexpected error while processing '{original_filename}': {e}"
+
+        logger.info(f"Batch ingesting {len(items)} documents (concurrency {max_concurrency}, {requests_per_minute} req/min).")
+        return list(await asyncio.gather(*(ingest_one(*item) for item in items)))
+
     def _get_system_prompt(self, focus_area: str, original_filename: str, local_context_str: str, query: str, custom_instructions: Optional[str] = None) -> str:
         """
-        Selects or generates the appropriate system prompt based on the focus area.
+        Selects the appropriate pre-rendered system prompt template based on the focus area
+        and appends the per-query values after its static instructions.
         Ensures an indicative, tentative, or suggestive tone while preserving directives.
         **Emphasizes generating more content for sections.**
         """
-        base_intro = f"""
-            **Framework Definitions (from COEQWAL Context - Four Equity Dimensions):**
-            - **Recognitional Equity:** Concerns the fair and inclusive recognition of diverse groups, their unique identities, histories, and cultural values in policies, processes, and outcomes. It asks if all voices are seen and valued.
-            - **Procedural Equity:** Focuses on fair and inclusive processes for decision-making. It examines whether all affected parties have meaningful opportunities to participate, influence, and access information.
-            - **Distributional Equity:** Addresses the fair and just distribution of benefits and burdens. It questions whether resources, services, and environmental risks are equitably shared among all groups, avoiding disproportionate impacts on any particular community.
-            - **Structural Equity:** Seeks to identify and address the underlying systemic barriers, institutional practices, and power imbalances that perpetuate inequities. It aims to transform these structures to create a more just society.
-
-            --- START CONTEXT FROM COEQWAL DOCUMENT ---
-            {local_context_str if local_context_str else 'No definitions or context from the COEQWAL document were retrieved from the COEQWAL Framework document.'}
-            --- END CONTEXT FROM COEQWAL DOCUMENT ---
-
-            **User Document Name:** {original_filename}
-            **User Query:** {query}
-
-            **IMPORTANT - Output Style & Tone:** Please write your analysis in clear, accessible language. Avoid overly academic or technical jargon.
-            Crucially, your analysis should be presented in a **tentative, suggestive, or indicative tone**. Avoid definitive or authoritative statements. You might use phrases such as: "This could suggest...", "It may indicate...", "A possible interpretation is...", "It appears to...", "Could be seen as...", "There seems to be an indication that...", "The document seems to imply...", "It might be perceived as...", "It might suggest the presence of...". If information is not explicitly available in the document, you may state that it is not directly mentioned or that the document does not appear to provide sufficient detail.
-            **Provide a comprehensive response, aiming for detailed analysis and multiple paragraphs where appropriate for each section/point.** Elaborate thoroughly on each finding. Conclude your response with a bulleted summary of the key findings.
+        # "custom" needs instructions to fill its template; unknown focus areas use the general COEQWAL prompt
+        if focus_area == "custom" and not custom_instructions: focus_area = "general"
+        if focus_area not in _COMPILED_PROMPTS: focus_area = "general"
+
+        # local_context_str usually comes from _local_context_cache, so its (cached) str hash makes this key cheap
+        cache_key = (focus_area, original_filename, local_context_str, query, custom_instructions or "")
+        prompt = self._system_prompt_cache.get(cache_key)
+        if prompt is None:
+            prompt = _render_prompt(_COMPILED_PROMPTS[focus_area], {
+                "local_context_str": local_context_str if local_context_str else _NO_LOCAL_CONTEXT_MSG,
+                "original_filename": original_filename,
+                "query": query,
+                "custom_instructions": custom_instructions or "",
+            })
+            self._system_prompt_cache.set(cache_key, prompt)
+        return prompt
+
+    async def _prepare_response_request(
+        self,
+        session_id: str,
+        query: str,
+        focus_area: str,
+        custom_instructions: Optional[str]
+    ) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]], Optional[str]]:
         """
-        
-        if focus_area == "custom" and custom_instructions:
-            return textwrap.dedent(f"""
-                **Your Task:** You are an equity analyst. Your goal is to analyze the uploaded 'User Document' based on a specific set of custom instructions provided by the user. You should strive to follow these instructions while using the COEQWAL Equity Framework as a guiding lens.
-
-                {base_intro}
-
-                **User's Custom Focus Instructions:**
-                --- START OF USER INSTRUCTIONS ---
-                {custom_instructions}
-                --- END OF USER INSTRUCTIONS ---
-
-                **Your Analysis Steps:**
-                1.  Thoroughly consider the User's Custom Focus Instructions.
-                2.  You may identify and extract all parts from the User Document that appear relevant to these instructions and the user's query.
-                3.  Where applicable, you might consider how the COEQWAL dimensions (Recognition, Procedure, Distribution, Structure) could help illuminate the analysis as per the user's instructions.
-                4.  Strive to provide a balanced view, discussing both potential strengths and possible weaknesses that you might identify.
-                5.  Where possible, you may refer to instances or examples from the User Document that could support your observations.
-                6.  If the document seems to lack the necessary information to follow the instructions, it may be appropriate to state this limitation.
-
-                **Final Output:** Provide a detailed analysis that directly addresses the User's Custom Focus Instructions. Start with a clear overview, then offer the detailed analysis, and conclude with a bulleted summary of your key findings. Ensure comprehensive coverage.
-            """).strip()
-
-        elif focus_area == "vulnerable_groups":
-            return textwrap.dedent(f"""
-                **Your Task:** You are an equity analyst. Your primary goal is to analyze how the uploaded 'User Document' discusses or potentially impacts **vulnerable groups**. You should use the user's query and the COEQWAL Equity Framework to guide your analysis.
-
-                {base_intro}
-
-                **Instructions for Vulnerable Group Analysis:**
-                1.  **Identify Vulnerable Groups:** You might look for any groups in the User Document that could be negatively affected or appear to have special needs (e.g., based on income, race, location, disability, language, etc.). Elaborate on any groups identified.
-                2.  **Recognition (Recognitional Equity):** Consider if the document seems to acknowledge these groups and their unique situations, or if they might be overlooked. Provide comprehensive detail.
-                3.  **Fair Process (Procedural Equity):** Does the document appear to describe a fair process for these groups to participate in decisions or potentially receive help? Detail the mechanisms or lack thereof.
-                4.  **Fair Outcomes (Distributional Equity):** Could the document suggest whether these groups might receive a fair share of benefits and appear protected from harm? Provide a thorough assessment.
-                5.  **Addressing Root Causes (Structural Equity):** Does the document seem to address any long-standing barriers or systems that might disadvantage these groups? Elaborate on the structural aspects.
-                6.  **Suggest Evidence:** Where possible, you may refer to specific examples or quotes from the *User Document* that could support your observations.
-                7.  **Present a Balanced View:** Discuss both the potential strengths (positive considerations) and possible weaknesses (potential concerns) that you might discern in the User Document comprehensively.
-                8.  **Handle Missing Information:** If the User Document appears to lack detail on this topic, it may be appropriate to state this clearly.
-
-                **Final Output:** Provide a **thorough and comprehensive** analysis focused on vulnerable groups, supported by specific examples from the document. Start with a clear overview and ensure each point is well-developed.
-                """).strip()
-
-        elif focus_area == "severity_of_impact":
-            return textwrap.dedent(f"""
-                **Your Task:** You are an equity analyst. Your primary goal is to assess the **potential severity of impacts**—both positive and negative—that might be described or implied in the uploaded 'User Document'. You should use the user's query and the COEQWAL Equity Framework to guide your analysis of how these potential impacts are handled.
-
-                {base_intro}
-
-                **Instructions for Severity of Impact Analysis:**
-                1.  **Identify Key Impacts:** You might try to identify the main potential consequences or outcomes (both positive and negative) that could be suggested by the actions or policies described in the User Document. Elaborate on these impacts.
-                2.  **Assess Severity:** For each identified impact, consider how serious it might be. This could involve evaluating the potential number of people affected, the possible duration of the impact, and its apparent reversibility. Provide detailed insights.
-                3.  **Distribution of Severe Impacts (Distributional Equity):** Does the document seem to indicate if the most severe potential negative impacts might be unfairly concentrated on certain groups? Detail any disproportionate effects.
-                4.  **Acknowledgement of Severity (Recognitional Equity):** Could the document suggest whether it acknowledges that some groups might be potentially impacted more severely than others? Provide comprehensive detail on this recognition.
-                5.  **Process for Addressing Severe Impacts (Procedural Equity):** Does the document appear to describe a fair process for evaluating and possibly dealing with severe impacts? Elaborate on these processes.
-                6.  **Structural Link to Severity (Structural Equity):** Do the severe potential impacts seem to stem from deeper, systemic issues? Discuss any apparent structural connections.
-                7.  **Suggest Evidence:** Where possible, you may refer to specific examples or data from the *User Document* that could support your observations.
-                8.  **Present a Balanced View:** Discuss both significant potential positive outcomes and possible severe negative impacts comprehensively.
-                9.  **Handle Missing Information:** If the User Document appears to lack detail on the severity of impacts, it may be appropriate to state this clearly.
-                
-                **Final Output:** Provide a **thorough and comprehensive** analysis focused on the potential severity of impact, supported by specific examples from the document. Start with a clear overview and ensure each point is well-developed.
-                """).strip()
-
-        elif focus_area == "mitigation_strategies":
-            return textwrap.dedent(f"""
-                **Your Task:** You are an equity analyst. Your primary goal is to evaluate the **mitigation strategies** (plans to reduce harm) that might be discussed or implied in the uploaded 'User Document'. You should use the user's query and the COEQWAL Equity Framework to assess how fair and potentially effective these strategies appear to be.
-
-                {base_intro}
-
-                **Instructions for Mitigation Strategy Analysis:**
-                1.  **Identify Mitigation Strategies:** You might look for any specific plans or actions in the User Document that appear to be designed to prevent, reduce, or address potential negative impacts. Provide a detailed list and description.
-                2.  **Evaluate Strategy Fairness and Effectiveness:**
-                    *   **Recognition:** Do the strategies seem to consider the unique needs of the people who might be most affected? Elaborate on this consideration.
-                    *   **Fair Process:** Was the process for considering or creating these strategies seemingly fair and inclusive? Detail the procedural aspects.
-                    *   **Fair Outcomes:** Could the strategies actually help those who might need it most, or do they appear to introduce new potential challenges? Provide a thorough assessment of outcomes.
-                    *   **Addressing Root Causes:** Do the strategies seem to address the underlying problem, or could they be perceived as more of a temporary measure? Elaborate on their systemic impact.
-                3.  **Consider Unintended Consequences:** Does the User Document hint at potential new problems that the strategies themselves might inadvertently create? Discuss these potential issues.
-                4.  **Assess Sufficiency:** Do the strategies appear to be sufficiently robust to address the problem they are meant to target? Provide a comprehensive assessment.
-                5.  **Suggest Evidence:** Where possible, you may refer to specific details from the *User Document* that could support your evaluation.
-                6.  **Present a Balanced View:** Discuss both the potential strengths and possible weaknesses of the suggested mitigation strategies comprehensively.
-                7.  **Handle Missing Information:** If the User Document appears to lack detail on mitigation strategies, it may be appropriate to state this clearly.
-
-                **Final Output:** Provide a **thorough and comprehensive** analysis focused on mitigation strategies, supported by specific examples from the document. Start with a clear overview and ensure each point is well-developed.
-            """).strip()
-
-        else: # Default to the general COEQWAL analysis prompt
-            return textwrap.dedent(f"""
-                **Your Task:** You are an equity analyst. Your goal is to provide a balanced analysis of the uploaded 'User Document' based on the user's query, using the COEQWAL Equity Framework (Recognition, Procedure, Distribution, and Structure) as your guide. You might identify both potential strengths and possible areas of concern.
-
-                {base_intro}
-
-                **Instructions for General Analysis:**
-                1.  **Search the User Document:** You may identify sections of the document that appear relevant to the user's query.
-                2.  **Apply COEQWAL Framework:** For each relevant part, it might be useful to evaluate it using the four dimensions: Recognition, Procedure, Distribution, and Structure. Provide comprehensive details for each.
-                3.  **Identify Strengths and Potential Concerns:** Consider whether certain points could be interpreted as positive alignments with equity or as potential areas of concern. Elaborate thoroughly on these findings.
-                4.  **Suggest Evidence:** Where possible, you may refer to instances or examples from the *User Document* that could support your observations.
-                5.  **Address Information Gaps:** If the User Document appears to lack detail on a specific aspect, it may be appropriate to note this limitation.
-
-                **Final Output:** Provide a balanced analysis of the User Document. Start with a clear overview, then offer the detailed analysis, and conclude with a bulleted summary of your key potential strengths and concerns. Ensure comprehensive coverage for all aspects.
-            """).strip()
-
-    def decode_hex_utf16le(hex_string: str) -> str:
+        Runs local retrieval and builds the kwargs shared by responses.create and responses.stream.
+
+        Returns:
+            - request kwargs (None if the request should not be sent)
+            - list of local DB source chunks (dictionaries, raw)
+            - message to hand back to the user instead of calling the model (or None); this is
+              NO_CONTEXT_ANSWER when there is neither a ready user document nor local context
         """
-        Try to decode hex-encoded UTF-16LE text snippets to readable string.
-        Returns original string on failure.
+        session_data = self.user_sessions.get(session_id)
+        file_search_tool = None
+        original_filename = "N/A"
+
+        if session_data:
+            original_filename = session_data.original_filename
+            if session_data.status == "completed":
+                file_search_tool = session_data.file_search_tool
+            elif session_data.status == "failed":
+                return None, [], "Error: Document processing failed for this session. Cannot answer."
+            else: # "in_progress" or other unexpected status
+                 logger.warning(f"Session {session_id} document status is '{session_data.status}'. May not be fully ready.")
+
+
+        # Local search is CPU-bound (embedding + cosine); start it in a worker thread now and
+        # assemble the query-independent parts of the request while it runs
+        local_task = None
+        if self.local_db and self.local_db.model:
+            local_task = asyncio.create_task(asyncio.to_thread(self.local_db.search, query, self._top_k_local))
+
+        tools = []
+        if file_search_tool: # Only add tool if a vector store is available and ready
+            tools.append(file_search_tool)
+        else:
+            logger.warning(f"No valid vector store ID for session {session_id}. OpenAI file search will not be used.")
+
+        kwargs = {
+            "model": self._responses_model,
+            #"temperature": self.config.TEMPERATURE,
+            "max_output_tokens": self._max_output_tokens,
+        }
+
+        if tools:
+            kwargs["tools"] = tools
+            kwargs["include"] = ["file_search_call.results"]
+
+        # The prompt embeds the local context, so this is where the search has to be finished
+        local_chunks = await local_task if local_task is not None else []
+
+        # Nothing to ground an answer in: skip building the prompt and the LLM call entirely
+        if not tools and not local_chunks:
+            logger.info(f"Session {session_id}: No user document and no local context; skipping model call.")
+            return None, [], NO_CONTEXT_ANSWER
+
+        local_context_str = self._format_local_context_for_prompt(local_chunks)
+        kwargs["input"] = self._get_system_prompt(
+            focus_area,
+            original_filename,
+            local_context_str,
+            query,
+            custom_instructions
+        )
+
+        return kwargs, local_chunks, None
+
+    @staticmethod
+    def _parse_response_output(output: List[Any]) -> Tuple[Optional[str], List[str]]:
         """
-        try:
-            # Clean whitespace/newlines, if any
-            hex_str_clean = ''.join(hex_string.split())
-            byte_data = bytes.fromhex(hex_str_clean)
-            return byte_data.decode('utf-16le')
-        except Exception:
-            return hex_string
+        Classifies a Responses API output list in one pass.
 
+        Returns:
+            - the first output_text of the first message item (None if there is none)
+            - file_search_call.results formatted as source snippets
+        """
+        # Output items are SDK pydantic models, so fields are read directly; anything unexpected is skipped.
+        final_answer: Optional[str] = None
+        retrieved_chunks_from_openai_tool: List[str] = []
+        append = retrieved_chunks_from_openai_tool.append
+        for item in output:
+            try:
+                item_type = item.type
+                if item_type == "message":
+                    if final_answer is not None:
+                        continue
+                    for content_item in item.content:
+                        if content_item.type == "output_text":
+                            final_answer = content_item.text.strip() or "Model returned empty answer."
+                            break
+                elif item_type == "file_search_call":
+                    for res in item.results or ():
+                        file_name = getattr(res, "filename", None) or getattr(res, "file_name", None) or "Unknown file"
+                        chunk_text = getattr(res, "text", None) or ""
+                        snippet = chunk_text[:400] + "..." if len(chunk_text) > 400 else chunk_text
+                        # Use the exact format requested by the user for OpenAI sources
+                        append(f"Source from {file_name}:\n<blockquote>{snippet}</blockquote>")
+            except AttributeError:
+                continue
+        return final_answer, retrieved_chunks_from_openai_tool
+
+    @staticmethod
+    def _answer_cache_key(query: str, focus_area: str, custom_instructions: Optional[str],
+                          request_kwargs: Dict[str, Any], local_chunks: List[Dict[str, Any]]) -> str:
+        """Stable hash of everything that determines a model answer for a session query."""
+        vector_store_ids = ",".join(
+            vs_id for tool in request_kwargs.get("tools", ()) for vs_id in tool.get("vector_store_ids", ())
+        )
+        local_ids = ",".join(str(c.get("id", "")) for c in local_chunks)
+        raw = f"{query}|{focus_area}|{custom_instructions or ''}|{vector_store_ids}|{local_ids}|{request_kwargs.get('model', '')}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
 
-    def answer_question(
+    def _session_cache_scope(self, session_id: str, focus_area: str, custom_instructions: Optional[str]) -> str:
+        """Everything except the query that a cached session answer depends on."""
+        session_data = self.user_sessions.get(session_id)
+        # The vector store id is part of the scope so a newly uploaded document never hits answers for the old one
+        vector_store_id = session_data.vector_store_id if session_data else None
+        return f"{session_id}|{vector_store_id or ''}|{focus_area}|{custom_instructions or ''}"
+
+    @staticmethod
+    def _session_query_cache_key(scope: str, query: str) -> str:
+        """Hash of (session scope, normalized query) for the exact-match pre-retrieval cache."""
+        normalized_query = " ".join(query.split()).lower()
+        return hashlib.blake2b(f"{scope}|{normalized_query}".encode("utf-8"), digest_size=16).hexdigest()
+
+    async def _lookup_session_answer(
+        self,
+        session_id: str,
+        query: str,
+        focus_area: str,
+        custom_instructions: Optional[str]
+    ) -> Tuple[Optional[Tuple[str, Tuple[Dict[str, Any], ...], Tuple[str, ...]]], str, str, Optional[Any]]:
+        """
+        Pre-retrieval cache lookups shared by answer_question and stream_answer: the exact-match session
+        query cache, then the semantic cache. Returns the cached result (or None), the session scope and
+        session cache key, and the query embedding (None if not computed) for _remember_session_answer.
+        """
+        # Repeated question in this session: skip local search, prompt build and the model call
+        session_scope = self._session_cache_scope(session_id, focus_area, custom_instructions)
+        session_cache_key = self._session_query_cache_key(session_scope, query)
+        cached = self._session_query_cache.get(session_cache_key)
+        if cached is not None:
+            logger.info(f"Session {session_id}: Session query cache hit.")
+            return cached, session_scope, session_cache_key, None
+
+        # Rephrasing of an earlier question in this session; the embedding is reused by the local search
+        query_embedding = None
+        if self._semantic_cache.enabled and self.local_db and self.local_db.model:
+            query_embedding = await asyncio.to_thread(self.local_db.embed_query, query)
+            cached = self._semantic_cache.get(session_scope, query_embedding) if query_embedding is not None else None
+            if cached is not None:
+                logger.info(f"Session {session_id}: Semantic cache hit.")
+                self._session_query_cache.set(session_cache_key, cached)
+        return cached, session_scope, session_cache_key, query_embedding
+
+    def _remember_session_answer(self, session_scope: str, session_cache_key: str, query_embedding: Optional[Any],
+                                 result: Tuple[str, Tuple[Dict[str, Any], ...], Tuple[str, ...]]) -> None:
+        """Stores a successful answer in the session query cache and, if an embedding was computed, the semantic cache."""
+        self._session_query_cache.set(session_cache_key, result)
+        if query_embedding is not None: self._semantic_cache.set(session_scope, query_embedding, result)
+
+    async def answer_question(
         self,
         session_id: str,
         query: str,
@@ -230,148 +618,382 @@ class HybridRAGSystem:
 
         logger.info(f"Answering query for session {session_id} with focus: {focus_area}")
 
-        session_data = self.user_sessions.get(session_id)
-        user_vector_store_id = None
-        original_filename = "N/A"
-
-        if session_data:
-            original_filename = session_data.get("original_filename", "N/A")
-            if session_data.get("status") == "completed":
-                user_vector_store_id = session_data.get("vector_store_id")
-            elif session_data.get("status") == "failed":
-                return "Error: Document processing failed for this session. Cannot answer.", [], []
-            else: # "in_progress" or other unexpected status
-                 logger.warning(f"Session {session_id} document status is '{session_data.get('status')}'. May not be fully ready.")
+        cached, session_scope, session_cache_key, query_embedding = await self._lookup_session_answer(
+            session_id, query, focus_area, custom_instructions
+        )
+        if cached is not None:
+            cached_answer, cached_local, cached_sources = cached
+            return cached_answer, list(cached_local), list(cached_sources)
+
+        kwargs, local_chunks, error_message = await self._prepare_response_request(session_id, query, focus_area, custom_instructions)
+        if error_message:
+            return error_message, [], []
+
+        cache_key = self._answer_cache_key(query, focus_area, custom_instructions, kwargs, local_chunks)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Session {session_id}: Answer cache hit.")
+            self._session_query_cache.set(session_cache_key, cached)
+            cached_answer, cached_local, cached_sources = cached
+            return cached_answer, list(cached_local), list(cached_sources)
+
+        # Single-flight: an identical question already in flight is awaited instead of re-sent. The call runs as
+        # its own task and every caller awaits it shielded, so one caller's cancellation (a client disconnecting)
+        # never reaches the others
+        inflight = self._inflight_answers.get(cache_key)
+        if inflight is not None:
+            logger.info(f"Session {session_id}: Coalescing with an identical in-flight request.")
+        else:
+            inflight = asyncio.create_task(self._create_answer(session_id, kwargs, local_chunks, cache_key))
+            self._inflight_answers[cache_key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight_answers.pop(cache_key, None))
+        result = await asyncio.shield(inflight)
 
+        # Only answers that made it into the answer cache (i.e. not errors) are remembered for the session
+        if self._answer_cache.get(cache_key) is result:
+            self._remember_session_answer(session_scope, session_cache_key, query_embedding, result)
 
-        local_chunks = self.local_db.search(query, top_k=self.config.TOP_K_LOCAL) if (self.local_db and self.local_db.model) else []
-        local_context_str = self._format_local_context_for_prompt(local_chunks)
-        prompt_content_string = self._get_system_prompt(
-            focus_area,
-            original_filename,
-            local_context_str,
-            query,
-            custom_instructions
-        )
+        final_answer, shared_local, shared_sources = result
+        # Return original local_chunks (raw dicts) - these will be *discarded* by generate_batch_analysis.py
+        # But the signature needs to match rag_system's original return.
+        return final_answer, list(shared_local), list(shared_sources)
 
+    async def _create_answer(
+        self,
+        session_id: str,
+        kwargs: Dict[str, Any],
+        local_chunks: List[Dict[str, Any]],
+        cache_key: str
+    ) -> Tuple[str, Tuple[Dict[str, Any], ...], Tuple[str, ...]]:
+        """Calls responses.create under the concurrency limit and parses the answer; errors become answer strings."""
         try:
-            tools = []
-            if user_vector_store_id: # Only add tool if a vector store is available and ready
-                tools.append({
-                    "type": "file_search",
-                    "vector_store_ids": [user_vector_store_id],
-                    "max_num_results": getattr(self.config, "MAX_NUM_RESULTS", 5),
-                })
+            async with self._openai_semaphore:
+                logger.info(f"Session {session_id}: Calling aclient.responses.create with include=['file_search_call.results']")
+                response = await self.openai_interaction.acall_rate_limited(
+                    self.openai_interaction.generation_client.responses.with_raw_response.create,
+                    estimate_tokens(kwargs["input"], self._max_output_tokens, self._responses_model),
+                    **kwargs
+                )
+
+            # Log full raw response for debugging (model_dump + serialization is costly, so only at DEBUG)
+            if logger.isEnabledFor(logging.DEBUG):
+                try:
+                    resp_dict = response.model_dump()
+                except Exception:
+                    resp_dict = response if isinstance(response, dict) else response.__dict__
+                logger.debug("Full OpenAI response dump: %s", json_utils.dumps(resp_dict))
             else:
-                logger.warning(f"No valid vector store ID for session {session_id}. OpenAI file search will not be used.")
+                logger.info("Session %s: Response %s returned %d output items.", session_id, getattr(response, "id", "N/A"), len(response.output))
 
+            # Sources come exclusively from file_search_call.results for JSON output
+            final_answer, retrieved_chunks_from_openai_tool = self._parse_response_output(response.output)
 
-            kwargs = {
-                "model": self.config.RESPONSES_MODEL,
-                "input": prompt_content_string,
-                #"temperature": self.config.TEMPERATURE,
-                "max_output_tokens": self.config.MAX_OUTPUT_TOKENS,
-            }
+            result = (final_answer or "No valid answer returned by the model.", tuple(local_chunks), tuple(retrieved_chunks_from_openai_tool))
+            if final_answer is not None:
+                self._answer_cache.set(cache_key, result)
+            return result
 
-            if tools:
-                kwargs["tools"] = tools
-                kwargs["include"] = ["file_search_call.results"]
+        except APIError as e:
+            logger.error(f"Session {session_id}: APIError: {e}", exc_info=False)
+            return f"Error: OpenAI API failed ({getattr(e, 'status_code', 'N/A')}).", (), ()
+        except Exception as e:
+            logger.error(f"Session {session_id}: Unexpected error: {e}", exc_info=True)
+            return "Error: An unexpected issue occurred while generating the response.", (), ()
+
+    def _get_multi_focus_prompt(self, requests: List[Tuple[str, str, str]], original_filename: str, local_context_str: str,
+                                output_templates: Dict[str, Dict[str, Any]]) -> str:
+        """Builds the prompt for answer_multi_focus: shared preamble, the instructions of each focus area used, then the requests."""
+        focus_areas = sorted({focus if focus in _FOCUS_INSTRUCTIONS else "general" for _, _, focus in requests})
+        focus_blocks = "\n\n".join(f"**Focus area `{focus}`:**\n{_FOCUS_INSTRUCTIONS[focus]}" for focus in focus_areas)
+        request_lines: List[str] = []
+        for key, query, focus in requests:
+            line = f"- `{key}` (focus area: {focus if focus in _FOCUS_INSTRUCTIONS else 'general'}): {query}"
+            if key in output_templates:
+                line += f"\n  Answer as this JSON shape: {json_utils.dumps(output_templates[key])}"
+            request_lines.append(line)
+        request_lines = "\n".join(request_lines)
+        details = _MULTI_FOCUS_DETAILS_TEMPLATE.format(
+            local_context_str=local_context_str if local_context_str else _NO_LOCAL_CONTEXT_MSG,
+            original_filename=original_filename,
+            requests=request_lines,
+        )
+        return "\n\n".join((_MULTI_FOCUS_INTRO, _BASE_INTRO_TEMPLATE, focus_blocks, _MULTI_FOCUS_OUTPUT_FORMAT, details))
 
-            logger.info(f"Session {session_id}: Calling client.responses.create with include=['file_search_call.results']")
-            response = self.openai_interaction.client.responses.create(**kwargs)
+    async def answer_multi_focus(
+        self,
+        session_id: str,
+        requests: List[Tuple[str, str, str]],
+        output_templates: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[str]]:
+        """
+        Answers several (key, query, focus_area) requests about the session's document with one
+        responses.create call in JSON mode, so the document context is retrieved and prefilled once.
+        output_templates optionally maps a request key to a JSON object with "..." placeholders that
+        the model fills in, so structured output needs no separate formatting call.
 
-            # Log full raw response for debugging
-            try:
-                resp_dict = response.model_dump()
-            except Exception:
-                resp_dict = response if isinstance(response, dict) else response.__dict__
-            logger.info(f"Full OpenAI response dump:\n{json.dumps(resp_dict, indent=2)}")
-
-            final_answer: Optional[str] = None
-            
-            # --- Parse message annotations for the answer text itself ---
-            # This is specifically for extracting the main textual answer.
-            # Sources extracted from file_search_call.results are handled separately below.
-            for item in response.output:
-                if getattr(item, "type", None) == "message" and hasattr(item, "content"):
-                    for content_item in item.content:
-                        if getattr(content_item, "type", None) == "output_text":
-                            if final_answer is None:
-                                final_answer = getattr(content_item, "text", "").strip() or "Model returned empty answer."
-                            # Removed openai_sources.append(f"Reference from file...") from here
-                            # as user wants sources exclusively from file_search_call.results for JSON output.
-                            # If you still want file citations for other purposes (e.g. debugging, a separate field),
-                            # they could be collected here.
-
-            # --- Parse retrieved chunks from file_search_call.results (as per user's explicit instruction) ---
-            retrieved_chunks_from_openai_tool: List[str] = []
-            for item in response.output:
-                if getattr(item, "type", None) == "file_search_call":
-                    results = getattr(item, "results", None)
-                    if results:
-                        for res in results:
-                            file_name = getattr(res, "file_name", None) or getattr(res, "filename", None) or "Unknown file"
-                            chunk_text = getattr(res, "text", "")
-                            snippet = chunk_text[:400] + "..." if len(chunk_text) > 400 else chunk_text
-                            # Use the exact format requested by the user for OpenAI sources
-                            retrieved_chunks_from_openai_tool.append(
-                                f"Source from {file_name}:\n<blockquote>{snippet}</blockquote>"
-                            )
-
-            if final_answer is None:
-                final_answer = "No valid answer returned by the model."
-
-            # Return original local_chunks (raw dicts) - these will be *discarded* by generate_batch_analysis.py
-            # But the signature needs to match rag_system's original return.
-            return final_answer, local_chunks, retrieved_chunks_from_openai_tool
+        Returns:
+            - answers keyed by request key: a string, or a dict for requests with an output template;
+              requests the model left out (or all, on error) are missing, and callers are expected to
+              fall back to answer_question for them
+            - list of local DB source chunks (dictionaries, raw), merged across the queries
+            - list of OpenAI source strings (file search results), shared by all answers
+        """
+        if not requests:
+            return {}, [], []
+        session_data = self.user_sessions.get(session_id)
+        if not session_data or session_data.status != "completed" or not session_data.file_search_tool:
+            logger.warning(f"Session {session_id}: No ready user document; multi-focus request skipped.")
+            return {}, [], []
+
+        # One local search per distinct query, merged into a single top-k context block
+        local_chunks: List[Dict[str, Any]] = []
+        if self.local_db and self.local_db.model:
+            queries = list(dict.fromkeys(query for _, query, _ in requests))
+            search_results = await asyncio.gather(*(asyncio.to_thread(self.local_db.search, q, self._top_k_local) for q in queries))
+            best_chunks: Dict[Any, Dict[str, Any]] = {}
+            for chunks in search_results:
+                for chunk in chunks:
+                    chunk_id = chunk.get("id", chunk.get("text"))
+                    if chunk_id not in best_chunks or chunk.get("score", 0) > best_chunks[chunk_id].get("score", 0):
+                        best_chunks[chunk_id] = chunk
+            local_chunks = sorted(best_chunks.values(), key=lambda c: c.get("score", 0), reverse=True)[:self._top_k_local]
+
+        output_templates = output_templates or {}
+        prompt = self._get_multi_focus_prompt(requests, session_data.original_filename,
+                                              self._format_local_context_for_prompt(local_chunks), output_templates)
+        max_output_tokens = min(self._max_output_tokens * len(requests), self.config.MULTI_FOCUS_MAX_OUTPUT_TOKENS)
+        kwargs = {
+            "model": self._responses_model,
+            "max_output_tokens": max_output_tokens,
+            "tools": [session_data.file_search_tool],
+            "include": ["file_search_call.results"],
+            "text": {"format": {"type": "json_object"}},
+            "input": prompt,
+        }
+        try:
+            async with self._openai_semaphore:
+                logger.info(f"Session {session_id}: Calling aclient.responses.create for {len(requests)} analyses in one request")
+                response = await self.openai_interaction.acall_rate_limited(
+                    self.openai_interaction.generation_client.responses.with_raw_response.create,
+                    estimate_tokens(prompt, max_output_tokens, self._responses_model),
+                    **kwargs
+                )
+        except APIError as e:
+            logger.error(f"Session {session_id}: APIError in multi-focus request: {e}", exc_info=False)
+            return {}, local_chunks, []
+        except Exception as e:
+            logger.error(f"Session {session_id}: Unexpected error in multi-focus request: {e}", exc_info=True)
+            return {}, local_chunks, []
+
+        answer_text, openai_sources = self._parse_response_output(response.output)
+        try:
+            parsed = json_utils.loads(answer_text) if answer_text else None
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, dict):
+            logger.error(f"Session {session_id}: Multi-focus response was not a JSON object.")
+            return {}, local_chunks, openai_sources
+
+        answers: Dict[str, Any] = {}
+        for key, _, _ in requests:
+            value = parsed.get(key)
+            if key in output_templates:
+                if isinstance(value, dict) and value: answers[key] = value
+            elif isinstance(value, str) and value.strip():
+                answers[key] = value.strip()
+        if len(answers) < len(requests):
+            logger.warning(f"Session {session_id}: Multi-focus response answered {len(answers)}/{len(requests)} requests.")
+        return answers, local_chunks, openai_sources
+
+    async def stream_answer(
+        self,
+        session_id: str,
+        query: str,
+        focus_area: str = "general",
+        custom_instructions: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of answer_question using streamed responses.create. Shares its caches: a cached
+        answer is sent as a single delta, and a completed stream is stored like answer_question's result.
+
+        Yields event dicts:
+            - {"type": "delta", "text": ...} for each chunk of answer text as it is generated
+            - {"type": "sources", "openai_sources": [...]} once, after the response completes
+            - {"type": "error", "detail": ...} if the answer cannot be produced
+        """
+        if not query:
+            yield {"type": "error", "detail": "Please provide a query."}
+            return
+
+        logger.info(f"Streaming answer for session {session_id} with focus: {focus_area}")
+
+        cached, session_scope, session_cache_key, query_embedding = await self._lookup_session_answer(
+            session_id, query, focus_area, custom_instructions
+        )
+        if cached is None:
+            kwargs, local_chunks, error_message = await self._prepare_response_request(session_id, query, focus_area, custom_instructions)
+            if error_message == NO_CONTEXT_ANSWER:
+                yield {"type": "delta", "text": error_message}
+                yield {"type": "sources", "openai_sources": []}
+                return
+            if error_message:
+                yield {"type": "error", "detail": error_message}
+                return
+            cache_key = self._answer_cache_key(query, focus_area, custom_instructions, kwargs, local_chunks)
+            cached = self._answer_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Session {session_id}: Answer cache hit.")
+                self._session_query_cache.set(session_cache_key, cached)
+        if cached is not None:
+            yield {"type": "delta", "text": cached[0]}
+            yield {"type": "sources", "openai_sources": list(cached[2])}
+            return
+
+        # The model's stream is drained into a queue by a separate task, so the concurrency slot is held only
+        # while OpenAI is generating; a slow client reads from the queue without blocking other callers
+        events: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(self._produce_stream_events(session_id, kwargs, events))
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+        finally:
+            if not producer.done(): producer.cancel() # Client went away: stop generating tokens nobody reads
+
+        completed = await producer
+        if completed is not None:
+            final_answer, openai_sources = completed
+            result = (final_answer, tuple(local_chunks), tuple(openai_sources))
+            self._answer_cache.set(cache_key, result)
+            self._remember_session_answer(session_scope, session_cache_key, query_embedding, result)
+
+    async def _produce_stream_events(self, session_id: str, kwargs: Dict[str, Any],
+                                     events: asyncio.Queue) -> Optional[Tuple[str, List[str]]]:
+        """
+        Runs responses.create(stream=True) under the concurrency limit and the shared rate limiter (headers
+        feed it, 429s are retried) and puts stream_answer's event dicts on events, then None.
+        Returns the parsed answer and OpenAI sources when the model produced an answer, else None.
+        """
+        try:
+            logger.info(f"Session {session_id}: Calling aclient.responses.create(stream=True) with include=['file_search_call.results']")
+            final_response = None
+            async with self._openai_semaphore:
+                stream = await self.openai_interaction.acall_rate_limited(
+                    self.openai_interaction.generation_client.responses.with_raw_response.create,
+                    estimate_tokens(kwargs["input"], self._max_output_tokens, self._responses_model),
+                    stream=True,
+                    **kwargs
+                )
+                async with stream:
+                    async for event in stream:
+                        if event.type == "response.output_text.delta":
+                            events.put_nowait({"type": "delta", "text": event.delta})
+                        elif event.type == "response.completed":
+                            final_response = event.response
+            if final_response is None:
+                logger.error(f"Session {session_id}: Stream ended without a completed response.")
+                events.put_nowait({"type": "error", "detail": "Error: The response stream ended before the answer was complete."})
+            else:
+                final_answer, openai_sources = self._parse_response_output(final_response.output)
+                events.put_nowait({"type": "sources", "openai_sources": openai_sources})
+                if final_answer is not None: return final_answer, openai_sources
 
         except APIError as e:
-            logger.error(f"Session {session_id}: APIError: {e}", exc_info=False)
-            return f"Error: OpenAI API failed ({getattr(e, 'status_code', 'N/A')}).", [], []
+            logger.error(f"Session {session_id}: APIError while streaming: {e}", exc_info=False)
+            events.put_nowait({"type": "error", "detail": f"Error: OpenAI API failed ({getattr(e, 'status_code', 'N/A')})."})
         except Exception as e:
-            logger.error(f"Session {session_id}: Unexpected error: {e}", exc_info=True)
-            return "Error: An unexpected issue occurred while generating the response.", [], []
+            logger.error(f"Session {session_id}: Unexpected error while streaming: {e}", exc_info=True)
+            events.put_nowait({"type": "error", "detail": "Error: An unexpected issue occurred while generating the response."})
+        finally:
+            events.put_nowait(None)
 
     def _format_local_context_for_prompt(self, local_results: List[Dict[str, Any]]) -> str:
         # This method is used to format local context for the *prompt* passed to OpenAI.
         # It's distinct from how sources are ultimately stored in the final JSON.
         if not local_results: return ""
+        cache_key = None
+        if all(r.get("id") is not None for r in local_results):
+            cache_key = tuple((r["id"], round(r.get("score") or 0.0, 4)) for r in local_results)
+            cached = self._local_context_cache.get(cache_key)
+            if cached is not None:
+                self._local_context_cache.move_to_end(cache_key)
+                return cached
+
+        n = len(local_results)
         context_parts = []
-        for i, result in enumerate(local_results):
-            text = result.get("text", "").strip()
+        append = context_parts.append
+        for i, result in enumerate(local_results, 1):
             metadata = result.get("metadata", {})
             headings = metadata.get("headings", [])
             score = result.get("score")
-            header_parts = [f"Local Source {i+1}/{len(local_results)}"]
-            if score is not None: header_parts.append(f"Score: {score:.4f}")
-            if headings: header_parts.append(f"Section: '{headings[-1]}'")
-            else: header_parts.append("Section: N/A")
             pos_index = metadata.get("position_index", -1); pos_total = metadata.get("position_total", -1)
-            if pos_index != -1 and pos_total != -1: header_parts.append(f"Position: {pos_index+1}/{pos_total}")
-            header = f"-- {' | '.join(header_parts)} --"
-            context_parts.append(f"{header}\n{text}")
-        return "\n\n".join(context_parts)
-
-    def remove_user_session_resources(self, session_id: str, delete_openai_resources: bool = True):
+            has_position = pos_index != -1 and pos_total != -1
+            append(_LOCAL_SOURCE_TEMPLATES[(score is not None, has_position)].format(
+                i=i, n=n, score=score, pos=pos_index + 1, total=pos_total,
+                section=f"'{headings[-1]}'" if headings else "N/A",
+                text=result.get("text", "").strip(),
+            ))
+        context_str = "\n\n".join(context_parts)
+
+        if cache_key is not None:
+            self._local_context_cache[cache_key] = context_str
+            if len(self._local_context_cache) > _LOCAL_CONTEXT_CACHE_SIZE:
+                self._local_context_cache.popitem(last=False)
+        return context_str
+
+    async def remove_user_session_resources(self, session_id: str, delete_openai_resources: bool = True, wait: bool = True):
+        """
+        Stops tracking a session and deletes its OpenAI vector store and file.
+        With wait=False the deletions run as a background task and this returns right away;
+        wait_for_pending_cleanups() awaits any that are still running.
+        """
         logger.info(f"Cleanup for session '{session_id}'. Delete OpenAI: {delete_openai_resources}")
-        if session_id in self.user_sessions:
-            doc_meta = self.user_sessions[session_id]
-            vs_id = doc_meta.get("vector_store_id")
-            file_id = doc_meta.get("file_id")
-
-            
-            if delete_openai_resources:
-                if vs_id:
-                    deleted_vs = self.openai_interaction.delete_vector_store(vs_id)
-                    if not deleted_vs: logger.warning(f"Session {session_id}: Failed to delete VS {vs_id}.")
-                if file_id:
-                    time.sleep(1) # Small delay before file deletion
-                    deleted_file = self.openai_interaction.delete_file(file_id)
-                    if not deleted_file: logger.warning(f"Session {session_id}: Failed to delete File {file_id}.")
-            
-            del self.user_sessions[session_id] # This deletes the session from tracking
-            logger.info(f"Removed session '{session_id}' from tracking.")
-            return True
-        else:
+        doc_meta = self.user_sessions.pop(session_id, None) # Stop tracking first so nothing new uses the session
+        if doc_meta is None:
             logger.warning(f"Session ID '{session_id}' not found for cleanup.")
-            return False
\ No newline at end of file
+            return False
+        logger.info(f"Removed session '{session_id}' from tracking after {time.monotonic() - doc_meta.created_at:.0f}s.")
+        doc_meta.notify_status_change() # Lets status streams see that the session is gone
+
+        if delete_openai_resources and (doc_meta.vector_store_id or doc_meta.file_id):
+            await self._run_cleanup(self._delete_openai_resources(session_id, doc_meta.vector_store_id, doc_meta.file_id), wait)
+        return True
+
+    async def release_session_documents(self, session_id: str, wait: bool = True, session: Optional[UserSession] = None) -> None:
+        """
+        Deletes the OpenAI vector store and file of a session that stays tracked (e.g. so a failed upload
+        can still report its status), and detaches them from the session. Pass session to release a
+        session object that is no longer tracked under session_id.
+        """
+        session = session or self.user_sessions.get(session_id)
+        if session is None or not (session.vector_store_id or session.file_id):
+            return
+        vs_id, file_id = session.vector_store_id, session.file_id
+        session.vector_store_id = session.file_id = session.file_search_tool = None
+        await self._run_cleanup(self._delete_openai_resources(session_id, vs_id, file_id), wait)
+
+    async def _run_cleanup(self, cleanup: Awaitable[None], wait: bool) -> None:
+        if wait:
+            await cleanup
+        else:
+            task = asyncio.create_task(cleanup)
+            self._cleanup_tasks.add(task) # Keep a strong reference until it finishes
+            task.add_done_callback(self._cleanup_tasks.discard)
+
+    async def _delete_openai_resources(self, session_id: str, vs_id: Optional[str], file_id: Optional[str]) -> None:
+        # The two deletions are independent REST calls; issue them concurrently
+        cleanup_targets = []
+        if vs_id: cleanup_targets.append((f"VS {vs_id}", self.openai_interaction.adelete_vector_store(vs_id)))
+        if file_id: cleanup_targets.append((f"File {file_id}", self.openai_interaction.adelete_file(file_id)))
+        results = await asyncio.gather(*(coro for _, coro in cleanup_targets), return_exceptions=True)
+        for (label, _), result in zip(cleanup_targets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Session {session_id}: Error deleting {label}: {result}")
+            elif not result:
+                logger.warning(f"Session {session_id}: Failed to delete {label}.")
+
+    async def wait_for_pending_cleanups(self) -> None:
+        """Awaits background cleanups started with remove_user_session_resources(..., wait=False)."""
+        # Loop, since a cleanup may be started while earlier ones are being awaited
+        while self._cleanup_tasks:
+            logger.info(f"Waiting for {len(self._cleanup_tasks)} pending OpenAI resource cleanups...")
+            await asyncio.gather(*list(self._cleanup_tasks), return_exceptions=True)
@@ -0,0 +1,149 @@
+# core/rate_limit.py
+import asyncio
+import functools
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Mapping, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    logging.warning("tiktoken is not installed. Token budgets will use a ~4 characters/token estimate.")
+    tiktoken = None
+
+class AsyncRateLimiter:
+    """Token bucket for coroutines: allows about requests_per_minute acquisitions per minute (<= 0 disables)."""
+    def __init__(self, requests_per_minute: float, burst: float = 1.0):
+        self.rate = requests_per_minute / 60.0 # tokens per second
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        # Waiters queue on the lock so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+_RESET_PART_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_RESET_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses OpenAI reset/retry durations such as '1s', '6m0s', '20ms' or a bare number of seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _RESET_PART_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _RESET_UNIT_SECONDS[unit] for amount, unit in parts)
+
+@functools.lru_cache(maxsize=16)
+def _get_encoding(model: Optional[str]) -> Optional[Any]:
+    """tiktoken encoding for a model (o200k_base for unknown ones); None without tiktoken."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("o200k_base")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e: # e.g. the encoding file cannot be downloaded
+        logging.warning(f"Could not load a tiktoken encoding for '{model}': {e}. Using the character estimate.")
+        return None
+
+def estimate_tokens(text: str, max_output_tokens: int = 0, model: Optional[str] = None) -> int:
+    """
+    Token cost of a request plus its output allowance. Counted with tiktoken for model when it is
+    installed, otherwise estimated at about 4 characters per token.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + max_output_tokens
+    return len(encoding.encode_ordinary(text)) + max_output_tokens
+
+class OpenAIRateLimiter:
+    """
+    Paces OpenAI calls within rolling one-minute request/token budgets (<= 0 disables a budget)
+    and pauses everyone when the API's x-ratelimit-* or retry-after headers say the account
+    limit has been reached, instead of sleeping a fixed amount between calls.
+    """
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window: Deque[Tuple[float, int]] = deque() # (start time, estimated tokens) per call
+        self._window_tokens = 0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _wait_seconds(self, now: float, tokens: int) -> float:
+        window = self._window
+        while window and window[0][0] <= now - 60:
+            self._window_tokens -= window.popleft()[1]
+        wait = self._paused_until - now
+        if wait > 0:
+            return wait
+        if self.requests_per_minute > 0 and len(window) >= self.requests_per_minute:
+            return window[0][0] + 60 - now
+        # A single request larger than the whole budget is let through once the window is empty
+        if self.tokens_per_minute > 0 and window and self._window_tokens + tokens > self.tokens_per_minute:
+            return window[0][0] + 60 - now
+        return 0.0
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Waits until a call estimated at `tokens` fits the budgets, then records it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_seconds(now, tokens)
+                if wait <= 0:
+                    self._window.append((now, tokens))
+                    self._window_tokens += tokens
+                    return
+                await asyncio.sleep(wait)
+
+    def _pause_for(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Pauses until the reported reset when the account's remaining requests or tokens run out."""
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                exhausted = int(remaining) <= 0
+            except ValueError:
+                continue
+            if exhausted:
+                reset = parse_reset_seconds(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset: self._pause_for(reset)
+
+    def record_rate_limited(self, headers: Optional[Mapping[str, str]], default_seconds: float = 2.0) -> float:
+        """Handles a 429: pauses for the server's retry-after (or reset) hint and returns the pause length."""
+        delay = None
+        if headers:
+            retry_after_ms = headers.get("retry-after-ms")
+            if retry_after_ms:
+                delay = (parse_reset_seconds(retry_after_ms) or 0) / 1000 or None
+            delay = delay or parse_reset_seconds(headers.get("retry-after"))
+            delay = delay or max(
+                parse_reset_seconds(headers.get("x-ratelimit-reset-requests")) or 0,
+                parse_reset_seconds(headers.get("x-ratelimit-reset-tokens")) or 0,
+            ) or None
+        delay = delay or default_seconds
+        self._pause_for(delay)
+        return delay
@@ -0,0 +1,76 @@
+# core/semantic_cache.py
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+import numpy as np
+
+class _ScopeBucket:
+    __slots__ = ("embeddings", "values")
+
+    def __init__(self, dim: int):
+        self.embeddings = np.empty((0, dim), dtype=np.float32) # Unit-normalized rows
+        self.values: List[Any] = []
+
+class SemanticCache:
+    """
+    Near-duplicate lookup: returns a cached value whose query embedding has cosine similarity
+    >= threshold with the new one. Entries are partitioned by scope (e.g. session + document +
+    focus area), so only comparable answers are ever matched. Both the number of scopes and the
+    entries per scope are LRU-bounded.
+    """
+    def __init__(self, threshold: float = 0.95, max_scopes: int = 256, max_entries_per_scope: int = 64):
+        self.threshold = threshold
+        self.max_scopes = max_scopes
+        self.max_entries_per_scope = max_entries_per_scope
+        self._scopes: "OrderedDict[Hashable, _ScopeBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.threshold <= 1 and self.max_scopes > 0 and self.max_entries_per_scope > 0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        if not np.isfinite(norm) or norm <= 1e-9:
+            return None
+        return vec / norm
+
+    def get(self, scope: Hashable, embedding: np.ndarray, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        vec = self._normalize(embedding)
+        if vec is None:
+            return default
+        with self._lock:
+            bucket = self._scopes.get(scope)
+            if bucket is None or not bucket.values or bucket.embeddings.shape[1] != vec.shape[0]:
+                return default
+            similarities = bucket.embeddings @ vec # One BLAS call over every cached query in scope
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return default
+            self._scopes.move_to_end(scope)
+            return bucket.values[best]
+
+    def set(self, scope: Hashable, embedding: np.ndarray, value: Any) -> None:
+        if not self.enabled:
+            return
+        vec = self._normalize(embedding)
+        if vec is None:
+            return
+        with self._lock:
+            bucket = self._scopes.get(scope)
+            if bucket is None or bucket.embeddings.shape[1] != vec.shape[0]:
+                bucket = self._scopes[scope] = _ScopeBucket(vec.shape[0])
+            self._scopes.move_to_end(scope)
+            bucket.embeddings = np.vstack((bucket.embeddings, vec))[-self.max_entries_per_scope:]
+            bucket.values = (bucket.values + [value])[-self.max_entries_per_scope:]
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes.clear()
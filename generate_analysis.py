@@ -1,24 +1,40 @@
 # generate_batch_analysis.py
 import os
-import json
+import copy
 import logging
-import shutil
-import tempfile
-import textwrap
 import time
-from openai import OpenAI
-from typing import Dict, Any, List, Optional # Added for type hinting
+import asyncio
+import secrets
+import hashlib
+import functools
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable, Iterator # Added for type hinting
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 
 try:
     from PyPDF2 import PdfReader
 except ImportError:
     print("PyPDF2 is not installed. Please run: pip install PyPDF2")
     PdfReader = None
+try:
+    import pypdfium2 as pdfium # C-backed; much faster than PyPDF2 for metadata and text
+except ImportError:
+    pdfium = None
 
 from core.config import settings
+from core import json_utils
+from core.pdf_metadata import read_pdf_title
 from core.openai_interaction import OpenAIInteraction
-from core.rag_system import HybridRAGSystem
+from core.rag_system import HybridRAGSystem, UserSession
 from core.local_db import load_db_on_startup, get_local_db
+from core.analysis_cache import AnalysisCache
+from core.semantic_cache import SemanticCache
+from core import equity_analyzer
+# Shared with the web analysis so the two cannot drift apart
+from core.equity_analyzer import (
+    EQUITY_DIMENSIONS, MULTI_FOCUS_BATCH_SIZE, PERSPECTIVES, PERSPECTIVE_GROUP_KEYS, PERSPECTIVE_SOURCE_KEYS, batch_analysis_jobs
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("batch_analysis_script")
@@ -26,49 +42,26 @@ logger = logging.getLogger("batch_analysis_script")
 DOCUMENTS_FOLDER = "Documents"
 # Changed to a directory for per-file JSON outputs
 OUTPUT_DIR = "analysis_outputs"
-FOCUS_AREAS = ["general", "vulnerable_groups", "severity_of_impact", "mitigation_strategies"]
-
-# ANALYSIS_QUERY is now more generic as the specific framing will come from _get_system_prompt
-# The {focus_description} will be populated by a specific detail instruction for each analysis type.
-ANALYSIS_QUERY_GENERIC = "Provide an equity analysis of this document, focusing on: {focus_description}"
-DELAY_BETWEEN_REQUESTS_SECONDS = 5 # Reduced delay to 5 seconds
-
-# Define the new perspectives and their specific prompts for raw analysis generation
-# These descriptions are for the LLM to understand what to focus on for each raw analysis.
-# The 'indicative' tone will be baked into the prompts from rag_system.py
-PERSPECTIVES = [
-    {
-        "group_name": "Policy Makers",
-        "description": "the overall equity implications from the perspective of federal and state policymakers, considering their regulatory responsibilities and influence on equity outcomes. This assessment could indicate how effectively equity measures are embedded in their processes, or if there might be systematic gaps in addressing social or racial disparities.",
-        "dimensions": {
-            "recognitional": "how the document suggests policy makers acknowledge how historical or systemic exclusion might impact decision-making access for marginalized groups. The analysis might highlight whether unique water justice needs appear to be adequately recognized.",
-            "procedural": "how the document examines indications of how agencies manage pollution control and public input, considering whether affected communities appear to meaningfully influence agenda-setting or enforcement priorities.",
-            "distributional": "whether the document suggests funding and technical assistance are directed in a way that prioritizes equity impacts, or if there might be unaddressed distributional disparities.",
-            "structural": "how the document hints at perpetuating top-down oversight, and whether it could suggest a reallocation of decision-making power or reduction of structural barriers for historically excluded groups."
-        }
-    },
-    {
-        "group_name": "Residents",
-        "description": "the overall equity implications from the perspective of ordinary residents, especially those in vulnerable communities, regarding their access to clean and affordable water. The assessment might indicate if community voices appear to be sufficiently represented in decisions affecting their health and well-being.",
-        "dimensions": {
-            "recognitional": "how the document suggests residents experience inequity when their specific circumstances—such as historic under-investment in infrastructure or exposure to legacy industrial sites—appear overlooked or undervalued in funding and policy priorities.",
-            "procedural": "how the document examines indications of meaningful resident engagement in public hearings and notice periods, and if marginalized populations might face capacity issues in effective participation.",
-            "distributional": "whether the document suggests residents in distressed or rural communities might benefit less from environmental outcomes, or if they appear to pay higher rates for water services due to infrastructure underfunding or costly upgrades.",
-            "structural": "how the document hints at systemic obstacles for residents, particularly from minority and low-income groups, such as under-resourced water utilities, lack of representation in regulatory processes, and enduring legacies of exclusion from environmental policymaking."
-        }
-    },
-    {
-        "group_name": "Farmers/Business Owners",
-        "description": "the overall equity implications from the perspective of farmers and business owners, particularly small operators, considering their roles as regulated entities and community members. The assessment could indicate if compliance costs or infrastructure funding might impose disproportionate economic hardship.",
-        "dimensions": {
-            "recognitional": "how the document suggests the Act primarily recognizes large industrial and municipal actors, and if distinct rural or small-operator needs might be missed in the broader regulatory structures.",
-            "procedural": "how the document assesses whether adequate input opportunities exist for small businesses and farmers through regulatory consultations and permit processes, or if resource constraints, lack of technical assistance, and geographic isolation might impede their meaningful participation.",
-            "distributional": "whether the document suggests compliance costs (such as new filtration or runoff systems) might weigh heavier on small agricultural operations and small businesses—sometimes threatening economic viability, especially in distressed regions.",
-            "structural": "how the document hints at small operators generally lacking a seat at high-level regulatory tables; financial and information barriers could prevent them from accessing support or defending their interests."
-        }
-    }
+PROBE_WORKERS = min(16, (os.cpu_count() or 1) + 4) # Threads reading/hashing PDFs during startup
+PREPARE_WORKERS = 2 # Documents having cached / near-duplicate analyses resolved ahead of the analysis stage
+FINISH_WORKERS = 2 # Documents being assembled into the final JSON and written
+PIPELINE_QUEUE_SIZE = 2 # Documents buffered between pipeline stages
+# Finished raw analyses / final JSON keyed by document content hash, so reruns resume per analysis
+ANALYSIS_CACHE_PATH = os.path.join(OUTPUT_DIR, "analysis_cache.sqlite")
+# Reuse cached analyses of an earlier document whose leading text embeds at least this similarly; 0 disables
+NEAR_DUPLICATE_SIMILARITY = 0.97
+NEAR_DUPLICATE_TEXT_CHARS = 8000 # Leading document text embedded for near-duplicate detection
+# Bump when JSON_SKELETON or assemble_final_json changes, so reruns reassemble from the cached raw analyses
+FINAL_JSON_VERSION = 1
+
+OVERALL_SUMMARY_QUERY = "Summarize the key equity gaps and key equity strengths this document suggests, and recommend how its equity outcomes could be improved."
+
+# The web analysis' raw analyses, plus the overall summary & recommendations (batched with the standard focus areas)
+ANALYSIS_JOBS: List[Tuple[str, str, str, str]] = equity_analyzer.ANALYSIS_JOBS + [
+    ("overall_summary", OVERALL_SUMMARY_QUERY, "general", "overall summary and recommendations")
 ]
 
+
 # Updated JSON Skeleton to remove 'transformational_equity' and include 'sources' array
 # NOTE: The 'sources' structure will be {"type": "openai", "data": "..."} as local sources are excluded
 JSON_SKELETON = """
@@ -138,129 +131,204 @@ JSON_SKELETON = """
   }
 }
 """
+# Parsed once; per-document results start from a deep copy
+_SKELETON_DICT: Dict[str, Any] = json_utils.loads(JSON_SKELETON)
+
+# Section of the final JSON filled by each standard raw analysis
+STANDARD_SECTIONS = {
+    "general": "general_equity_assessment",
+    "vulnerable_groups": "vulnerable_groups_analysis",
+    "severity_of_impact": "severity_impact_analysis",
+    "mitigation_strategies": "mitigation_strategies_analysis",
+}
+PLACEHOLDER = "..."
+NOT_INDICATED = "Not explicitly indicated by the document."
+
+def _placeholder_fields(section: Dict[str, Any]) -> Dict[str, Any]:
+    """The "..." fields of a skeleton section (recursively), i.e. the part an analysis fills in."""
+    fields = {}
+    for name, value in section.items():
+        if isinstance(value, dict):
+            nested = _placeholder_fields(value)
+            if nested: fields[name] = nested
+        elif value == PLACEHOLDER:
+            fields[name] = value
+    return fields
+
+def _build_section_templates() -> Dict[str, Tuple[Dict[str, Any], str]]:
+    """
+    Per raw analysis key: (JSON shape the multi-focus request fills, field that takes a plain-text
+    answer instead). Derived from JSON_SKELETON so the two cannot drift apart.
+    """
+    skeleton = _SKELETON_DICT
+    templates = {
+        key: (_placeholder_fields(skeleton["analysis_sections"][section]), "summary")
+        for key, section in STANDARD_SECTIONS.items()
+    }
+    templates["overall_summary"] = (_placeholder_fields(skeleton["overall_summary_and_recommendations"]), "key_equity_gaps")
+    perspective_skeleton = skeleton["equity_analysis_by_perspective"][0]
+    for perspective_info in PERSPECTIVES:
+        perspective_group_key = PERSPECTIVE_GROUP_KEYS[perspective_info["group_name"]]
+        templates[f"perspective_{perspective_group_key}_general"] = (_placeholder_fields(perspective_skeleton["general_equity_assessment"]), "narrative")
+        for dim in EQUITY_DIMENSIONS:
+            templates[f"perspective_{perspective_group_key}_{dim}"] = (_placeholder_fields(perspective_skeleton[f"{dim}_equity"]), "description")
+    return templates
 
+SECTION_TEMPLATES = _build_section_templates()
+
+
+def _read_pdf_pdfium(file_path: str, text_chars: int) -> Tuple[Optional[str], str]:
+    """pypdfium2 variant of _read_pdf; raises if the document cannot be opened."""
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        title = (pdf.get_metadata_dict().get("Title") or "").strip() or None
+        parts: List[str] = []
+        total_chars = 0
+        for page_index in range(len(pdf)):
+            if total_chars >= text_chars: break
+            page = pdf[page_index]
+            text_page = page.get_textpage()
+            try:
+                page_text = text_page.get_text_range() or ""
+            finally:
+                text_page.close()
+                page.close()
+            parts.append(page_text)
+            total_chars += len(page_text)
+        return title, "".join(parts)[:text_chars]
+    finally:
+        pdf.close()
+
+@functools.lru_cache(maxsize=1024)
+def _read_pdf(file_path: str, mtime_ns: int, text_chars: int = 0) -> Tuple[Optional[str], str]:
+    """
+    Title metadata (None if missing or unreadable) and up to text_chars of leading text, from a single
+    parse of the PDF (blocking). mtime_ns is only part of the cache key, so an edited file is re-read.
+    Uses pypdfium2 when installed, PyPDF2 otherwise (or if pypdfium2 cannot open the file).
+    Title-only reads try a trailer scan first, which skips parsing the PDF altogether.
+    """
+    if text_chars <= 0:
+        title = read_pdf_title(file_path)
+        if title:
+            return title, ""
+    if pdfium is not None:
+        try:
+            return _read_pdf_pdfium(file_path, text_chars)
+        except Exception as e:
+            logger.warning(f"pypdfium2 could not read PDF '{file_path}': {e}")
+    if PdfReader is None:
+        return None, ""
+    try:
+        reader = PdfReader(file_path, strict=False) # Lenient xref/trailer parsing; pages are only parsed if text is needed
+    except Exception as e:
+        logger.error(f"Could not read PDF '{file_path}': {e}")
+        return None, ""
+
+    title = None
+    try:
+        raw_title = (reader.metadata or {}).get('/Title')
+        if raw_title:
+            title = str(raw_title).strip() or None
+    except Exception as e:
+        logger.error(f"Could not read metadata from PDF '{file_path}': {e}")
+
+    parts: List[str] = []
+    total_chars = 0
+    try:
+        for page in reader.pages:
+            if total_chars >= text_chars: break
+            page_text = page.extract_text() or ""
+            parts.append(page_text)
+            total_chars += len(page_text)
+    except Exception as e:
+        logger.warning(f"Could not extract text from '{file_path}': {e}")
+    return title, "".join(parts)[:text_chars]
 
 def get_pdf_title(file_path: str, default_filename: str) -> str:
     """Extracts title from PDF metadata or returns default filename."""
-    if PdfReader is None:
+    if PdfReader is None and pdfium is None:
+        title = read_pdf_title(file_path)
+        if title:
+            return title
         logger.warning(f"PyPDF2 not installed. Title extraction for '{default_filename}' skipped.")
         return f"Title not extracted (PyPDF2 missing) - {default_filename}"
     try:
-        reader = PdfReader(file_path)
-        title = reader.metadata.get('/Title', default_filename)
-        if not isinstance(title, str):
-            title = str(title) if title else default_filename
-        return title.strip()
-    except Exception as e:
+        mtime_ns = os.stat(file_path).st_mtime_ns
+    except OSError as e:
         logger.error(f"Could not read metadata from PDF '{file_path}': {e}")
         return default_filename
+    return _read_pdf(file_path, mtime_ns)[0] or default_filename
+
+def iter_pdf_files(folder: str) -> Iterator[str]:
+    """Yields the names of the regular .pdf files in folder (scandir's cached entry type avoids a stat per file)."""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith('.pdf') and entry.is_file():
+                yield entry.name
+
+def _write_json_file(output_file_path: str, data: Dict[str, Any]) -> None:
+    """Writes a per-document analysis JSON file (blocking; call via asyncio.to_thread)."""
+    # Encoded in one go (orjson when installed) and swapped in atomically, so a killed run leaves no partial file
+    json_utils.write_file(output_file_path, data, indent=True)
+
+def _fill_placeholders(target: Dict[str, Any], answer: Dict[str, Any]) -> None:
+    """Copies answer values into the "..." fields of target (recursively); fixed fields such as titles are kept."""
+    for name, value in answer.items():
+        current = target.get(name)
+        if isinstance(current, dict) and isinstance(value, dict):
+            _fill_placeholders(current, value)
+        elif current == PLACEHOLDER and isinstance(value, str) and value.strip():
+            target[name] = value.strip()
+
+def _clear_placeholders(data: Any) -> None:
+    """Replaces any "..." left unfilled with an indicative 'not indicated' note."""
+    items = data.items() if isinstance(data, dict) else enumerate(data) if isinstance(data, list) else ()
+    for name, value in items:
+        if value == PLACEHOLDER: data[name] = NOT_INDICATED
+        elif isinstance(value, (dict, list)): _clear_placeholders(value)
+
+def _fill_section(target: Dict[str, Any], key: str, raw_analyses: Dict[str, Dict[str, Any]]) -> None:
+    """Fills one final-JSON section from its raw analysis: structured answers field by field, plain text into the main field."""
+    raw = raw_analyses.get(key)
+    if raw is None:
+        return
+    if isinstance(raw.get("section"), dict):
+        _fill_placeholders(target, raw["section"])
+    else:
+        target[SECTION_TEMPLATES[key][1]] = raw.get("text", "Not provided.")
 
-def format_analyses_into_json(raw_analyses: Dict[str, Dict[str, Any]], filename: str, title: str,
-                              file_size_kb: int, upload_date_utc: str, client: OpenAI) -> Optional[Dict[str, Any]]:
+def assemble_final_json(raw_analyses: Dict[str, Dict[str, Any]], filename: str, title: str,
+                        file_size_kb: int, upload_date_utc: str) -> Dict[str, Any]:
     """
-    Synthesizes raw text analyses into the final structured JSON format.
-    Sources are inserted *after* LLM generation, purely by Python.
+    Builds the final structured JSON for a document from its raw analyses, without another model call:
+    the multi-focus requests already return each section in the skeleton's shape.
+    Sources are inserted *after*, purely by Python.
     """
-    logger.info("-> Synthesizing raw analyses into the final JSON structure (text portion)...")
-
-    # Check for any failures in raw analysis generation from the `raw_analyses` dict
-    if any("ANALYSIS FAILED" in raw_analysis.get("text", "") for raw_analysis in raw_analyses.values()):
-        logger.error("Skipping full JSON formatting due to failure in raw analysis generation for one or more sections.")
-        error_json = json.loads(JSON_SKELETON)
-        error_json["document"]["filename"] = filename
-        error_json["document"]["title"] = title
-        error_json["document"]["size_kb"] = file_size_kb
-        error_json["document"]["upload_date_utc"] = upload_date_utc
-        error_json["analysis_sections"]["general_equity_assessment"]["summary"] = "One or more raw analyses failed during text generation. See logs for details."
-        # Clear/default other fields to reflect failure
-        error_json["equity_analysis_by_perspective"] = []
-        error_json["overall_summary_and_recommendations"]["key_equity_gaps"] = "Due to incomplete raw analysis generation."
-        # Still attempt to populate sources for any sections that might have succeeded
-        _populate_sources_into_json(error_json, raw_analyses)
-        return error_json
-
-
-    # Dynamically build the raw analyses string (text only) to include in the prompt for the formatter LLM
-    raw_analyses_text_str = ""
-    for k, v in raw_analyses.items():
-        raw_analyses_text_str += f"\n--- RAW ANALYSIS TEXT FOR: {k.replace('_', ' ').upper()} ---\n{v.get('text', 'Not provided.')}\n"
-
-    formatter_prompt = textwrap.dedent(f"""
-    You are an expert data structurer and equity analyst. Your task is to populate the provided JSON structure.
-    All generated content in the JSON must be derived **ONLY** from the raw analysis texts provided below.
-    Crucially, all summary, narrative, and description fields must use an **indicative, tentative, or suggestive tone**.
-    Avoid definitive or authoritative statements. Employ phrases like "This may indicate...", "It suggests that...",
-    "A potential interpretation is...", "It appears to...", "Could be seen as...", "There is an indication that...",
-    "The document seems to...", "It might imply...", etc.
-
-    **Instructions:**
-    1.  Carefully read all provided raw text analyses.
-    2.  Fill in every "..." placeholder in the JSON skeleton with **detailed and comprehensive** information synthesized from these analysis texts. Do not over-summarize; preserve key details and nuanced interpretations.
-    3.  Ensure all content strictly adheres to the schema and the required indicative tone.
-    4.  **DO NOT ADD ANY SOURCE INFORMATION OR CITATIONS TO THE TEXT FIELDS OR THE 'sources' ARRAYS.** The 'sources' arrays in the JSON skeleton will be populated separately by Python.
-    5.  Specifically for the `general_equity_assessment` within `analysis_sections`, break down the 'general' raw analysis into the sub-fields for each of the four equity dimensions (Recognitional, Procedural, Distributional, Structural). For each dimension, aim to identify both "positive_findings" and "concerns" if discernible, and provide a "conclusion". If information is not provided for a sub-field, use "Not explicitly indicated by the document." or similar indicative phrasing.
-    6.  For the `equity_analysis_by_perspective` array, create an entry for each perspective mentioned in the raw analyses (e.g., Policy Makers, Residents, Farmers/Business Owners). For each perspective entry:
-        *   Populate the `group` name (e.g., "Policy Makers").
-        *   Fill the `general_equity_assessment` (title and narrative) using the corresponding raw analysis text (e.g., the content for key `perspective_policymakers_general`). The title should reflect the group's perspective.
-        *   Fill the individual equity dimension descriptions (recognitional_equity, procedural_equity, distributional_equity, structural_equity) using the specific raw analysis texts for that dimension and group (e.g., the content for key `perspective_policymakers_recognitional`).
-    7.  Ensure the output is a single, valid JSON object and nothing else.
-
-    **JSON SKELETON TO POPULATE (Text fields only):**
-    {JSON_SKELETON}
-
-    **RAW TEXT ANALYSES TO USE:**
-    {raw_analyses_text_str}
-    """)
+    structured_data = copy.deepcopy(_SKELETON_DICT)
+    structured_data["document"].update(filename=filename, title=title, size_kb=file_size_kb, upload_date_utc=upload_date_utc)
 
-    try:
-        response = client.chat.completions.create(
-            model=settings.OPENAI_CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that outputs JSON."},
-                {"role": "user", "content": formatter_prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2 # Keep temperature low for structured output
-        )
-        json_output_str = response.choices[0].message.content
-        structured_data = json.loads(json_output_str)
-
-        # Assign document metadata
-        structured_data["document"]["filename"] = filename
-        structured_data["document"]["title"] = title
-        structured_data["document"]["size_kb"] = file_size_kb
-        structured_data["document"]["upload_date_utc"] = upload_date_utc
-
-        # --- Python Logic to Inject Raw Sources (POST-LLM) ---
-        _populate_sources_into_json(structured_data, raw_analyses)
-
-        logger.info("-> Successfully synthesized analyses into JSON structure and injected raw sources.")
-        return structured_data
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON from OpenAI response during formatting: {e}. Response was: {json_output_str[:500]}...", exc_info=True)
-        # Attempt to return a partial JSON indicating formatting failure and populate sources
-        error_json = json.loads(JSON_SKELETON)
-        error_json["document"]["filename"] = filename
-        error_json["document"]["title"] = title
-        error_json["document"]["size_kb"] = file_size_kb
-        error_json["document"]["upload_date_utc"] = upload_date_utc
-        error_json["analysis_sections"]["general_equity_assessment"]["summary"] = f"JSON formatting failed: {e}. Raw analyses might be incomplete or malformed."
-        error_json["equity_analysis_by_perspective"] = []
-        error_json["overall_summary_and_recommendations"]["key_equity_gaps"] = "Due to JSON formatting failure."
-        _populate_sources_into_json(error_json, raw_analyses) # Still try to populate sources on error
-        return error_json
-    except Exception as e:
-        logger.error(f"Failed to format analyses into JSON for unknown reason: {e}", exc_info=True)
-        error_json = json.loads(JSON_SKELETON)
-        error_json["document"]["filename"] = filename
-        error_json["document"]["title"] = title
-        error_json["document"]["size_kb"] = file_size_kb
-        error_json["document"]["upload_date_utc"] = upload_date_utc
-        error_json["analysis_sections"]["general_equity_assessment"]["summary"] = f"An unexpected error occurred during final JSON synthesis: {e}"
-        error_json["equity_analysis_by_perspective"] = []
-        error_json["overall_summary_and_recommendations"]["key_equity_gaps"] = "Due to unexpected error during JSON formatting."
-        _populate_sources_into_json(error_json, raw_analyses) # Still try to populate sources on error
-        return error_json
+    for key, section in STANDARD_SECTIONS.items():
+        _fill_section(structured_data["analysis_sections"][section], key, raw_analyses)
+    _fill_section(structured_data["overall_summary_and_recommendations"], "overall_summary", raw_analyses)
+
+    perspective_skeleton = structured_data["equity_analysis_by_perspective"][0]
+    perspectives = []
+    for perspective_info in PERSPECTIVES:
+        perspective_group_key = PERSPECTIVE_GROUP_KEYS[perspective_info["group_name"]]
+        entry = copy.deepcopy(perspective_skeleton)
+        entry["group"] = perspective_info["group_name"]
+        _fill_section(entry["general_equity_assessment"], f"perspective_{perspective_group_key}_general", raw_analyses)
+        if entry["general_equity_assessment"]["title"] == PLACEHOLDER:
+            entry["general_equity_assessment"]["title"] = f"General Equity Assessment: {perspective_info['group_name']}"
+        for dim in EQUITY_DIMENSIONS:
+            _fill_section(entry[f"{dim}_equity"], f"perspective_{perspective_group_key}_{dim}", raw_analyses)
+        perspectives.append(entry)
+    structured_data["equity_analysis_by_perspective"] = perspectives
+    _clear_placeholders(structured_data)
+
+    # --- Python Logic to Inject Raw Sources (POST-LLM) ---
+    _populate_sources_into_json(structured_data, raw_analyses)
+    return structured_data
 
 def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: Dict[str, Dict[str, Any]]):
     """
@@ -269,6 +337,12 @@ def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: D
     This is done purely by Python after the LLM has filled the text fields.
     """
     
+    if not raw_analyses:
+        # Nothing to inject (the document failed before any analysis succeeded)
+        if "overall_summary_and_recommendations" in structured_data:
+            structured_data["overall_summary_and_recommendations"]["sources"] = []
+        return
+
     # Mapping from raw_analyses keys to structured_data paths for sources
     source_mappings = {
         # Standard Focus Areas
@@ -279,19 +353,18 @@ def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: D
     }
 
     # Add Perspective-Based mappings
-    for perspective_info in PERSPECTIVES:
-        group_key = perspective_info["group_name"].replace(" ", "_").lower()
-        
+    # Index the perspective entries by group once instead of scanning the list per perspective
+    entries_by_group = {item.get("group"): item for item in structured_data["equity_analysis_by_perspective"]}
+    for group_name, section_keys in PERSPECTIVE_SOURCE_KEYS:
         # Find the correct perspective entry in structured_data
         # This assumes the LLM successfully created the perspective entries.
-        perspective_entry = next((item for item in structured_data["equity_analysis_by_perspective"] if item.get("group") == perspective_info["group_name"]), None)
+        perspective_entry = entries_by_group.get(group_name)
         
         if perspective_entry:
-            source_mappings[f"perspective_{group_key}_general"] = perspective_entry["general_equity_assessment"]
-            for dim in ["recognitional", "procedural", "distributional", "structural"]:
-                source_mappings[f"perspective_{group_key}_{dim}"] = perspective_entry[f"{dim}_equity"]
+            for key, section in section_keys:
+                source_mappings[key] = perspective_entry[section]
         else:
-            logger.warning(f"Could not find perspective entry for '{perspective_info['group_name']}' in structured_data. Sources for this perspective will not be added.")
+            logger.debug(f"Could not find perspective entry for '{group_name}' in structured_data. Sources for this perspective will not be added.")
 
     # Populate sources for each mapped section
     for key, target_section in source_mappings.items():
@@ -299,28 +372,362 @@ def _populate_sources_into_json(structured_data: Dict[str, Any], raw_analyses: D
             # ONLY include openai_sources as per requirement
             raw_openai_sources = raw_analyses[key].get("openai_sources", [])
             
-            # Create the list of source objects, only for OpenAI type
-            combined_sources = []
-            for openai_source_str in raw_openai_sources:
-                combined_sources.append({"type": "openai", "data": openai_source_str})
-            
-            # Assign to the target section's "sources" field
-            target_section["sources"] = combined_sources
+            # Create the list of source objects, only for OpenAI type, and assign to the target section's "sources" field
+            target_section["sources"] = [{"type": "openai", "data": openai_source_str} for openai_source_str in raw_openai_sources]
         else:
             logger.debug(f"Raw analysis key '{key}' not found, skipping source injection for corresponding section.")
 
     # Handle overall_summary_and_recommendations sources
     # For simplicity, copy sources from the main general_equity_assessment if it exists.
     if "overall_summary_and_recommendations" in structured_data and "general" in raw_analyses:
-        main_general_openai_sources = []
-        for openai_source_str in raw_analyses["general"].get("openai_sources", []):
-            main_general_openai_sources.append({"type": "openai", "data": openai_source_str})
-        structured_data["overall_summary_and_recommendations"]["sources"] = main_general_openai_sources
+        structured_data["overall_summary_and_recommendations"]["sources"] = [
+            {"type": "openai", "data": openai_source_str} for openai_source_str in raw_analyses["general"].get("openai_sources", [])
+        ]
     else:
         structured_data["overall_summary_and_recommendations"]["sources"] = [] # Ensure it's an empty list if no sources.
 
 
-def main():
+def _sha256_file(file_path: str) -> str:
+    """SHA-256 of a file's contents, read in chunks (blocking; run in a worker thread)."""
+    with open(file_path, 'rb') as f:
+        if hasattr(hashlib, "file_digest"): # Python 3.11+: buffered reads straight into OpenSSL, GIL released
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        digest = hashlib.sha256()
+        while chunk := f.read(1 << 16):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+def _document_embedding(text: str, model: Any) -> Optional[np.ndarray]:
+    """Mean local-model embedding over 1000-character windows, so the whole excerpt counts despite the model's input limit (blocking)."""
+    windows = [window for window in (text[i:i + 1000] for i in range(0, len(text), 1000)) if window.strip()]
+    if not windows:
+        return None
+    return np.asarray(model.encode(windows, show_progress_bar=False), dtype=np.float32).mean(axis=0)
+
+class NearDuplicateFinder:
+    """
+    Finds an earlier document whose leading text is nearly identical (cosine similarity of the
+    local embeddings >= threshold), so its cached analyses can be reused. Document embeddings
+    are persisted in the AnalysisCache, which makes matches work across runs.
+    """
+    _SCOPE = "documents"
+
+    def __init__(self, model: Any, model_name: str, analysis_cache: AnalysisCache, threshold: float):
+        self._model = model
+        self._model_name = model_name
+        self._analysis_cache = analysis_cache
+        self._index = SemanticCache(threshold, max_scopes=1, max_entries_per_scope=1_000_000)
+        for doc_hash, embedding in analysis_cache.get_document_embeddings(model_name):
+            self._index.set(self._SCOPE, np.asarray(embedding, dtype=np.float32), doc_hash)
+
+    async def find(self, doc_hash: str, text: str) -> Optional[str]:
+        """Returns the hash of a different near-duplicate document (given its leading text), registering this one if it is new."""
+        if not text:
+            return None
+        embedding = await asyncio.to_thread(_document_embedding, text, self._model)
+        if embedding is None:
+            return None
+        match = self._index.get(self._SCOPE, embedding)
+        if match is None:
+            self._index.set(self._SCOPE, embedding, doc_hash)
+            self._analysis_cache.set_document_embedding(doc_hash, self._model_name, embedding.tolist())
+        return match if match != doc_hash else None
+
+def _get_first_cached(analysis_cache: AnalysisCache, keys: List[str]) -> Optional[Any]:
+    for key in keys:
+        value = analysis_cache.get(key)
+        if value is not None:
+            return value
+    return None
+
+def _raw_analysis_cache_key(doc_hash: str, analysis_key: str, query: str) -> str:
+    # The query hash keeps cached answers from being reused after a prompt wording change
+    query_hash = hashlib.blake2b(query.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{doc_hash}:{analysis_key}:{query_hash}:{settings.RESPONSES_MODEL}"
+
+def _vector_store_cache_key(doc_hash: str) -> str:
+    return f"{doc_hash}:vector_store"
+
+def _final_analysis_cache_key(doc_hash: str) -> str:
+    # Raw analyses are keyed on what was asked; the assembled JSON also depends on this script's layout code
+    return f"{doc_hash}:final:v{FINAL_JSON_VERSION}:{settings.RESPONSES_MODEL}"
+
+async def _generate_raw_analyses(filename: str, original_file_path: str, pending_jobs: List[Tuple[str, str, str, str]],
+                                 rag_system: HybridRAGSystem, analysis_cache: AnalysisCache, doc_hash: str) -> Dict[str, Dict[str, Any]]:
+    """Uploads the document to a fresh session and answers the pending jobs; successful answers are cached as they arrive."""
+    results: Dict[str, Dict[str, Any]] = {}
+    keep_vector_store = settings.BATCH_VECTOR_STORE_KEEP_DAYS > 0
+    vector_store_kept = False # Only a ready store is left behind; failed uploads are still cleaned up
+    # Unique session ID per document: documents run concurrently, and names like 'a.b.pdf' / 'a_b.pdf' map to
+    # the same prefix, so a random suffix keeps one from replacing the other's session
+    base_filename_no_ext = os.path.splitext(filename)[0]
+    session_id = f"batch_analysis_{base_filename_no_ext.replace('.', '_')}_{int(time.time())}_{secrets.token_hex(4)}"
+    try:
+        rag_system.user_sessions[session_id] = UserSession(original_filename=filename)
+        # A vector store kept from an earlier run of the same content skips the upload and indexing entirely
+        kept_store = analysis_cache.get(_vector_store_cache_key(doc_hash)) if keep_vector_store else None
+        vector_store_kept = bool(kept_store) and await rag_system.attach_existing_vector_store(
+            session_id, kept_store["vector_store_id"], kept_store.get("file_id"))
+        if kept_store and not vector_store_kept and kept_store.get("file_id"):
+            # The kept store expired (or is gone) but its file does not expire; the cache entry is about to be
+            # overwritten, so delete the file now or nothing ever will
+            await rag_system.openai_interaction.adelete_file(kept_store["file_id"])
+        if not vector_store_kept:
+            logger.info("Uploading '%s' to OpenAI and processing locally for session %s...", filename, session_id)
+            # The upload only reads the file, so the original is passed directly (no temp copy); temp_file_path
+            # stays unset so no session cleanup path can delete it
+            success, message = await rag_system.add_user_document_for_session(
+                session_id=session_id, file_path=original_file_path, original_filename=filename,
+                vector_store_expires_after_days=settings.BATCH_VECTOR_STORE_KEEP_DAYS
+            )
+            if not success:
+                raise Exception(f"Document processing failed: {message}")
+            if keep_vector_store:
+                session = rag_system.user_sessions[session_id]
+                analysis_cache.set(_vector_store_cache_key(doc_hash), {"vector_store_id": session.vector_store_id, "file_id": session.file_id})
+                vector_store_kept = True
+
+        async def run_job(key: str, query: str, focus: str, label: str) -> None:
+            # NOTE: local_chunks are discarded here as per requirement
+            answer, _, openai_srcs = await rag_system.answer_question(session_id=session_id, query=query, focus_area=focus)
+            if "Error:" in answer:
+                logger.error("Received an error for %s: %s. Marking as failed.", label, answer)
+                results[key] = {"text": f"ANALYSIS FAILED: {answer}", "openai_sources": openai_srcs}
+            else:
+                results[key] = {"text": answer, "openai_sources": openai_srcs}
+                analysis_cache.set(_raw_analysis_cache_key(doc_hash, key, query), results[key])
+
+        async def run_batch(batch: List[Tuple[str, str, str, str]]) -> None:
+            # One request answers the whole batch; anything it leaves out is asked on its own
+            answers, _, openai_srcs = await rag_system.answer_multi_focus(
+                session_id, [(key, query, focus) for key, query, focus, _ in batch],
+                output_templates={key: SECTION_TEMPLATES[key][0] for key, _, _, _ in batch if key in SECTION_TEMPLATES}
+            )
+            fallback_jobs = []
+            for job in batch:
+                key, query = job[0], job[1]
+                if key in answers:
+                    # Structured answers already have their final-JSON section's shape
+                    answer_field = "section" if isinstance(answers[key], dict) else "text"
+                    results[key] = {answer_field: answers[key], "openai_sources": list(openai_srcs)}
+                    analysis_cache.set(_raw_analysis_cache_key(doc_hash, key, query), results[key])
+                else:
+                    fallback_jobs.append(job)
+            if fallback_jobs:
+                logger.warning("Multi-focus request for '%s' missed %s analyses; asking them individually.", filename, len(fallback_jobs))
+                async with asyncio.TaskGroup() as tg:
+                    for job in fallback_jobs: tg.create_task(run_job(*job))
+
+        # Every raw analysis is an independent question against the same session, so they are all
+        # issued together; HybridRAGSystem's request semaphore bounds how many hit OpenAI at once.
+        if MULTI_FOCUS_BATCH_SIZE > 1:
+            batches = batch_analysis_jobs(pending_jobs)
+            logger.info("-> Generating %s raw analyses for '%s' in %s multi-focus requests...", len(pending_jobs), filename, len(batches))
+            async with asyncio.TaskGroup() as tg:
+                for batch in batches: tg.create_task(run_batch(batch))
+        else:
+            logger.info("-> Generating %s raw analyses for '%s' concurrently...", len(pending_jobs), filename)
+            async with asyncio.TaskGroup() as tg:
+                for job in pending_jobs: tg.create_task(run_job(*job))
+    finally:
+        # Deletions run in the background while this slot moves on to the next document; awaited before exit.
+        # Kept vector stores are left for the next run (OpenAI expires them once idle).
+        logger.info("Cleaning up OpenAI resources for session '%s'...", session_id)
+        await rag_system.remove_user_session_resources(session_id, delete_openai_resources=not vector_store_kept, wait=False)
+    return results
+
+@dataclass
+class _BatchDocument:
+    """Per-document state handed from one pipeline stage to the next."""
+    filename: str
+    file_path: str
+    output_json_path: str
+    title: str
+    file_size_kb: int
+    upload_date_utc: str
+    doc_hash: str
+    lookup_hashes: List[str]
+    raw_analyses: Dict[str, Dict[str, Any]] = field(default_factory=dict) # Store text, and openai_sources (local sources explicitly excluded)
+    pending_jobs: List[Tuple[str, str, str, str]] = field(default_factory=list)
+    leading_text: str = "" # For near-duplicate detection; dropped once the prepare stage has used it
+    final_json: Optional[Dict[str, Any]] = None
+    error: Optional[Exception] = None
+
+def _output_json_path(filename: str) -> str:
+    return os.path.join(OUTPUT_DIR, f"{os.path.splitext(filename)[0]}.json")
+
+def _probe_pdf(filename: str) -> Optional[_BatchDocument]:
+    """
+    Reads a PDF's size, title, leading text and content hash (blocking; run in the prefetch pool).
+    Returns None if the file is empty or unreadable. Documents whose output already exists are
+    filtered out by main() before probing, so they are never opened.
+    """
+    output_json_path = _output_json_path(filename)
+    original_file_path = os.path.join(DOCUMENTS_FOLDER, filename)
+    try:
+        file_stat = os.stat(original_file_path)
+        if file_stat.st_size == 0:
+            logger.warning("Skipping '%s': the file is empty.", filename)
+            return None
+        # Title and (for near-duplicate detection) leading text come from one cached parse of the PDF
+        leading_text = ""
+        if PdfReader is None and pdfium is None:
+            title = get_pdf_title(original_file_path, filename)
+        else:
+            text_chars = NEAR_DUPLICATE_TEXT_CHARS if NEAR_DUPLICATE_SIMILARITY > 0 else 0
+            pdf_title, leading_text = _read_pdf(original_file_path, file_stat.st_mtime_ns, text_chars)
+            title = pdf_title or filename
+        doc_hash = _sha256_file(original_file_path)
+    except Exception as e:
+        logger.error("Skipping '%s': could not read the file: %s", filename, e)
+        return None
+    return _BatchDocument(
+        filename=filename, file_path=original_file_path, output_json_path=output_json_path, title=title,
+        file_size_kb=file_stat.st_size // 1024, # Size in KB
+        upload_date_utc=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(file_stat.st_mtime)),
+        doc_hash=doc_hash, lookup_hashes=[doc_hash], leading_text=leading_text
+    )
+
+async def _prepare_document(doc: _BatchDocument, analysis_cache: AnalysisCache,
+                            near_duplicates: Optional[NearDuplicateFinder]) -> _BatchDocument:
+    """Stage 1: resolves cached analyses (for this document or a near-duplicate) for a probed document."""
+    filename, title = doc.filename, doc.title
+    leading_text, doc.leading_text = doc.leading_text, ""
+    # Cached analyses are looked up for this document first, then for a near-duplicate one
+    if near_duplicates is not None:
+        similar_hash = await near_duplicates.find(doc.doc_hash, leading_text)
+        if similar_hash:
+            logger.info("'%s' is a near-duplicate of an earlier document; its cached analyses will be reused.", filename)
+            doc.lookup_hashes.append(similar_hash)
+
+    doc.final_json = _get_first_cached(analysis_cache, [_final_analysis_cache_key(h) for h in doc.lookup_hashes])
+    if doc.final_json is not None:
+        logger.info("Reusing cached final analysis for '%s'.", filename)
+        doc.final_json["document"].update(filename=filename, title=title, size_kb=doc.file_size_kb, upload_date_utc=doc.upload_date_utc)
+        return doc
+
+    for job in ANALYSIS_JOBS:
+        cached = _get_first_cached(analysis_cache, [_raw_analysis_cache_key(h, job[0], job[1]) for h in doc.lookup_hashes])
+        if cached is not None: doc.raw_analyses[job[0]] = cached
+        else: doc.pending_jobs.append(job)
+    if doc.raw_analyses:
+        logger.info("Reusing %s/%s cached raw analyses for '%s'.", len(doc.raw_analyses), len(ANALYSIS_JOBS), filename)
+    return doc
+
+async def _analyze_document(doc: _BatchDocument, rag_system: HybridRAGSystem, analysis_cache: AnalysisCache) -> _BatchDocument:
+    """Stage 2: uploads the document and generates its missing raw analyses."""
+    if doc.final_json is not None or not doc.pending_jobs:
+        return doc
+    logger.info("\n--- Analyzing document: %s ---", doc.filename)
+    try:
+        generated_analyses = await _generate_raw_analyses(doc.filename, doc.file_path, doc.pending_jobs, rag_system, analysis_cache, doc.doc_hash)
+        doc.raw_analyses.update(generated_analyses)
+        logger.info("Generated raw analyses for '%s'.", doc.filename)
+    except Exception as e:
+        doc.error = e
+    return doc
+
+async def _finish_document(doc: _BatchDocument, analysis_cache: AnalysisCache) -> None:
+    """Stage 3: writes the document's result, then drops it (main() holds every _BatchDocument until the batch ends)."""
+    try:
+        await _persist_document(doc, analysis_cache)
+    finally:
+        doc.raw_analyses, doc.pending_jobs, doc.final_json = {}, [], None
+
+async def _persist_document(doc: _BatchDocument, analysis_cache: AnalysisCache) -> None:
+    """Assembles the raw analyses into the final JSON (or an error report) and writes the per-document file."""
+    if doc.final_json is None and doc.error is None:
+        try:
+            raw_analyses = {key: doc.raw_analyses[key] for key, _, _, _ in ANALYSIS_JOBS}
+            # --- Assemble the final JSON structure from the raw analyses (Python injects sources after) ---
+            doc.final_json = assemble_final_json(raw_analyses, doc.filename, doc.title, doc.file_size_kb, doc.upload_date_utc)
+            if not any("ANALYSIS FAILED" in raw.get("text", "") for raw in raw_analyses.values()):
+                analysis_cache.set(_final_analysis_cache_key(doc.doc_hash), doc.final_json)
+        except Exception as e:
+            doc.error = e
+
+    if doc.error is not None:
+        e = doc.error
+        logger.critical("A critical error occurred while processing '%s': %s. Cleaning up and skipping this document.", doc.filename, e, exc_info=e)
+        # Attempt to save a partial/error JSON
+        # Use a simplified error structure that Python can easily populate
+        error_json_for_file = {
+            "document": { "filename": doc.filename, "title": doc.title, "size_kb": doc.file_size_kb, "upload_date_utc": doc.upload_date_utc },
+            "analysis_sections": { "general_equity_assessment": { "summary": f"Analysis failed due to critical error: {e}", "sources": [] } },
+            "equity_analysis_by_perspective": [],
+            "overall_summary_and_recommendations": { "key_equity_gaps": f"Due to critical error: {e}", "sources": [] }
+        }
+        # Even on critical failure, try to populate sources for any successful raw analyses
+        _populate_sources_into_json(error_json_for_file, doc.raw_analyses)
+
+        try:
+            await asyncio.to_thread(_write_json_file, doc.output_json_path, error_json_for_file)
+            logger.info("Error report saved to '%s'.", doc.output_json_path)
+        except Exception as write_e:
+            logger.error("Failed to write error report for '%s': %s", doc.filename, write_e)
+        return # Done with this document
+
+    try:
+        await asyncio.to_thread(_write_json_file, doc.output_json_path, doc.final_json)
+        logger.info("Analysis for '%s' saved successfully to '%s'.", doc.filename, doc.output_json_path)
+    except Exception as e:
+        logger.critical("Could not write final JSON for '%s' to '%s': %s. Continuing to next document, but data might be lost.", doc.filename, doc.output_json_path, e, exc_info=True)
+
+async def _pipeline_worker(stage: str, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue],
+                           handler: Callable[[Any], Awaitable[Any]]) -> None:
+    """Feeds items from inbox through handler until a None sentinel arrives, passing non-None results to outbox."""
+    while (item := await inbox.get()) is not None:
+        try:
+            result = await handler(item)
+        except Exception as e:
+            logger.critical("Unhandled error in %s stage for '%s': %s", stage, getattr(item, 'filename', item), e, exc_info=True)
+            continue
+        if outbox is not None and result is not None:
+            await outbox.put(result)
+
+async def _run_stage(stage: str, worker_count: int, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue],
+                     handler: Callable[[Any], Awaitable[Any]], downstream_workers: int = 0) -> None:
+    """Runs worker_count workers for one stage, then tells each downstream worker that no more items are coming."""
+    async with asyncio.TaskGroup() as tg:
+        for _ in range(worker_count): tg.create_task(_pipeline_worker(stage, inbox, outbox, handler))
+    for _ in range(downstream_workers):
+        await outbox.put(None)
+
+async def run_batch_pipeline(documents: List[_BatchDocument], rag_system: HybridRAGSystem, analysis_cache: AnalysisCache, near_duplicates: Optional[NearDuplicateFinder]) -> None:
+    """
+    Processes the documents as a prepare -> upload/analyze -> assemble/persist pipeline connected by bounded
+    queues, so one document's upload and analysis overlap another's persisting instead of holding its slot.
+    Session cleanup already runs in the background (see _generate_raw_analyses).
+    """
+    # Read here rather than at import, as settings is None when config loading failed (main() reports that)
+    max_concurrent_documents = max(1, settings.BATCH_CONCURRENCY) # Documents uploaded and analyzed at the same time
+    prepare_queue: asyncio.Queue = asyncio.Queue()
+    analyze_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    finish_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    for doc in documents:
+        prepare_queue.put_nowait(doc)
+    for _ in range(PREPARE_WORKERS):
+        prepare_queue.put_nowait(None)
+
+    # A crash in any stage cancels the others; each in-flight session's finally block still schedules its cleanup
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(_run_stage("prepare", PREPARE_WORKERS, prepare_queue, analyze_queue,
+                                  lambda doc: _prepare_document(doc, analysis_cache, near_duplicates), max_concurrent_documents))
+        tg.create_task(_run_stage("analyze", max_concurrent_documents, analyze_queue, finish_queue,
+                                  lambda doc: _analyze_document(doc, rag_system, analysis_cache), FINISH_WORKERS))
+        tg.create_task(_run_stage("finish", FINISH_WORKERS, finish_queue, None,
+                                  lambda doc: _finish_document(doc, analysis_cache)))
+
+def _make_probe_executor() -> Executor:
+    """
+    Threads suffice while PDF parsing runs in C (pypdfium2, hashing); PyPDF2's pure-Python text
+    extraction holds the GIL, so without pypdfium2 the probes run in worker processes instead.
+    """
+    if pdfium is None and PdfReader is not None and NEAR_DUPLICATE_SIMILARITY > 0:
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    return ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="pdf_probe")
+
+async def main():
     logger.info("--- Starting Batch Document Analysis ---")
 
     if not settings:
@@ -333,170 +740,71 @@ def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     logger.info(f"Output directory '{OUTPUT_DIR}' ensured.")
 
-    try:
-        openai_interface = OpenAIInteraction()
-        logger.info("OpenAI Interaction layer initialized.")
-    except Exception as e:
-        logger.error(f"Failed to initialize OpenAI Interaction: {e}", exc_info=True)
-        return
-
-    # Load local DB on startup (if configured) - this is for HybridRAGSystem
-    load_db_on_startup()
-    if get_local_db() is None and settings.ENABLE_LOCAL_RAG:
-        logger.warning("Local DB did not load successfully. Local RAG component might be unavailable.")
-    elif get_local_db() is not None:
-        logger.info(f"Local DB loaded with {len(get_local_db().documents)} documents.")
-
-    try:
-        rag_system = HybridRAGSystem(openai_interaction=openai_interface)
-        logger.info("Hybrid RAG System initialized.")
-    except Exception as e:
-        logger.error(f"Failed to initialize RAG System: {e}", exc_info=True)
-        return
-
-    pdf_files = [f for f in os.listdir(DOCUMENTS_FOLDER) if f.lower().endswith('.pdf')]
+    pdf_files = list(iter_pdf_files(DOCUMENTS_FOLDER))
     if not pdf_files:
         logger.warning(f"No PDF files found in '{DOCUMENTS_FOLDER}'. Exiting.")
         return
     logger.info(f"Found {len(pdf_files)} PDF documents to analyze.")
 
+    # One listing of the output folder replaces an exists() check per document (restarts skip most of them)
+    with os.scandir(OUTPUT_DIR) as entries:
+        existing_outputs = {entry.path for entry in entries}
+    pending_files = []
     for filename in pdf_files:
-        base_filename_no_ext = os.path.splitext(filename)[0]
-        output_json_path = os.path.join(OUTPUT_DIR, f"{base_filename_no_ext}.json")
-
-        if os.path.exists(output_json_path):
-            logger.info(f"Skipping '{filename}' as '{output_json_path}' already exists.")
-            continue
-
-        logger.info(f"\n--- Analyzing document: {filename} ---")
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            original_file_path = os.path.join(DOCUMENTS_FOLDER, filename)
-            temp_file_path = os.path.join(temp_dir, filename)
-
-            try:
-                shutil.copy2(original_file_path, temp_file_path)
-            except Exception as e:
-                logger.critical(f"Could not create temp copy for '{filename}': {e}. Skipping this document.", exc_info=True)
-                continue # Skip to next document instead of stopping script
-
-            # Unique session ID per document, incorporating timestamp
-            session_id = f"batch_analysis_{base_filename_no_ext.replace('.', '_')}_{int(time.time())}"
-            title = get_pdf_title(original_file_path, filename)
-            file_size_kb = os.path.getsize(original_file_path) // 1024 # Size in KB
-            upload_date_utc = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(os.path.getmtime(original_file_path)))
-
-            raw_analyses: Dict[str, Dict[str, Any]] = {} # Store text, and openai_sources (local sources explicitly excluded)
-            final_json_result = None
-
-            try:
-                logger.info(f"Uploading '{filename}' to OpenAI and processing locally for session {session_id}...")
-                success, message = rag_system.add_user_document_for_session(
-                    session_id=session_id, file_path=temp_file_path, original_filename=filename
-                )
-                if not success:
-                    raise Exception(f"Document processing failed: {message}")
-
-                # --- Generate analyses for standard FOCUS_AREAS ---
-                focus_description_map = {
-                    "general": "the overall equity implications, considering all relevant dimensions of the COEQWAL framework.",
-                    "vulnerable_groups": "how vulnerable groups are affected or mentioned.",
-                    "severity_of_impact": "the severity of the document's impacts on equity.",
-                    "mitigation_strategies": "strategies or solutions for equity concerns."
-                }
-                for focus in FOCUS_AREAS:
-                    logger.info(f"-> Generating raw analysis for focus: '{focus}'...")
-                    query_for_rag_system = ANALYSIS_QUERY_GENERIC.format(focus_description=focus_description_map.get(focus, "equity implications."))
-                    
-                    # NOTE: _ means local_chunks are discarded here as per requirement
-                    answer, _, openai_srcs = rag_system.answer_question(session_id=session_id, query=query_for_rag_system, focus_area=focus)
-                    
-                    if "Error:" in answer:
-                        logger.error(f"Received an error for standard focus '{focus}': {answer}. Marking as failed.")
-                        raw_analyses[focus] = {"text": f"ANALYSIS FAILED: {answer}", "openai_sources": openai_srcs}
-                    else:
-                        raw_analyses[focus] = {"text": answer, "openai_sources": openai_srcs}
-                    logger.info(f"Generated raw analysis for '{focus}'. Waiting for {DELAY_BETWEEN_REQUESTS_SECONDS}s...")
-                    time.sleep(DELAY_BETWEEN_REQUESTS_SECONDS)
-
-                # --- Generate analyses for each PERSPECTIVE ---
-                for perspective_info in PERSPECTIVES:
-                    perspective_group_key = perspective_info["group_name"].replace(" ", "_").lower()
-                    logger.info(f"-> Generating analysis for perspective: '{perspective_info['group_name']}'...")
-
-                    # General Equity Assessment for this perspective
-                    query_general_perspective = ANALYSIS_QUERY_GENERIC.format(focus_description=perspective_info['description'])
-                    answer_general, _, openai_srcs = rag_system.answer_question(session_id=session_id, query=query_general_perspective, focus_area="general") # Use general focus for retrieval
-                    if "Error:" in answer_general:
-                        logger.error(f"Error for perspective '{perspective_info['group_name']}' general analysis: {answer_general}. Marking as failed.")
-                        raw_analyses[f"perspective_{perspective_group_key}_general"] = {"text": f"ANALYSIS FAILED: {answer_general}", "openai_sources": openai_srcs}
-                    else:
-                        raw_analyses[f"perspective_{perspective_group_key}_general"] = {"text": answer_general, "openai_sources": openai_srcs}
-                    logger.info(f"Generated general analysis for '{perspective_info['group_name']}'. Waiting for {DELAY_BETWEEN_REQUESTS_SECONDS}s...")
-                    time.sleep(DELAY_BETWEEN_REQUESTS_SECONDS)
-
-                    # Individual Equity Dimensions for this perspective
-                    for dim in ["recognitional", "procedural", "distributional", "structural"]: # Only 4 dimensions
-                        prompt_description = perspective_info["dimensions"].get(dim)
-                        if prompt_description:
-                            query_dim_perspective = ANALYSIS_QUERY_GENERIC.format(focus_description=prompt_description)
-                            answer_dim, _, openai_srcs = rag_system.answer_question(session_id=session_id, query=query_dim_perspective, focus_area="general") # Use general focus for retrieval
-                            if "Error:" in answer_dim:
-                                logger.error(f"Error for perspective '{perspective_info['group_name']}' {dim} analysis: {answer_dim}. Marking as failed.")
-                                raw_analyses[f"perspective_{perspective_group_key}_{dim}"] = {"text": f"ANALYSIS FAILED: {answer_dim}", "openai_sources": openai_srcs}
-                            else:
-                                raw_analyses[f"perspective_{perspective_group_key}_{dim}"] = {"text": answer_dim, "openai_sources": openai_srcs}
-                            logger.info(f"Generated '{dim}' analysis for '{perspective_info['group_name']}'. Waiting for {DELAY_BETWEEN_REQUESTS_SECONDS}s...")
-                            time.sleep(DELAY_BETWEEN_REQUESTS_SECONDS)
-
-                # --- Synthesize all raw analyses text into final JSON structure (Python injects sources after) ---
-                final_json_result = format_analyses_into_json(raw_analyses, filename, title, file_size_kb, upload_date_utc, openai_interface.client)
-                if not final_json_result:
-                    raise Exception("Failed to synthesize the final JSON structure from raw analyses.")
-
-            except Exception as e:
-                logger.critical(f"A critical error occurred while processing '{filename}': {e}. Cleaning up and skipping this document.", exc_info=True)
-                # Attempt to save a partial/error JSON before cleaning up
-                # Use a simplified error structure that Python can easily populate
-                error_json_for_file = {
-                    "document": { "filename": filename, "title": title, "size_kb": file_size_kb, "upload_date_utc": upload_date_utc },
-                    "analysis_sections": { "general_equity_assessment": { "summary": f"Analysis failed due to critical error: {e}", "sources": [] } },
-                    "equity_analysis_by_perspective": [],
-                    "overall_summary_and_recommendations": { "key_equity_gaps": f"Due to critical error: {e}", "sources": [] }
-                }
-                # Even on critical failure, try to populate sources for any successful raw analyses
-                _populate_sources_into_json(error_json_for_file, raw_analyses)
-                
-                try:
-                    with open(output_json_path, 'w', encoding='utf-8') as f:
-                        json.dump(error_json_for_file, f, indent=2, ensure_ascii=False)
-                    logger.info(f"Error report saved to '{output_json_path}'.")
-                except Exception as write_e:
-                    logger.error(f"Failed to write error report for '{filename}': {write_e}")
-                # Ensure OpenAI resources are cleaned even if the analysis failed
-                logger.info(f"Cleaning up OpenAI resources for failed session '{session_id}'...")
-                rag_system.remove_user_session_resources(session_id, delete_openai_resources=True)
-                continue # Move to the next document
-
-            logger.info(f"Cleaning up OpenAI resources for session '{session_id}'...")
-            rag_system.remove_user_session_resources(session_id, delete_openai_resources=True)
-
-            try:
-                with open(output_json_path, 'w', encoding='utf-8') as f:
-                    json.dump(final_json_result, f, indent=2, ensure_ascii=False)
-                logger.info(f"Analysis for '{filename}' saved successfully to '{output_json_path}'.")
-            except Exception as e:
-                logger.critical(f"Could not write final JSON for '{filename}' to '{output_json_path}': {e}. Continuing to next document, but data might be lost.", exc_info=True)
-                continue # Continue to next document even if saving current fails
+        if _output_json_path(filename) in existing_outputs:
+            logger.info(f"Skipping '{filename}' as '{_output_json_path(filename)}' already exists.")
+        else:
+            pending_files.append(filename)
 
-    logger.info("\n--- Batch Analysis Complete ---")
+    # Stat, parse and hash every PDF in a worker pool while the clients and local DB initialize below
+    probe_executor = _make_probe_executor()
+    probe_futures = [probe_executor.submit(_probe_pdf, filename) for filename in pending_files]
+    try:
+        try:
+            openai_interface = OpenAIInteraction()
+            logger.info("OpenAI Interaction layer initialized.")
+        except Exception as e:
+            logger.error(f"Failed to initialize OpenAI Interaction: {e}", exc_info=True)
+            return
+
+        # Load local DB on startup (if configured) - this is for HybridRAGSystem
+        load_db_on_startup()
+        if get_local_db() is None:
+            logger.warning("Local DB did not load successfully. Local RAG component might be unavailable.")
+        elif get_local_db() is not None:
+            logger.info(f"Local DB loaded with {len(get_local_db().documents)} documents.")
+
+        try:
+            rag_system = HybridRAGSystem(openai_interaction=openai_interface)
+            logger.info("Hybrid RAG System initialized.")
+        except Exception as e:
+            logger.error(f"Failed to initialize RAG System: {e}", exc_info=True)
+            return
+
+        documents = [doc for doc in await asyncio.gather(*(asyncio.wrap_future(f) for f in probe_futures)) if doc is not None]
+        logger.info(f"{len(documents)}/{len(pdf_files)} PDF documents need analysis.")
+        if not documents:
+            return
+
+        analysis_cache = AnalysisCache(ANALYSIS_CACHE_PATH)
+        near_duplicates = None
+        local_db = get_local_db()
+        if NEAR_DUPLICATE_SIMILARITY > 0 and local_db is not None and local_db.model is not None:
+            near_duplicates = NearDuplicateFinder(local_db.model, settings.LOCAL_EMBEDDING_MODEL, analysis_cache, NEAR_DUPLICATE_SIMILARITY)
+        try:
+            await run_batch_pipeline(documents, rag_system, analysis_cache, near_duplicates)
+        finally:
+            analysis_cache.close()
+            # Also on failure, so sessions cancelled mid-batch don't leave vector stores / files behind
+            await rag_system.wait_for_pending_cleanups()
+        logger.info("\n--- Batch Analysis Complete ---")
+    finally:
+        probe_executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
-    # Ensure OUTPUT_DIR exists before starting
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
     # Check for necessary libraries for local processing.
-    if not PdfReader:
-        logger.warning("PyPDF2 is not installed. PDF title extraction will be limited. Run: pip install PyPDF2")
+    if not PdfReader and not pdfium:
+        logger.warning("Neither pypdfium2 nor PyPDF2 is installed. PDF title extraction will be limited. Run: pip install pypdfium2")
     # Note: `fitz`, `docx`, and `bs4` are used in `core/text_processing.py`.
     # This script (generate_batch_analysis.py) doesn't directly import/use them for chunking,
     # but `HybridRAGSystem` might rely on `process_document_to_chunks` from `text_processing`.
@@ -514,4 +822,4 @@ if __name__ == "__main__":
     except ImportError:
         logger.warning("BeautifulSoup4 is not installed. HTML document processing for local RAG might be basic.")
 
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
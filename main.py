@@ -1,20 +1,29 @@
 import os
-import uuid
+import re
+import asyncio
 import logging
+import logging.handlers
+import queue
 import secrets
+import hashlib
+import gzip
 from contextlib import asynccontextmanager
+from email.utils import formatdate
 import time
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Depends, status, Cookie, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Depends, status, Cookie
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
 from core.config import settings
+from core import json_utils
+from core.cache import TTLCache
 from core.openai_interaction import OpenAIInteraction
-from core.rag_system import HybridRAGSystem
+from core.rag_system import HybridRAGSystem, UserSession
 from core.local_db import load_db_on_startup, get_local_db
 from core import equity_analyzer
 from models.models import (
@@ -35,17 +44,55 @@ rag_system: HybridRAGSystem | None = None
 
 TEMP_UPLOAD_DIR = "temp_uploads"
 os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+MAX_TEMP_NAME_CHARS = 128
 
 ANALYSIS_OUTPUT_FOLDER = "analysis_results_json"
 os.makedirs(ANALYSIS_OUTPUT_FOLDER, exist_ok=True)
 
+_BLOCKQUOTE_TAG_RE = re.compile(r"</?blockquote>")
+_SSE_DONE_EVENT = 'data: {"type":"done"}\n\n' # Same for every stream, so encoded once
+
+# Backpressure for upload bursts: each ingestion holds its whole file in memory while uploading to OpenAI
+_ingest_slots = asyncio.Semaphore(max(1, getattr(settings, "MAX_CONCURRENT_UPLOADS", 4)))
+# Upload processing tasks, owned by the app rather than a request (strong references until they finish)
+_upload_jobs: set[asyncio.Task] = set()
+
+def _start_queued_logging() -> logging.handlers.QueueListener | None:
+    """
+    Moves the root logger's handlers (stream/file I/O) onto a listener thread; request code then only
+    enqueues records. Returns the listener, or None if there was nothing to move.
+    """
+    root = logging.getLogger()
+    handlers = [h for h in root.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    if not handlers:
+        return None
+    log_queue = queue.SimpleQueue()
+    for handler in handlers: root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def _stop_queued_logging(listener: logging.handlers.QueueListener | None) -> None:
+    """Flushes the queued records and puts the original handlers back on the root logger."""
+    if listener is None:
+        return
+    listener.stop()
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]: root.removeHandler(handler)
+    for handler in listener.handlers: root.addHandler(handler)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    log_listener = _start_queued_logging()
     logger.info("Application startup...")
     global openai_interface, rag_system
+    app.state.ready = False
     if not settings:
         logger.critical("Settings not loaded. Cannot initialize.")
         yield
+        _stop_queued_logging(log_listener)
         return
 
     try:
@@ -73,57 +120,370 @@ async def lifespan(app: FastAPI):
         logger.error("Cannot initialize RAG system because OpenAI Interaction failed.")
         rag_system = None
 
-    # Ensure ANALYSIS_OUTPUT_FOLDER exists on startup
-    os.makedirs(ANALYSIS_OUTPUT_FOLDER, exist_ok=True)
-    logger.info(f"Analysis output folder '{ANALYSIS_OUTPUT_FOLDER}' ensured.")
+    # Both components are fixed for the process lifetime, so readiness is decided once here
+    app.state.ready = bool(rag_system and openai_interface)
+
+    file_sweeper = asyncio.create_task(_sweep_discarded_files())
+    sweep_task = None
+    if rag_system and getattr(settings, "SESSION_IDLE_TIMEOUT_SECONDS", 0) > 0:
+        sweep_task = asyncio.create_task(_expire_idle_sessions(settings.SESSION_IDLE_TIMEOUT_SECONDS, settings.SESSION_SWEEP_INTERVAL_SECONDS))
+
+    # index.html has no per-request content, so it is rendered once rather than on every GET /
+    _render_index(app.state)
 
     logger.info("Startup complete.")
     yield
     logger.info("Application shutdown...")
-
-app = FastAPI(title="COEQWAL Analysis Bot", lifespan=lifespan)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+    if sweep_task: sweep_task.cancel()
+    if _upload_jobs:
+        # Unfinished uploads cannot complete after shutdown; cancelling runs their temp-file cleanup
+        logger.info(f"Cancelling {len(_upload_jobs)} unfinished upload processing tasks...")
+        for job in list(_upload_jobs): job.cancel()
+        await asyncio.gather(*_upload_jobs, return_exceptions=True)
+    # Cancelled uploads queue their temp files, so the sweeper is stopped after them and the queue drained here
+    file_sweeper.cancel()
+    await asyncio.to_thread(_remove_files, _take_discarded_files(None))
+    if rag_system:
+        await rag_system.wait_for_pending_cleanups()
+    _stop_queued_logging(log_listener)
+
+# orjson is optional; without it FastAPI's stdlib-based JSONResponse is kept
+DefaultJSONResponse = ORJSONResponse if json_utils.orjson is not None else JSONResponse
+
+GZIP_MINIMUM_SIZE = 1000 # Bytes; smaller bodies are not worth compressing
+GZIP_COMPRESS_LEVEL = 5 # Per-response compression (analysis JSON): nearly level 9's ratio at a fraction of the CPU
+_GZIP_BYPASS_PREFIXES = ("/query/stream", "/stream_analysis_status/") # SSE must flush per event; older Starlette would gzip-buffer it
+# Served already gzipped to clients that accept it; older Starlette's middleware would compress them a second time
+_PRECOMPRESSED_PREFIXES = ("/static/",)
+_PRECOMPRESSED_PATHS = ("/",) # The landing page (see read_root)
+_GZIP_MEDIA_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+def _accepts_gzip(headers) -> bool:
+    return "gzip" in headers.get("accept-encoding", "")
+
+def _serves_precompressed(scope) -> bool:
+    path = scope["path"]
+    return (path in _PRECOMPRESSED_PATHS or path.startswith(_PRECOMPRESSED_PREFIXES)) and _accepts_gzip(Request(scope).headers)
+
+class _GZipExceptStreams:
+    """GZipMiddleware for every response except the server-sent event streams and pre-compressed assets."""
+    def __init__(self, app, minimum_size: int = GZIP_MINIMUM_SIZE, compresslevel: int = GZIP_COMPRESS_LEVEL):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (scope["path"].startswith(_GZIP_BYPASS_PREFIXES) or _serves_precompressed(scope)):
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip_app(scope, receive, send)
+
+def _gzip_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return gzip.compress(f.read())
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that compresses each text asset once per version (path + mtime) and serves the cached
+    gzip bytes to clients that accept them, instead of the middleware re-compressing it on every hit.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._gzip_cache: dict[str, tuple[int, bytes]] = {}
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if (scope["method"] != "GET" or not isinstance(response, FileResponse) or response.status_code != 200
+                or response.stat_result is None or response.stat_result.st_size < GZIP_MINIMUM_SIZE
+                or not (response.media_type or "").startswith(_GZIP_MEDIA_TYPES)
+                or not _accepts_gzip(Request(scope).headers)):
+            return response
+        version = response.stat_result.st_mtime_ns
+        cached = self._gzip_cache.get(response.path)
+        if cached is None or cached[0] != version:
+            cached = (version, await asyncio.to_thread(_gzip_file, response.path))
+            self._gzip_cache[response.path] = cached
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        headers.update({"content-encoding": "gzip", "vary": "Accept-Encoding"})
+        return Response(content=cached[1], headers=headers)
+
+app = FastAPI(title="COEQWAL Analysis Bot", lifespan=lifespan, default_response_class=DefaultJSONResponse)
+# Compresses JSON API responses (e.g. /query answers with many local sources); pre-compressed assets bypass it
+app.add_middleware(_GZipExceptStreams, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 async def check_system_ready():
-    if not rag_system or not openai_interface:
+    if not app.state.ready:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Core system components are not initialized. Please check server logs."
         )
 
+async def get_tracked_session(session_id: str) -> UserSession:
+    """
+    Resolves the session_id path parameter to its tracked session (one lookup, which also marks it active),
+    or 404s. List it after check_system_ready so an uninitialized system still reports 503.
+    """
+    session_info = rag_system.touch_session(session_id) if rag_system else None
+    if not session_info:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Session {session_id} not found.")
+    return session_info
+
 async def get_session_id(session_id: str | None = Cookie(None)) -> str | None:
     if session_id is None: return None
     return session_id
 
+SESSION_COOKIE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
 async def ensure_session(response: Response, session_id: str | None = Cookie(None)) -> str:
      if session_id is None:
-         session_id = str(uuid.uuid4())
-         logger.info(f"New session started: {session_id}")
-         response.set_cookie(key="session_id", value=session_id, httponly=True, samesite='lax')
+         session_id = secrets.token_urlsafe(16)
+         logger.info("New session started: %s", session_id)
+         response.set_cookie(key="session_id", value=session_id, httponly=True, samesite='lax',
+                             max_age=SESSION_COOKIE_MAX_AGE_SECONDS)
      return session_id
 
+UPLOAD_COPY_CHUNK_BYTES = 1 << 20
+
+def _temp_upload_path(session_id: str, original_filename: str) -> str:
+    """
+    Temp path for an upload; the client-supplied name is reduced to a short, traversal-free basename.
+    A random part makes the path unique per upload, so a re-upload under the same name never overwrites
+    (or gets deleted along with) the file an earlier upload's background task is still processing.
+    """
+    safe_name = _UNSAFE_FILENAME_CHARS.sub("_", os.path.basename(original_filename))[:MAX_TEMP_NAME_CHARS]
+    return os.path.join(TEMP_UPLOAD_DIR, f"{session_id}_{secrets.token_hex(4)}_{safe_name}")
+
+def _save_upload(source, path: str) -> str:
+    """
+    Copies an upload's spooled file to path in fixed-size chunks (blocking; bounded memory for large PDFs),
+    hashing each chunk on the way through. Returns the hex digest of the content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    # One reusable buffer: each chunk is read into it in place instead of allocating a new bytes object
+    chunk = memoryview(bytearray(UPLOAD_COPY_CHUNK_BYTES))
+    source.seek(0)
+    with open(path, "wb") as buffer:
+        while size := source.readinto(chunk):
+            digest.update(chunk[:size])
+            buffer.write(chunk[:size])
+    return digest.hexdigest()
+
+def _is_duplicate_upload(session: UserSession | None, content_hash: str) -> bool:
+    """True if the session already holds (or is still processing) a successful upload of the same bytes."""
+    if session is None or session.content_hash != content_hash:
+        return False
+    return session.analysis_status != "failed" and not session.status.startswith("failed")
+
+# PDF titles keyed on (content hash, filename): the same document uploaded by other sessions skips the PDF parse
+PDF_TITLE_CACHE_SIZE = 1024
+_pdf_title_cache = TTLCache(PDF_TITLE_CACHE_SIZE)
+
+def _read_upload_metadata(path: str, original_filename: str, content_hash: str | None) -> tuple[str, os.stat_result]:
+    """Returns the PDF title (falling back to the filename) and the stat of a saved upload (blocking)."""
+    cache_key = (content_hash, original_filename)
+    title = _pdf_title_cache.get(cache_key) if content_hash else None
+    if title is None:
+        title = equity_analyzer.get_pdf_title(path, original_filename)
+        if content_hash: _pdf_title_cache.set(cache_key, title)
+    return title, os.stat(path)
+
+async def _safe_remove(path: str | None, context: str) -> bool:
+    """Deletes a file in a worker thread. Returns False only if it existed and could not be removed."""
+    if not path:
+        return True
+    try:
+        await asyncio.to_thread(os.remove, path)
+        logger.info("Deleted file (%s): %s", context, path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error("Could not remove file (%s) %s: %s", context, path, e)
+        return False
+    return True
+
+# Temp files nobody waits on (failed / abandoned uploads) are queued and deleted in batches by one sweeper task
+TEMP_SWEEP_BATCH_SIZE = 32
+_discarded_files: asyncio.Queue = asyncio.Queue()
+
+def _discard_file(path: str | None, context: str) -> None:
+    """Queues a file for deletion by the sweeper; returns immediately."""
+    if path: _discarded_files.put_nowait((path, context))
+
+def _take_discarded_files(limit: int | None) -> list[tuple[str, str]]:
+    batch = []
+    while not _discarded_files.empty() and (limit is None or len(batch) < limit):
+        batch.append(_discarded_files.get_nowait())
+    return batch
+
+def _remove_files(batch: list[tuple[str, str]]) -> None:
+    """Deletes a batch of queued files (blocking); missing files are fine, other errors are logged."""
+    for path, context in batch:
+        try:
+            os.remove(path)
+            logger.info("Deleted file (%s): %s", context, path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Could not remove file (%s) %s: %s", context, path, e)
+
+async def _sweep_discarded_files() -> None:
+    while True:
+        batch = [await _discarded_files.get()]
+        batch += _take_discarded_files(TEMP_SWEEP_BATCH_SIZE - 1) # Whatever else is already queued
+        await asyncio.to_thread(_remove_files, batch) # One worker-thread hop per batch
+
+DEV_RELOAD = os.getenv("DEV_RELOAD", "0") == "1"
+INDEX_TEMPLATE = "index.html"
+INDEX_TEMPLATE_PATH = os.path.join("templates", INDEX_TEMPLATE)
+
+def _render_index_bytes() -> tuple[bytes, bytes, int]:
+    """Renders index.html into encoded and gzip-compressed bytes, with the template's mtime (blocking)."""
+    mtime_ns = os.stat(INDEX_TEMPLATE_PATH).st_mtime_ns
+    html = templates.get_template(INDEX_TEMPLATE).render(request=None).encode("utf-8")
+    return html, gzip.compress(html), mtime_ns
+
+def _render_index(state) -> None:
+    """Renders index.html once onto app state."""
+    state.index_html, state.index_html_gzip, state.index_mtime_ns = _render_index_bytes()
+
+def _rerender_index_if_changed(mtime_ns: int) -> tuple[bytes, bytes, int] | None:
+    """_render_index_bytes() if the template changed since mtime_ns, else None (blocking)."""
+    return _render_index_bytes() if os.stat(INDEX_TEMPLATE_PATH).st_mtime_ns != mtime_ns else None
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    state = request.app.state
+    index_html = getattr(state, "index_html", None)
+    if index_html is None:
+        return templates.TemplateResponse(INDEX_TEMPLATE, {"request": request})
+    # Uvicorn's reloader only watches .py files, so in development template edits are picked up here;
+    # the stat and any re-render run in a worker thread, and the results are swapped in together on the loop
+    if DEV_RELOAD:
+        rendered = await asyncio.to_thread(_rerender_index_if_changed, state.index_mtime_ns)
+        if rendered is not None:
+            state.index_html, state.index_html_gzip, state.index_mtime_ns = rendered
+    if _accepts_gzip(request.headers):
+        # Compressed once at startup; requests for this path bypass the gzip middleware (_PRECOMPRESSED_PATHS)
+        return HTMLResponse(content=state.index_html_gzip,
+                            headers={"content-encoding": "gzip", "vary": "Accept-Encoding"})
+    return HTMLResponse(content=state.index_html)
+
+async def _end_session_resources(session_id: str, session_info: UserSession) -> bool:
+    """Stops tracking a session and deletes its OpenAI resources, temp upload and analysis JSON. False if any cleanup failed."""
+    # OpenAI deletions finish in the background; nobody needs to wait on them
+    success = await rag_system.remove_user_session_resources(session_id, delete_openai_resources=True, wait=False)
+    # Explicitly delete the temporary uploaded file if it still exists and wasn't cleaned by analyzer
+    if not await _safe_remove(session_info.temp_file_path, "lingering temporary file"):
+        success = False
+    # Also remove the generated analysis JSON file if it exists
+    if not await _safe_remove(session_info.analysis_result_path, "analysis JSON"):
+        success = False
+    return success
+
+async def _expire_idle_sessions(max_idle_seconds: int, interval_seconds: int) -> None:
+    """
+    Periodically ends sessions whose browser went away without calling /end-session, so their
+    OpenAI files / vector stores, temp files and in-memory state do not accumulate for the process lifetime.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        for session_id in rag_system.idle_session_ids(max_idle_seconds):
+            session_info = rag_system.user_sessions.get(session_id)
+            if session_info is None: continue
+            logger.info("Session %s idle for over %ss; ending it.", session_id, max_idle_seconds)
+            try:
+                await _end_session_resources(session_id, session_info)
+            except Exception as e:
+                logger.error("Failed to expire idle session %s: %s", session_id, e, exc_info=True)
+
+async def _fail_upload_session(session_id: str, error: str) -> None:
+    """
+    Marks a session's analysis as failed and releases its OpenAI resources after an upload error.
+    The session stays tracked so status polling reports the failure; /end-session removes it.
+    """
+    session = rag_system.user_sessions.get(session_id)
+    if session is None:
+        return
+    session.analysis_status = 'failed'
+    session.analysis_error = error
+    session.notify_status_change()
+    await rag_system.release_session_documents(session_id, wait=False)
+
+async def _ingest_and_analyze(session_id: str, session: UserSession, temp_file_path: str, original_filename: str) -> None:
+    """
+    Background half of /upload: uploads the saved file to OpenAI / the vector store, then runs the
+    equity analysis, which takes over (and deletes) the temp file. Failures are reported through the
+    session's analysis status, which the frontend polls.
+    """
+    analysis_started = False
+    try:
+        # add_user_document_for_session updates the session's 'file_id', 'vector_store_id' and 'status' directly.
+        # Uploads beyond MAX_CONCURRENT_UPLOADS wait here (still 'pending') rather than all running at once.
+        async with _ingest_slots:
+            if rag_system.user_sessions.get(session_id) is not session:
+                logger.info("Session %s ended before its upload was processed.", session_id)
+                return
+            success, message = await rag_system.add_user_document_for_session(
+                session_id=session_id,
+                file_path=temp_file_path,
+                original_filename=original_filename
+            )
+        if rag_system.user_sessions.get(session_id) is not session:
+            # The session was ended (or replaced by a new upload) while ingesting; drop what was just created
+            logger.info("Session %s ended during upload processing; discarding its OpenAI resources.", session_id)
+            await rag_system.release_session_documents(session_id, wait=False, session=session)
+            return
+        if not success:
+            await _fail_upload_session(session_id, message)
+            return
+
+        # PDF parsing and stat are blocking; do them together in one worker thread
+        title, file_stat = await asyncio.to_thread(_read_upload_metadata, temp_file_path, original_filename, session.content_hash)
+        if rag_system.user_sessions.get(session_id) is not session:
+            logger.info("Session %s ended before its analysis started.", session_id)
+            return
+        analysis_started = True
+        await equity_analyzer.perform_equity_analysis(
+            session_id=session_id,
+            temp_file_path=temp_file_path, # Pass the path to the temp file
+            original_filename=original_filename,
+            title=title,
+            file_size_kb=file_stat.st_size // 1024,
+            upload_date_utc=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(file_stat.st_mtime)),
+            rag_system_instance=rag_system, # Pass the global instance
+            openai_interface_instance=openai_interface, # Pass the global instance
+            session_info=session, # Updated in place; a replaced or ended session is never written to
+            analysis_output_dir=ANALYSIS_OUTPUT_FOLDER # Pass the configured output folder
+        )
+    except Exception as e:
+        logger.error("Unexpected error while processing upload for session %s: %s", session_id, e, exc_info=True)
+        await _fail_upload_session(session_id, str(e))
+    finally:
+        # Once the analysis starts it owns the temp file (equity_analyzer deletes it); otherwise delete it here
+        if not analysis_started:
+            _discard_file(temp_file_path, "temp upload, processing failed")
 
 @app.post("/upload",
           response_model=UploadResponse,
+          status_code=status.HTTP_202_ACCEPTED,
           responses={
               status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Core system not ready"},
-              status.HTTP_400_BAD_REQUEST: {"model": ErrorResponse, "description": "File processing failed"},
               status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse, "description": "Internal server error during upload"},
           })
 async def upload_document(
-    background_tasks: BackgroundTasks, # Inject BackgroundTasks
     response: Response,
     file: UploadFile = File(...),
     session_id: str | None = Depends(get_session_id),
     _=Depends(check_system_ready)
 ):
+    """
+    Saves the upload and returns 202 right away; the OpenAI upload, vector store indexing and equity
+    analysis run as a background task whose progress is reported by /get_analysis_status.
+    """
     active_session_id = await ensure_session(response, session_id)
     original_filename = file.filename or "uploaded_file"
-    temp_file_path = os.path.join(TEMP_UPLOAD_DIR, f"{active_session_id}_{original_filename}")
+    temp_file_path = _temp_upload_path(active_session_id, original_filename)
 
     # Ensure rag_system is available
     if rag_system is None:
@@ -132,108 +492,57 @@ async def upload_document(
             detail="RAG system not initialized. Cannot process upload."
         )
 
+    processing_scheduled = False
     try:
-        logger.info(f"Receiving file '{original_filename}' for session {active_session_id}")
+        logger.info("Receiving file '%s' for session %s", original_filename, active_session_id)
         # Save the file temporarily for processing
-        with open(temp_file_path, "wb") as buffer: content = await file.read(); buffer.write(content)
-        logger.info(f"Temporarily saved file to {temp_file_path}")
-
-        # --- CRITICAL CHANGE: Initialize session data HERE before calling rag_system.add_user_document_for_session ---
-        # This ensures the session exists in user_sessions before any background task or subsequent rag_system call.
-        rag_system.user_sessions[active_session_id] = {
-            "file_id": None, # Will be filled by add_user_document_for_session
-            "vector_store_id": None, # Will be filled by add_user_document_for_session
-            "original_filename": original_filename,
-            "status": "initial_upload_pending", # Specific status for main.py to track
-            "analysis_status": "pending", # Initial analysis status
-            "analysis_result_cached": None,
-            "analysis_result_path": None,
-            "analysis_error": None,
-            "temp_file_path": temp_file_path # Keep track of temp path for cleanup by analyzer
-        }
-
-        # Perform the initial document upload and vector store creation (this still takes time)
-        # rag_system.add_user_document_for_session will now update the 'file_id', 'vector_store_id', and 'status'
-        # fields within rag_system.user_sessions[active_session_id] directly.
-        success, message = rag_system.add_user_document_for_session(
-            session_id=active_session_id,
-            file_path=temp_file_path, # Pass temp_file_path for processing
-            original_filename=original_filename
-        )
-        
-        # After rag_system.add_user_document_for_session completes,
-        # get the updated status from the session_info
-        current_upload_status = rag_system.user_sessions[active_session_id].get("status", "unknown")
-
-
-        if current_upload_status == "completed": # Check the *actual* status from rag_system
-            # If upload and VS setup is successful, schedule the detailed analysis as a background task
-            background_tasks.add_task(
-                equity_analyzer.perform_equity_analysis,
-                session_id=active_session_id,
-                temp_file_path=temp_file_path, # Pass the path to the temp file
-                original_filename=original_filename,
-                title=equity_analyzer.get_pdf_title(temp_file_path, original_filename), # Get title here
-                file_size_kb=os.path.getsize(temp_file_path) // 1024,
-                upload_date_utc=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(os.path.getmtime(temp_file_path))),
-                rag_system_instance=rag_system, # Pass the global instance
-                openai_interface_instance=openai_interface, # Pass the global instance
-                user_sessions_dict=rag_system.user_sessions, # Pass the dict itself for updates
-                analysis_output_dir=ANALYSIS_OUTPUT_FOLDER # Pass the configured output folder
-            )
+        content_hash = await asyncio.to_thread(_save_upload, file.file, temp_file_path)
+        logger.info("Temporarily saved file to %s", temp_file_path)
+
+        existing_session = rag_system.user_sessions.get(active_session_id)
+        if _is_duplicate_upload(existing_session, content_hash):
+            # The bytes went to this upload's own temp file, which the finally below discards;
+            # the earlier upload's file, still in use by its task, was never touched
+            logger.info("Session %s re-uploaded identical content; reusing its existing processing.", active_session_id)
             return UploadResponse(
                 success=True,
-                message=message + " Detailed analysis started in the background.",
+                message=f"File '{original_filename}' was already received for this session; its processing continues.",
                 session_id=active_session_id,
-                filename=original_filename,
-                analysis_status="pending" # Frontend initial status
+                filename=existing_session.original_filename,
+                analysis_status=existing_session.analysis_status
             )
-        else:
-            # If initial upload/VS setup failed (status is not "completed"), update analysis_status to failed directly
-            # The 'message' from rag_system.add_user_document_for_session already explains the failure.
-            # The rag_system.user_sessions[active_session_id] should have been updated by rag_system itself.
-            rag_system.user_sessions[active_session_id]['analysis_status'] = 'failed'
-            rag_system.user_sessions[active_session_id]['analysis_error'] = message
-            
-            # Cleanup OpenAI resources and the temp file immediately if the *initial* upload/VS creation failed.
-            # rag_system.add_user_document_for_session will have tried to delete the file_id/vector_store_id if it failed
-            # midway. Here, we ensure everything is clean for a failed upload.
-            rag_system.remove_user_session_resources(active_session_id, delete_openai_resources=True)
-            
-            # This temp_file_path should ideally be handled by equity_analyzer's finally block,
-            # but if the analysis task *never starts* due to a pre-analysis failure, we need to delete it here.
-            if os.path.exists(temp_file_path):
-                try: os.remove(temp_file_path); logger.info(f"Cleaned temp file on failed upload: {temp_file_path}")
-                except OSError: logger.error(f"Could not remove temp file on failed upload: {temp_file_path}")
-
-            status_code = status.HTTP_400_BAD_REQUEST # Assume client error for failed upload/VS
-            raise HTTPException(status_code=status_code, detail=message)
-    except HTTPException as e:
-         # HTTPExceptions are re-raised immediately, so ensure cleanup before raising
-         if active_session_id in rag_system.user_sessions:
-             rag_system.user_sessions[active_session_id]['analysis_status'] = 'failed'
-             rag_system.user_sessions[active_session_id]['analysis_error'] = str(e.detail)
-             # Attempt to clean up resources related to the session as it failed early
-             rag_system.remove_user_session_resources(active_session_id, delete_openai_resources=True)
-         
-         # Clean up temp file if it's still lingering and not managed elsewhere
-         if os.path.exists(temp_file_path):
-            try: os.remove(temp_file_path); logger.info(f"Cleaned temp file on HTTPException: {temp_file_path}")
-            except OSError: logger.error(f"Could not remove temp file on HTTPException: {temp_file_path}")
-         raise e
+
+        # Initialize session data before scheduling, so status polling finds the session immediately.
+        # file_id / vector_store_id / status are filled in by add_user_document_for_session
+        session = UserSession(
+            original_filename=original_filename,
+            temp_file_path=temp_file_path, # Keep track of temp path for cleanup by analyzer
+            content_hash=content_hash
+        )
+        rag_system.user_sessions[active_session_id] = session
+
+        # Scheduled on the event loop directly rather than as a response BackgroundTask, so the work is not
+        # tied to this request's lifecycle and shutdown can cancel it
+        job = asyncio.create_task(_ingest_and_analyze(active_session_id, session, temp_file_path, original_filename))
+        _upload_jobs.add(job)
+        job.add_done_callback(_upload_jobs.discard)
+        processing_scheduled = True
+        return UploadResponse(
+            success=True,
+            message=f"File '{original_filename}' received. Document processing and detailed analysis started in the background.",
+            session_id=active_session_id,
+            filename=original_filename,
+            analysis_status="pending" # Frontend initial status
+        )
     except Exception as e:
-         logger.error(f"Unexpected error during upload for session {active_session_id}: {e}", exc_info=True)
-         if active_session_id in rag_system.user_sessions:
-             rag_system.user_sessions[active_session_id]['analysis_status'] = 'failed'
-             rag_system.user_sessions[active_session_id]['analysis_error'] = str(e)
-             # Attempt to clean up resources related to the session as it failed early
-             rag_system.remove_user_session_resources(active_session_id, delete_openai_resources=True)
-         
-         # Clean up temp file if it's still lingering and not managed elsewhere
-         if os.path.exists(temp_file_path):
-            try: os.remove(temp_file_path); logger.info(f"Cleaned temp file on unexpected error: {temp_file_path}")
-            except OSError: logger.error(f"Could not remove temp file on unexpected error: {temp_file_path}")
+         logger.error("Unexpected error during upload for session %s: %s", active_session_id, e, exc_info=True)
+         await _fail_upload_session(active_session_id, str(e))
          raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error during upload initiation.")
+    finally:
+         # Once processing is scheduled the background task owns the temp file;
+         # if it never starts, nothing else will delete it, so do it here.
+         if not processing_scheduled:
+             _discard_file(temp_file_path, "temp upload, upload failed")
 
 @app.post("/query",
           response_model=QueryResponse,
@@ -250,15 +559,15 @@ async def handle_query(
     focus_area = query_req.focus_area
     custom_instructions = query_req.custom_instructions
 
-    logger.info(f"Received query for session {session_id}, focus '{focus_area}': '{query[:100]}...'")
+    logger.info("Received query for session %s, focus '%s': '%.100s...'", session_id, focus_area, query)
     if custom_instructions:
-        logger.info(f"Custom instructions provided: '{custom_instructions[:100]}...'")
-    if session_id not in rag_system.user_sessions:
-         logger.warning(f"Query for session {session_id}, but no document info in RAG system. Local context only.")
+        logger.info("Custom instructions provided: '%.100s...'", custom_instructions)
+    if rag_system.touch_session(session_id) is None:
+         logger.warning("Query for session %s, but no document info in RAG system. Local context only.", session_id)
 
     try:
         # Call the analysis function ONCE and store all three results
-        answer, local_sources, openai_sources = rag_system.answer_question(
+        answer, local_sources, openai_sources = await rag_system.answer_question(
             session_id=session_id,
             query=query,
             focus_area=focus_area,
@@ -266,26 +575,53 @@ async def handle_query(
         )
         cleaned_answer = answer.strip() if answer else "No answer generated."
         
-        # Log the exact data being sent back for debugging
-        logger.info("--- DATA TO BE SENT TO FRONTEND ---")
-        logger.info(f"Answer length: {len(cleaned_answer)}")
-        logger.info(f"OpenAI Sources found: {len(openai_sources)}")
-        for i, source in enumerate(openai_sources):
-            clean_source = source.replace('</blockquote>', '').replace('<blockquote>', ' ').strip()
-            logger.info(f"  Source {i+1}: {clean_source}")
-        logger.info("------------------------------------")
+        # Log what is sent back for debugging, as one record (skipped entirely when INFO is filtered out)
+        if logger.isEnabledFor(logging.INFO):
+            clean_sources = [_BLOCKQUOTE_TAG_RE.sub(" ", source).strip() for source in openai_sources]
+            logger.info("Query response: answer length %s, %s OpenAI sources: %r", len(cleaned_answer), len(clean_sources), clean_sources)
         
-        return QueryResponse(
-            answer=cleaned_answer,
-            local_sources=local_sources,
-            openai_sources=openai_sources
-        )
+        # Built server-side from trusted data, so it is returned as a response object: FastAPI then skips
+        # re-validating every local source chunk against response_model (kept for the OpenAPI schema)
+        return DefaultJSONResponse(content={
+            "answer": cleaned_answer,
+            "local_sources": local_sources,
+            "openai_sources": openai_sources
+        })
 
     except Exception as e:
-        logger.error(f"Error during query processing for session {session_id}: {e}", exc_info=True)
+        logger.error("Error during query processing for session %s: %s", session_id, e, exc_info=True)
         detail = str(e) if "Error:" in str(e) else "Internal server error during query processing."
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=detail)
 
+@app.post("/query/stream",
+          responses={
+              status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Core system not ready"},
+          })
+async def handle_query_stream(
+    query_req: QueryRequest,
+    _=Depends(check_system_ready)
+):
+    """Same as /query, but streams the answer as Server-Sent Events (delta, sources, error, done)."""
+    session_id = query_req.session_id
+    logger.info("Received streaming query for session %s, focus '%s': '%.100s...'", session_id, query_req.focus_area, query_req.query)
+    rag_system.touch_session(session_id)
+
+    async def event_stream():
+        async for event in rag_system.stream_answer(
+            session_id=session_id,
+            query=query_req.query,
+            focus_area=query_req.focus_area,
+            custom_instructions=query_req.custom_instructions
+        ):
+            yield f"data: {json_utils.dumps(event)}\n\n"
+        yield _SSE_DONE_EVENT
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/end-session",
           response_model=EndSessionResponse,
           responses={
@@ -298,7 +634,7 @@ async def end_session(
     _=Depends(check_system_ready)
 ):
     session_id = end_req.session_id
-    logger.info(f"Received request to end session and clean up resources for: {session_id}")
+    logger.info("Received request to end session and clean up resources for: %s", session_id)
 
     # Ensure rag_system is available
     if rag_system is None:
@@ -310,35 +646,13 @@ async def end_session(
     # Check if session exists in user_sessions
     session_info = rag_system.user_sessions.get(session_id)
     if not session_info:
-        logger.warning(f"Request to end session {session_id}, but it was not found in active sessions or already cleaned up.")
+        logger.warning("Request to end session %s, but it was not found in active sessions or already cleaned up.", session_id)
         # Attempt to delete cookie even if session not found on backend
         response.delete_cookie(key="session_id")
         return EndSessionResponse(success=True, message="Session not found or already cleaned up.")
 
     try:
-        # Pass the temp_file_path to remove_user_session_resources for comprehensive cleanup
-        temp_file_to_delete = session_info.get("temp_file_path")
-        
-        success = rag_system.remove_user_session_resources(session_id, delete_openai_resources=True)
-        
-        # Explicitly delete the temporary uploaded file if it still exists and wasn't cleaned by analyzer
-        if temp_file_to_delete and os.path.exists(temp_file_to_delete):
-            try:
-                os.remove(temp_file_to_delete)
-                logger.info(f"Deleted lingering temporary file: {temp_file_to_delete}")
-            except OSError as e:
-                logger.error(f"Error deleting lingering temporary file {temp_file_to_delete}: {e}")
-                success = False # Mark overall success as false if file deletion failed
-
-        # Also remove the generated analysis JSON file if it exists
-        analysis_json_path = session_info.get("analysis_result_path")
-        if analysis_json_path and os.path.exists(analysis_json_path):
-            try:
-                os.remove(analysis_json_path)
-                logger.info(f"Deleted analysis JSON file: {analysis_json_path}")
-            except OSError as e:
-                logger.error(f"Error deleting analysis JSON file {analysis_json_path}: {e}")
-                success = False
+        success = await _end_session_resources(session_id, session_info)
 
         if success:
             message = "Session ended and associated resources cleaned up successfully."
@@ -349,12 +663,12 @@ async def end_session(
             message = "Session ended, but an error occurred during resource cleanup on the backend. Check server logs."
             logger.error(message + f" (Session ID: {session_id})")
             response.delete_cookie(key="session_id")
-            return JSONResponse(
+            return DefaultJSONResponse(
                  status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                  content={"success": False, "message": message}
             )
     except Exception as e:
-        logger.error(f"Unexpected error during session end for {session_id}: {e}", exc_info=True)
+        logger.error("Unexpected error during session end for %s: %s", session_id, e, exc_info=True)
         response.delete_cookie(key="session_id")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An internal server error occurred while ending the session.")
 
@@ -363,22 +677,76 @@ async def end_session(
              status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "Session not found"},
              status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Core system not ready"},
          })
-async def get_analysis_status(session_id: str, _=Depends(check_system_ready)):
-    if rag_system is None:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="RAG system not initialized.")
-
-    session_info = rag_system.user_sessions.get(session_id)
-    if not session_info:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Session {session_id} not found.")
-    
+async def get_analysis_status(request: Request, response: Response, session_id: str, _=Depends(check_system_ready),
+                              session_info: UserSession = Depends(get_tracked_session)):
+    # Polled until the analysis finishes; unchanged polls get an empty 304 instead of the same JSON again
+    etag = _etag(session_id, session_info.analysis_status, session_info.analysis_result_path, session_info.analysis_error)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    response.headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+    return _analysis_status_response(session_id, session_info)
+
+def _etag(*parts) -> str:
+    # Weak, as the gzip middleware may re-encode the body; blake2b is the fastest of hashlib's digests here
+    return 'W/"%s"' % hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=8).hexdigest()
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match: return False
+    opaque_tag = etag.removeprefix("W/") # If-None-Match uses weak comparison
+    return any(tag.strip().removeprefix("W/") in ("*", opaque_tag) for tag in if_none_match.split(","))
+
+def _not_modified(etag: str, headers: dict | None = None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "no-cache", **(headers or {})})
+
+def _analysis_status_response(session_id: str, session_info: UserSession) -> AnalysisStatusResponse:
     return AnalysisStatusResponse(
         session_id=session_id,
-        analysis_status=session_info.get("analysis_status", "unknown"),
-        message=f"Analysis status for session {session_id} is {session_info.get('analysis_status', 'unknown')}.",
-        analysis_result_path=session_info.get("analysis_result_path"),
-        analysis_error=session_info.get("analysis_error")
+        analysis_status=session_info.analysis_status,
+        message=f"Analysis status for session {session_id} is {session_info.analysis_status}.",
+        analysis_result_path=session_info.analysis_result_path,
+        analysis_error=session_info.analysis_error
+    )
+
+STATUS_STREAM_KEEPALIVE_SECONDS = 15 # Comment lines keep proxies from closing an idle stream
+_TERMINAL_ANALYSIS_STATUSES = ("completed", "failed")
+
+@app.get("/stream_analysis_status/{session_id}",
+         responses={
+             status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "Session not found"},
+             status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Core system not ready"},
+         })
+async def stream_analysis_status(session_id: str, _=Depends(check_system_ready), session_info: UserSession = Depends(get_tracked_session)):
+    """
+    Server-Sent Events version of /get_analysis_status: sends the current status, then one event per
+    change, and ends after 'completed' or 'failed' (or when the session ends). One open connection
+    replaces a poll every few seconds; /get_analysis_status stays for clients that cannot stream.
+    """
+    async def event_stream():
+        while rag_system.user_sessions.get(session_id) is session_info:
+            changed = session_info.status_changed # Taken before reading, so no change can slip past
+            payload = _analysis_status_response(session_id, session_info)
+            yield f"data: {json_utils.dumps(payload.model_dump())}\n\n"
+            if payload.analysis_status in _TERMINAL_ANALYSIS_STATUSES:
+                return
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=STATUS_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+_ANALYSIS_RESULT_MESSAGE_JSON = json_utils.dumps_bytes("Analysis completed and retrieved successfully.")
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
 @app.get("/get_analysis_result/{session_id}", response_model=AnalysisResultResponse,
          responses={
              status.HTTP_404_NOT_FOUND: {"model": ErrorResponse, "description": "Session or analysis not found"},
@@ -386,51 +754,62 @@ async def get_analysis_status(session_id: str, _=Depends(check_system_ready)):
              status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse, "description": "Error retrieving analysis"},
              status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ErrorResponse, "description": "Core system not ready"},
          })
-async def get_analysis_result(session_id: str, _=Depends(check_system_ready)):
-    if rag_system is None:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="RAG system not initialized.")
-
-    session_info = rag_system.user_sessions.get(session_id)
-    if not session_info:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Session {session_id} not found.")
-
-    analysis_status = session_info.get("analysis_status")
+async def get_analysis_result(request: Request, session_id: str, raw: bool = False, _=Depends(check_system_ready),
+                              session_info: UserSession = Depends(get_tracked_session)):
+    """
+    Returns the completed analysis wrapped in AnalysisResultResponse. With ?raw=1 the analysis JSON file
+    itself is sent as-is (FileResponse, no envelope). Carries an ETag from the file's stat, so a client
+    revalidating with If-None-Match gets a 304 without the file being read again.
+    """
+    analysis_status = session_info.analysis_status
     if analysis_status != "completed":
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, # 409 Conflict indicates the request cannot be completed due to the current state.
-            detail=f"Analysis for session {session_id} is not yet completed. Current status: {analysis_status}. Error: {session_info.get('analysis_error', 'N/A')}"
+            detail=f"Analysis for session {session_id} is not yet completed. Current status: {analysis_status}. Error: {session_info.analysis_error or 'N/A'}"
         )
     
-    analysis_data = session_info.get("analysis_result_cached")
-    analysis_path = session_info.get("analysis_result_path")
+    analysis_path = session_info.analysis_result_path
 
-    if analysis_data is None and analysis_path and os.path.exists(analysis_path):
-        try:
-            with open(analysis_path, 'r', encoding='utf-8') as f:
-                analysis_data = json.load(f)
-            # Optionally cache it for future quick access
-            session_info['analysis_result_cached'] = analysis_data
-        except (FileNotFoundError, json.JSONDecodeError, Exception) as e:
-            logger.error(f"Error loading analysis result from file {analysis_path} for session {session_id}: {e}", exc_info=True)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Could not load analysis result from file: {e}")
-    elif analysis_data is None and (analysis_path is None or not os.path.exists(analysis_path)):
-         logger.error(f"Analysis result not found in cache or file for session {session_id}. Path: {analysis_path}")
-         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Analysis result not found.")
-
-
-    return AnalysisResultResponse(
-        session_id=session_id,
-        analysis_status="completed",
-        analysis_data=analysis_data,
-        message="Analysis completed and retrieved successfully."
-    )  
+    # Not pinned in session memory: the file is re-read per request and stays hot in the OS page cache.
+    # One read attempt instead of exists() + read; a missing file surfaces as FileNotFoundError
+    try:
+        if not analysis_path:
+            raise FileNotFoundError(analysis_path)
+        file_stat = await asyncio.to_thread(os.stat, analysis_path)
+        etag = _etag(session_id, analysis_path, file_stat.st_mtime_ns, file_stat.st_size, raw)
+        cache_headers = {"Last-Modified": formatdate(file_stat.st_mtime, usegmt=True)}
+        if _etag_matches(request, etag):
+            return _not_modified(etag, cache_headers)
+        cache_headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+        if raw:
+            return FileResponse(analysis_path, media_type="application/json", stat_result=file_stat, headers=cache_headers)
+        analysis_json = await asyncio.to_thread(_read_bytes, analysis_path)
+    except FileNotFoundError:
+        logger.error("Analysis result file not found for session %s. Path: %s", session_id, analysis_path)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Analysis result not found.")
+    except Exception as e:
+        logger.error("Error loading analysis result from file %s for session %s: %s", analysis_path, session_id, e, exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Could not load analysis result from file: {e}")
+
+    # The file is JSON we wrote atomically ourselves, so its bytes are spliced into the AnalysisResultResponse
+    # envelope as-is instead of being parsed and re-serialized (response_model stays for the OpenAPI schema)
+    body = b"".join((
+        b'{"session_id":', json_utils.dumps_bytes(session_id),
+        b',"analysis_status":"completed","analysis_data":', analysis_json,
+        b',"message":', _ANALYSIS_RESULT_MESSAGE_JSON, b"}",
+    ))
+    return Response(content=body, media_type="application/json", headers=cache_headers)
 
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def health_check():
-    if rag_system and openai_interface: return {"status": "ok", "rag_system_initialized": True, "openai_initialized": True}
-    else: return {"status": "degraded", "rag_system_initialized": bool(rag_system), "openai_initialized": bool(openai_interface)}
+    local_db_warm = bool(rag_system and rag_system.is_ready())
+    if app.state.ready: return {"status": "ok", "rag_system_initialized": True, "openai_initialized": True, "local_db_warm": local_db_warm}
+    else: return {"status": "degraded", "rag_system_initialized": bool(rag_system), "openai_initialized": bool(openai_interface), "local_db_warm": local_db_warm}
 
 if __name__ == "__main__":
     import uvicorn
-    logger.info("Starting Uvicorn server for local development...")
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True, log_level="info")
\ No newline at end of file
+    # Single worker on purpose: sessions (and their OpenAI resources / analysis state) live in this
+    # process's memory, so requests for one session must all reach the same process.
+    # Auto-reload re-imports the app on every file change; opt in with DEV_RELOAD=1 while developing.
+    logger.info(f"Starting Uvicorn server (reload={DEV_RELOAD})...")
+    uvicorn.run("main:app", host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")), reload=DEV_RELOAD, log_level="info")
\ No newline at end of file
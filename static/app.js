@@ -24,6 +24,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // --- NEW: Analysis Polling Variables ---
   let analysisPollingTimer = null;
+  let analysisStatusSource = null; // EventSource for pushed status changes
   const ANALYSIS_POLLING_INTERVAL_MS = 5000; // Poll every 5 seconds for analysis status
   let analysisResultFetched = false;
 
@@ -89,10 +90,7 @@ document.addEventListener("DOMContentLoaded", () => {
     cleanupStatus.textContent = "";
     fileInput.value = "";
     analysisFocusSelect.value = "general";
-    if (analysisPollingTimer) {
-      clearInterval(analysisPollingTimer);
-      analysisPollingTimer = null;
-    }
+    stopAnalysisWatch();
     analysisResultFetched = false; // NEW: Reset this flag
     setProcessingState(false);
   }
@@ -131,12 +129,71 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  function stopAnalysisWatch() {
+    if (analysisPollingTimer) {
+      clearInterval(analysisPollingTimer);
+      analysisPollingTimer = null;
+    }
+    if (analysisStatusSource) {
+      analysisStatusSource.close();
+      analysisStatusSource = null;
+    }
+  }
+
+  function isWatchingAnalysis() {
+    return analysisPollingTimer !== null || analysisStatusSource !== null;
+  }
+
+  // Applies one analysis status update, whether it was pushed over the stream or fetched by polling
+  function handleAnalysisStatus(sessionId, result) {
+    uploadStatus.textContent = `Analysis Status: ${result.analysis_status.replace(/_/g, ' ')}`;
+    uploadStatus.style.color = "#666";
+
+    if (result.analysis_status === "completed") {
+        stopAnalysisWatch(); // CRITICAL: Stop watching FIRST
+        addMessage("Analysis completed successfully on server. Preparing to display results...", "status");
+        uploadStatus.textContent = `✅ Analysis Complete: "${result.message}"`;
+        uploadStatus.style.color = "green";
+        // Call displayAnalysisResult. It will handle the final processing state update.
+        displayAnalysisResult(sessionId);
+    } else if (result.analysis_status === "failed") {
+        stopAnalysisWatch();
+        addMessage(`Detailed analysis failed: ${result.analysis_error || result.message || "Unknown error"}`, "status");
+        uploadStatus.textContent = `❌ Analysis Failed: ${result.analysis_error || result.message || "Unknown error"}`;
+        uploadStatus.style.color = "red";
+        setProcessingState(false, true);
+    } else {
+        addMessage(`Analysis in progress (${result.analysis_status})... Please wait.`, "status");
+        setProcessingState(true, true);
+    }
+  }
+
+  // Status changes are pushed over Server-Sent Events; polling is the fallback when the stream is unavailable
+  function watchAnalysisStatus(sessionId) {
+    if (!window.EventSource) {
+      startAnalysisPolling(sessionId);
+      return;
+    }
+    analysisStatusSource = new EventSource(`/stream_analysis_status/${sessionId}`);
+    analysisStatusSource.onmessage = (event) => handleAnalysisStatus(sessionId, JSON.parse(event.data));
+    analysisStatusSource.onerror = () => {
+      // Terminal statuses close the stream before the server ends it, so this is a real failure
+      if (!analysisStatusSource) return;
+      stopAnalysisWatch();
+      if (!analysisResultFetched) startAnalysisPolling(sessionId);
+    };
+  }
+
+  function startAnalysisPolling(sessionId) {
+    analysisPollingTimer = setInterval(() => pollAnalysisStatus(sessionId), ANALYSIS_POLLING_INTERVAL_MS);
+    pollAnalysisStatus(sessionId); // Initial immediate poll
+  }
+
   // --- MODIFIED: Polling function for analysis status ---
   async function pollAnalysisStatus(sessionId) {
     // If a result has been successfully fetched, stop polling and don't re-enter.
     if (analysisResultFetched) {
-        clearInterval(analysisPollingTimer);
-        analysisPollingTimer = null;
+        stopAnalysisWatch();
         return; 
     }
 
@@ -147,40 +204,17 @@ document.addEventListener("DOMContentLoaded", () => {
         if (!response.ok) {
             console.error("Polling error:", result);
             addMessage(`Analysis status check failed: ${result.message || "Server error"}`, "status");
-            clearInterval(analysisPollingTimer);
-            analysisPollingTimer = null;
+            stopAnalysisWatch();
             setProcessingState(false, true);
             return;
         }
 
-        uploadStatus.textContent = `Analysis Status: ${result.analysis_status.replace(/_/g, ' ')}`;
-        uploadStatus.style.color = "#666";
-
-        if (result.analysis_status === "completed") {
-            clearInterval(analysisPollingTimer); // CRITICAL: Stop polling FIRST
-            analysisPollingTimer = null; // Set to null immediately
-            addMessage("Analysis completed successfully on server. Preparing to display results...", "status");
-            uploadStatus.textContent = `✅ Analysis Complete: "${result.message}"`;
-            uploadStatus.style.color = "green";
-            // Call displayAnalysisResult. It will handle the final processing state update.
-            displayAnalysisResult(sessionId);
-        } else if (result.analysis_status === "failed") {
-            clearInterval(analysisPollingTimer);
-            analysisPollingTimer = null;
-            addMessage(`Detailed analysis failed: ${result.analysis_error || result.message || "Unknown error"}`, "status");
-            uploadStatus.textContent = `❌ Analysis Failed: ${result.analysis_error || result.message || "Unknown error"}`;
-            uploadStatus.style.color = "red";
-            setProcessingState(false, true);
-        } else {
-            addMessage(`Analysis in progress (${result.analysis_status})... Please wait.`, "status");
-            setProcessingState(true, true);
-        }
+        handleAnalysisStatus(sessionId, result);
 
     } catch (error) {
         console.error("Network error during analysis status polling:", error);
         addMessage("Network error during analysis status check. Please check your connection.", "status");
-        clearInterval(analysisPollingTimer);
-        analysisPollingTimer = null;
+        stopAnalysisWatch();
         setProcessingState(false, true);
     }
   }
@@ -275,9 +309,8 @@ document.addEventListener("DOMContentLoaded", () => {
         uploadStatus.textContent = `Uploading complete. Analysis status: ${result.analysis_status.replace(/_/g, ' ')}`;
         uploadStatus.style.color = "#666";
 
-        // Start polling for analysis status
-        analysisPollingTimer = setInterval(() => pollAnalysisStatus(currentSessionId), ANALYSIS_POLLING_INTERVAL_MS);
-        pollAnalysisStatus(currentSessionId); // Initial immediate poll
+        // Start watching the analysis status
+        watchAnalysisStatus(currentSessionId);
 
         // Keep query input disabled until analysis is complete
         setProcessingState(true, true); // Still processing, analysis is running
@@ -300,8 +333,8 @@ document.addEventListener("DOMContentLoaded", () => {
     const query = queryInput.value.trim();
     const focusAreaValue = analysisFocusSelect.value;
     // Ensure analysis is complete before allowing queries
-    if (!query || !currentSessionId || isProcessing || !focusAreaValue || analysisPollingTimer) {
-      // If analysisPollingTimer is active, analysis is still running
+    if (!query || !currentSessionId || isProcessing || !focusAreaValue || isWatchingAnalysis()) {
+      // While the status is still being watched, analysis is still running
       addMessage("Please wait for the detailed analysis to complete before asking questions.", "status");
       return;
     }
@@ -325,8 +358,8 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     try {
-      console.log("SUBMITTING QUERY: Sending payload to /query:", payload);
-      const response = await fetch("/query", {
+      console.log("SUBMITTING QUERY: Sending payload to /query/stream:", payload);
+      const response = await fetch("/query/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(payload),
@@ -339,21 +372,53 @@ document.addEventListener("DOMContentLoaded", () => {
         throw new Error(errorMsg);
       }
 
-      const result = await response.json();
-      console.log("QUERY RESULT (PARSED JSON):", result);
+      // Render the answer progressively as Server-Sent Events arrive
+      addMessage("", "bot");
+      const answerDiv = chatbox.lastElementChild.querySelector(".content");
+      let answerText = "";
+      let openaiSources = [];
+      let streamError = null;
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop(); // Keep any partial event for the next read
+        for (const rawEvent of events) {
+          if (!rawEvent.startsWith("data: ")) continue;
+          const event = JSON.parse(rawEvent.slice(6));
+          if (event.type === "delta") {
+            answerText += event.text;
+            answerDiv.innerHTML = answerText.replace(/\n/g, "<br>");
+            chatbox.scrollTop = chatbox.scrollHeight;
+          } else if (event.type === "sources") {
+            openaiSources = event.openai_sources || [];
+          } else if (event.type === "error") {
+            streamError = event.detail;
+          }
+        }
+      }
+
+      if (streamError) {
+        if (!answerText) chatbox.lastElementChild.remove();
+        throw new Error(streamError);
+      }
+      if (!answerText) answerDiv.textContent = "No answer generated.";
 
-      addMessage(result.answer, "bot");
-      
       // Display OpenAI sources if available
-      if (result.openai_sources && Array.isArray(result.openai_sources) && result.openai_sources.length > 0) {
-        console.log(`SUCCESS: Found ${result.openai_sources.length} OpenAI sources. Creating display element...`);
+      if (openaiSources.length > 0) {
+        console.log(`SUCCESS: Found ${openaiSources.length} OpenAI sources. Creating display element...`);
         const sourcesContainer = document.createElement("div");
         sourcesContainer.classList.add("bot-sources");
         const title = document.createElement("strong");
         title.textContent = "Sources from your document:";
         sourcesContainer.appendChild(title);
 
-        result.openai_sources.forEach((sourceHTML) => {
+        openaiSources.forEach((sourceHTML) => {
           console.log("  - Adding source:", sourceHTML);
           const sourceElement = document.createElement("div");
           sourceElement.innerHTML = sourceHTML;
@@ -363,12 +428,7 @@ document.addEventListener("DOMContentLoaded", () => {
         chatbox.appendChild(sourcesContainer);
         chatbox.scrollTop = chatbox.scrollHeight;
       } else {
-        console.warn("WARNING: 'openai_sources' key was not found or the array is empty in the response from the server.", "Received value:", result.openai_sources);
-      }
-      
-      // Local sources are now typically excluded from results, but keeping the log for robustness
-      if (result.local_sources && result.local_sources.length > 0) {
-        console.log("Local COEQWAL sources retrieved (not displayed):", result.local_sources);
+        console.warn("WARNING: No OpenAI sources were received from the server stream.");
       }
 
     } catch (error) {
@@ -391,11 +451,8 @@ document.addEventListener("DOMContentLoaded", () => {
     cleanupStatus.textContent = "Cleaning up...";
     cleanupStatus.style.color = "#666";
     
-    // Clear any active polling timer
-    if (analysisPollingTimer) {
-      clearInterval(analysisPollingTimer);
-      analysisPollingTimer = null;
-    }
+    // Stop watching the analysis status (stream or polling timer)
+    stopAnalysisWatch();
 
     try {
       const response = await fetch("/end-session", {